@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-memory registry for static files the bot serves repeatedly.
+"""
+import os
+import threading
+from time import monotonic
+
+
+# Default loader: Reads a text file as a whole
+def read_text(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+class AssetRegistry:
+    """
+    Keeps the contents of registered files in memory and only reloads a file
+    when its modification time changes. To keep the hot path free of syscalls,
+    mtimes are checked at most once every check_interval seconds per asset.
+    """
+
+    def __init__(self, check_interval=1.0):
+        self.check_interval = check_interval
+        self._assets = {}    # name -> [path, loader, mtime, value, last_check]
+        self._lock = threading.Lock()
+
+
+    def register(self, name, path, loader=read_text):
+        """
+        Registers a file under name and loads it right away.
+        A file that doesn't exist yet is loaded once it appears.
+        """
+        entry = [path, loader, None, None, 0.0]
+        with self._lock:
+            self._assets[name] = entry
+            self._reload_if_changed(entry)
+
+
+    def get(self, name):
+        """
+        Returns the in-memory contents of a registered file.
+        """
+        entry = self._assets[name]
+
+        if monotonic() - entry[4] >= self.check_interval:
+            with self._lock:
+                self._reload_if_changed(entry)
+
+        return entry[3]
+
+
+    def _reload_if_changed(self, entry):
+        entry[4] = monotonic()
+        try:
+            mtime = os.stat(entry[0]).st_mtime
+        except OSError:
+            # Keep serving the last loaded contents if the file went missing
+            return
+
+        if mtime != entry[2]:
+            self._reload(entry)
+
+
+    def _reload(self, entry):
+        path, loader = entry[0], entry[1]
+        mtime = os.stat(path).st_mtime
+        entry[3] = loader(path)
+        entry[2] = mtime
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Backfills the metrics store with loan metrics at past blocks.
+
+Loan states are read with eth_call at each block, prices are CoinGecko's
+historical prices closest before the block's time (one request per token). Loan details and due dates
+never change, so they are queried once per loan across all blocks.
+Blocks are queried in parallel. Rows that already exist are kept.
+The backfill has collection contexts of its own, so it can run next to
+the in-process refresh of the bot.
+
+    python backfill.py --blocks 11500000 11600000
+    python backfill.py --range 11500000 11900000 6500     # start, end, step
+    python backfill.py --days 90 --every-hours 24         # last 90 days, daily
+"""
+import argparse
+import logging
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import time
+
+import data_aggregation as da
+from deployments import RateLimiter
+from timeseries_store import STORE_FILE, open_store
+
+
+# CoinGecko's public API allows about 10-50 calls a minute
+COINGECKO_MAX_RPS = 0.5
+
+
+# Helper function: Unix time of a block
+def block_timestamp(block_number, ctx=None):
+    return da.get_context(ctx).eth.getBlock(block_number)['timestamp']
+
+
+# Returns the numbers of the last blocks mined at or before each of timestamps
+def blocks_at_timestamps(timestamps, latest=None, ctx=None):
+    '''
+    Returns {timestamp: block number}. One binary search per timestamp, in
+    ascending order: each search starts at the block found for the previous
+    timestamp and ends below the first block already known to be later, and
+    block timestamps read by earlier searches are reused.
+    '''
+    latest = latest or da.get_context(ctx).eth.blockNumber
+    known = {}      # block number -> block timestamp
+
+    def timestamp_of(block_number):
+        if block_number not in known:
+            known[block_number] = block_timestamp(block_number, ctx)
+        return known[block_number]
+
+    blocks = {}
+    low = 0
+    for ts in sorted(set(timestamps)):
+        high = min((block - 1 for block, block_ts in known.items() if block_ts > ts), default=latest)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if timestamp_of(mid) <= ts:
+                low = mid
+            else:
+                high = mid - 1
+        blocks[ts] = low
+    return blocks
+
+
+# Returns the number of the last block mined at or before ts
+def block_at_timestamp(ts, latest=None, ctx=None):
+    '''
+    Binary search over block timestamps. Takes about log2(#blocks) RPC calls.
+    '''
+    return blocks_at_timestamps([ts], latest, ctx)[ts]
+
+
+# Reads the state of all loans at a block
+def loans_at_block(block_number, immutable_cache, ctx=None):
+    '''
+    Returns (block timestamp, loans data, YLD supply) at block_number.
+    immutable_cache is a dict shared by all blocks (see get_loan_data()).
+    '''
+    ctx = da.get_context(ctx)
+    da.load_abis(ctx)
+    caller = ctx.loan_fac.caller(block_identifier=block_number)
+    loans = da.call_contract(caller, 'getLoans', ctx=ctx)
+
+    loans_data = {
+        loan: da.get_loan_data(loan, block_identifier=block_number, immutable_cache=immutable_cache, ctx=ctx)
+        for loan in loans
+        }
+    supply = da.get_YLD_supply(block_identifier=block_number, ctx=ctx)
+
+    return block_timestamp(block_number, ctx), loans_data, supply
+
+
+# Prices further than this from a block's time are considered missing
+MAX_PRICE_AGE = 86400
+
+
+# Helper function: Lending and collateral tokens of a loans data dict
+def loan_tokens(loans_data):
+    return {
+        token
+        for loan in loans_data.values()
+        for token in (loan['address_lending_token'], loan['address_collateral_token'])
+        }
+
+
+# Fetches the price history of every token over a time range
+def price_histories(tokens, start, end, max_workers=4):
+    '''
+    Returns a dict {token address: [(unix time, USD price), ...]}.
+    One request per token, spaced to respect CoinGecko's rate limit.
+    '''
+    limiter = RateLimiter(COINGECKO_MAX_RPS)
+
+    def fetch(token):
+        token_str = da.get_token_str(token)
+        if token_str is None:
+            return []
+        limiter.wait()
+        return da.get_token_price_history(token_str, start - MAX_PRICE_AGE, end + MAX_PRICE_AGE)
+
+    tokens = sorted(tokens)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(tokens, executor.map(fetch, tokens)))
+
+
+# Helper function: Latest price at or before ts (or None)
+def price_at(history, ts):
+    i = bisect_right(history, (ts, float('inf')))
+    if i == 0 or ts - history[i - 1][0] > MAX_PRICE_AGE:
+        return None
+    return history[i - 1][1]
+
+
+# Recomputes the loan metrics at every block and appends them to the store
+def backfill(blocks, store_file=STORE_FILE, max_workers=8, verbose=False):
+    '''
+    Returns a dict {block number: metrics} of all blocks that could be backfilled.
+    Blocks whose loans can't be read are logged and skipped.
+    '''
+    immutable_cache = {}
+    states = {}
+    failed = []
+    ctx = da.CollectionContext()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(loans_at_block, block, immutable_cache, ctx): block for block in blocks}
+        for future in as_completed(futures):
+            block = futures[future]
+            try:
+                states[block] = future.result()
+            # Possibility: Node error or pruned state at this block. The other blocks go on.
+            except Exception as e:
+                logging.warning(f'Failed to read loans at block {block}: {e!r}')
+                failed.append(block)
+                continue
+            if verbose:
+                print(f'Read loans at block {block} ({len(states)}/{len(blocks)}).')
+
+    if failed:
+        logging.warning(f'Skipped {len(failed)} blocks whose loans could not be read: {sorted(failed)}')
+
+    tokens = {token for _, loans_data, _ in states.values() for token in loan_tokens(loans_data)}
+    timestamps = [ts for ts, _, _ in states.values()]
+    histories = price_histories(tokens, min(timestamps, default=0), max(timestamps, default=0))
+
+    # Every block is aggregated in a context of its own
+    store = open_store(store_file, verbose=verbose)
+    results = {}
+    for block in sorted(states):
+        ts, loans_data, supply = states[block]
+        block_prices = {token: price_at(histories[token], ts) for token in loan_tokens(loans_data)}
+        missing = [da.get_token_symbol(t) for t, p in block_prices.items() if p is None]
+        if missing or not loans_data:
+            logging.warning(f'Skipped block {block}: no prices for {missing}' if missing
+                            else f'Skipped block {block}: no loans yet')
+            continue
+
+        block_ctx = da.CollectionContext()
+        da.set_all_loans_data(loans_data, block_ctx)
+        da.set_scraped_prices(block_prices, block_ctx)
+        results[block] = da.export_loan_metrics_dict(YLD_total_supply=supply, timestamp=ts, ctx=block_ctx)
+        store.append(results[block], ts=ts, replace=False)
+
+        if verbose:
+            print(f"Block {block} ({results[block]['time']}): TVL {results[block]['total_collateral_in_use_USD']}")
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill loan metrics at past blocks.')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--blocks', type=int, nargs='+', metavar='BLOCK')
+    group.add_argument('--range', type=int, nargs=3, metavar=('START', 'END', 'STEP'))
+    group.add_argument('--days', type=float, help='backfill the last DAYS days')
+    parser.add_argument('--every-hours', type=float, default=24, help='spacing for --days (default: 24)')
+    parser.add_argument('--store', default=STORE_FILE)
+    parser.add_argument('--workers', type=int, default=8, help='blocks queried in parallel')
+    args = parser.parse_args()
+
+    if args.blocks:
+        blocks = args.blocks
+    elif args.range:
+        start, end, step = args.range
+        blocks = list(range(start, end + 1, step))
+    else:
+        now, latest = time(), da.DEFAULT_CONTEXT.eth.blockNumber
+        step = args.every_hours * 3600
+        n = int(args.days * 24 / args.every_hours)
+        blocks = sorted(set(blocks_at_timestamps([now - i * step for i in range(n + 1)], latest).values()))
+
+    print(f'Backfilling {len(blocks)} blocks into {args.store}...')
+    start = time()
+    results = backfill(blocks, store_file=args.store, max_workers=args.workers, verbose=True)
+    print(f'\nBackfilled {len(results)} of {len(blocks)} blocks in {time() - start:.0f}s.')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scaling benchmarks for the loan aggregation functions in data_aggregation.py.
+
+Generates synthetic loan books shaped like ALL_LOANS_DATA (10^2 up to 10^6
+loans) with realistic status mixes and tokens from lookups.token_map, stubs
+all prices and times each aggregation plus the full export. Peak memory is
+tracked with tracemalloc. Results are saved as JSON per commit, so runs of
+different commits can be compared:
+
+    python benchmarks/bench_aggregation.py --max-exp 5
+    python benchmarks/bench_aggregation.py --compare benchmarks/results/<commit>.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# data_aggregation reads these at import time, but doesn't query any API
+os.environ.setdefault('ETHERSCAN_API_KEY', 'benchmark')
+os.environ.setdefault('WEB3_INFURA_PROJECT_ID', 'benchmark')
+
+import data_aggregation as da
+import loan_decoder
+import lookups as lu
+
+
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+# Share of loans per status (0 = active, 1 = repaid, 2 = defaulted)
+STATUS_MIX = {0: 0.45, 1: 0.50, 2: 0.05}
+
+# Stubbed USD prices
+PRICES = {address: (1.0 if token['symbol'] in {'DAI', 'USDC', 'USDT', 'TUSD', 'SUSD'}
+                    else random.Random(token['symbol']).uniform(0.5, 3000))
+          for address, token in lu.token_map.items()}
+
+
+# Helper function: Random hex address
+def random_address(rng):
+    return '0x' + ''.join(rng.choice('0123456789abcdef') for _ in range(40))
+
+
+# Generates a synthetic loan book in the format of ALL_LOANS_DATA
+def generate_loan_book(n, seed=0):
+    rng = random.Random(seed)
+    tokens = list(lu.token_map)
+    statuses, weights = list(STATUS_MIX), list(STATUS_MIX.values())
+    now = int(time())
+
+    loans = {}
+    for _ in range(n):
+        lending, collateral = rng.sample(tokens, 2)
+        principal_usd = rng.lognormvariate(8.5, 1.0)
+        collateral_usd = principal_usd * rng.uniform(1.3, 2.5)
+        status = rng.choices(statuses, weights)[0]
+        duration = rng.randint(7, 60) * 24 * 3600
+        ts_start = now - rng.randint(0, 365 * 24 * 3600)
+
+        def raw(amount_usd, token):
+            decimals = lu.token_map[token]['decimals']
+            return int(amount_usd / PRICES[token] * 10**decimals)
+
+        loans[random_address(rng)] = {
+            'collateral_balance': raw(collateral_usd, collateral) if status == 0 else 0,
+            'ts_due': ts_start + duration,
+            'is_defaulted': status == 2,
+            'address_lender': random_address(rng),
+            'address_borrower': random_address(rng),
+            'address_lending_token': lending,
+            'address_collateral_token': collateral,
+            'principal': raw(principal_usd, lending),
+            'interest': rng.randint(300, 1500),
+            'duration': duration,
+            'collateral': raw(collateral_usd, collateral),
+            'loan_status': status,
+            'ts_start': ts_start,
+            'ts_repaid': ts_start + rng.randint(0, duration) if status == 1 else 0,
+            'liquidatable_t_allowance': 3 * 24 * 3600
+            }
+
+    return loans
+
+
+# Helper function: Runs function without the decoded loan columns of a previous run
+def uncached(function):
+    def run():
+        da.DEFAULT_CONTEXT.loan_columns = None
+        return function()
+    return run
+
+
+# Functions to benchmark. Prices are stubbed, the YLD supply is passed in.
+BENCHMARKS = {
+    'get_active_loans': da.get_active_loans,
+    'get_current_TVL': uncached(da.get_current_TVL),
+    'get_currently_borrowed': uncached(da.get_currently_borrowed),
+    'get_avg_loan_val': uncached(da.get_avg_loan_val),
+    'decode_loans': lambda: loan_decoder.decode_loans(da.get_all_loans()),
+    'decode_columns': lambda: loan_decoder.decode_columns(da.get_all_loans()),
+    'decode_float_columns': lambda: loan_decoder.decode_float_columns(da.get_all_loans()),
+    'export_loan_metrics_dict': uncached(lambda: da.export_loan_metrics_dict(YLD_total_supply=624000)),
+    }
+
+
+# Times a function (best of repeats) and measures its peak memory
+def measure(function, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        gc.collect()
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def run_benchmarks(sizes, repeats=3):
+    results = []
+    da.set_scraped_prices(PRICES)
+
+    for n in sizes:
+        book = generate_loan_book(n)
+        da.set_all_loans_data(book)
+
+        for name, function in BENCHMARKS.items():
+            # Large books are only timed once
+            seconds, peak = measure(function, repeats if n <= 10**4 else 1)
+            results.append({'n_loans': n, 'function': name, 'seconds': seconds, 'peak_kb': peak / 1024})
+            print('{:>9} | {:28} | {:>10.4f} s | {:>10.0f} kB'.format(n, name, seconds, peak / 1024))
+
+        del book
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Prints the ratio of this run's timings to a previous results file
+def compare(results, other_file):
+    with open(other_file) as file:
+        other = json.load(file)
+    baseline = {(r['n_loans'], r['function']): r['seconds'] for r in other['results']}
+
+    print(f"\nCompared to {other['commit']} (ratio > 1 = slower now):")
+    for r in results:
+        key = (r['n_loans'], r['function'])
+        if key in baseline and baseline[key] > 0:
+            print('{:>9} | {:28} | {:>6.2f}x'.format(r['n_loans'], r['function'], r['seconds'] / baseline[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling benchmarks of loan aggregation.')
+    parser.add_argument('--min-exp', type=int, default=2, help='smallest book: 10^min_exp loans')
+    parser.add_argument('--max-exp', type=int, default=5, help='largest book: 10^max_exp loans')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--compare', help='results file of another commit')
+    args = parser.parse_args()
+
+    sizes = [10**e for e in range(args.min_exp, args.max_exp + 1)]
+    print('{:>9} | {:28} | {:>12} | {:>13}'.format('loans', 'function', 'time', 'peak memory'))
+    print('-'*72)
+    results = run_benchmarks(sizes, repeats=args.repeats)
+
+    commit = git_commit()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    outfile = os.path.join(RESULTS_DIR, f'{commit}.json')
+    with open(outfile, 'w') as file:
+        json.dump({
+            'commit': commit,
+            'timestamp': int(time()),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': results
+            }, file, indent=1)
+    print(f'\nSaved results to {outfile}.')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
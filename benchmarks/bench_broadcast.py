@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the broadcast fan-out of loans.png to subscribed chats.
+
+Uses the recording fake bot of bench_load.py, optionally answering a share of
+the sends with a flood-limit error. Reports fan-out time, uploads and sends.
+
+    python benchmarks/bench_broadcast.py --chats 1000 --rps 30
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from telegram.error import RetryAfter
+
+from broadcast import Broadcaster
+from bench_load import RecordingBot
+
+
+class FloodingBot(RecordingBot):
+    """
+    RecordingBot raising RetryAfter for a share of the sends by file_id.
+    """
+
+    def __init__(self, flood_rate=0.0, retry_after=1, seed=0, **kwargs):
+        super().__init__(**kwargs)
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.floods = 0
+        self._rng = random.Random(seed)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        if isinstance(photo, str):
+            with self._lock:
+                flood = self._rng.random() < self.flood_rate
+                self.floods += flood
+            if flood:
+                raise RetryAfter(self.retry_after)
+        return super().send_photo(chat_id, photo, caption=caption, **kwargs)
+
+
+def run_broadcast(n_chats=300, rps=30, workers=8, flood_rate=0.0,
+                  upload_latency=0.5, send_latency=0.05, pic_file='loans.png'):
+    '''
+    Broadcasts pic_file to n_chats chats. Returns a dict of results.
+    '''
+    bot = FloodingBot(flood_rate=flood_rate, upload_latency=upload_latency, send_latency=send_latency)
+    broadcaster = Broadcaster(bot, max_per_second=rps, workers=workers)
+    broadcaster.start()
+
+    broadcast = broadcaster.broadcast_photo(pic_file, range(1, n_chats + 1))
+    broadcast.wait()
+
+    return {
+        'chats': n_chats,
+        'seconds': broadcast.seconds,
+        'sent': broadcast.sent,
+        'failed': broadcast.failed,
+        'uploads': bot.uploads,
+        'bot_calls': len(bot.calls),
+        'floods': bot.floods,
+        'threads': threading.active_count(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the broadcast of loans.png.')
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--rps', type=float, default=30, help='messages per second, Telegram allows ~30')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='share of sends answered with RetryAfter')
+    parser.add_argument('--upload-latency', type=float, default=0.5)
+    parser.add_argument('--send-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    results = run_broadcast(
+        n_chats=args.chats,
+        rps=args.rps,
+        workers=args.workers,
+        flood_rate=args.flood_rate,
+        upload_latency=args.upload_latency,
+        send_latency=args.send_latency
+        )
+
+    print(f"\n{results['sent']} of {results['chats']} chats served in {results['seconds']:.2f}s "
+          f"({results['sent'] / results['seconds']:.1f} chats/s), {results['failed']} failed")
+    print(f"uploads: {results['uploads']}, bot calls: {results['bot_calls']}, flood limits hit: {results['floods']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark of the read-only HTTP API (http_api.py).
+
+Starts the API server in a process pinned to one CPU core, on a temporary
+store of synthetic snapshots and the repo's loans.png. Client processes
+send requests over keep-alive connections, either plain (200 with body)
+or revalidating with If-None-Match (empty 304).
+
+    python benchmarks/bench_http_api.py --requests 5000 --clients 4
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+from time import perf_counter, sleep, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from http_api import ApiServer, MetricsApi
+from timeseries_store import DAY, METRIC_FIELDS, TimeSeriesStore
+
+
+PATHS = ['/api/latest', '/api/history?metric=total_collateral_in_use_USD&period=day', '/api/loans.png']
+
+
+# Writes a store of n_rows snapshots, one every 3 hours up to now
+def synthetic_store(path, n_rows=2000, seed=0):
+    rng = random.Random(seed)
+    store = TimeSeriesStore(path)
+    now = int(time())
+    for i in range(n_rows):
+        metrics = {field: rng.random() * 10**6 for field in METRIC_FIELDS}
+        store.append(metrics, ts=now - (n_rows - i) * DAY // 8)
+    return store
+
+
+def serve(workdir, port, cpu):
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    api = MetricsApi(os.path.join(workdir, 'bench.db'), os.path.join(workdir, 'loans.png'),
+                     os.path.join(workdir, 'breakdown.json'), refresh_seconds=3 * 3600)
+    ApiServer('127.0.0.1', port, api).serve_forever()
+
+
+# Client process: n requests of path over one keep-alive connection
+def client(port, path, n, revalidate):
+    con = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {}
+    if revalidate:
+        con.request('GET', path)
+        response = con.getresponse()
+        response.read()
+        headers['If-None-Match'] = response.getheader('ETag')
+
+    statuses = {}
+    for _ in range(n):
+        con.request('GET', path, headers=headers)
+        response = con.getresponse()
+        response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    con.close()
+    return statuses
+
+
+def run_benchmark(n_requests=5000, n_clients=4, port=8765, cpu=0):
+    '''
+    Returns a list of (path, mode, requests per second, statuses).
+    '''
+    workdir = tempfile.mkdtemp()
+    synthetic_store(os.path.join(workdir, 'bench.db'))
+    shutil.copy('loans.png', os.path.join(workdir, 'loans.png'))
+
+    server = multiprocessing.Process(target=serve, args=(workdir, port, cpu), daemon=True)
+    server.start()
+    sleep(0.5)
+
+    results = []
+    try:
+        with multiprocessing.Pool(n_clients) as pool:
+            for path in PATHS:
+                for mode in ('200', '304'):
+                    args = [(port, path, n_requests // n_clients, mode == '304')] * n_clients
+                    start = perf_counter()
+                    counts = pool.starmap(client, args)
+                    seconds = perf_counter() - start
+
+                    statuses = {}
+                    for count in counts:
+                        for status, n in count.items():
+                            statuses[status] = statuses.get(status, 0) + n
+                    results.append((path, mode, sum(statuses.values()) / seconds, statuses))
+    finally:
+        server.terminate()
+        shutil.rmtree(workdir)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the HTTP API on one core.')
+    parser.add_argument('--requests', type=int, default=5000, help='requests per path and mode')
+    parser.add_argument('--clients', type=int, default=4, help='client processes')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cpu', type=int, default=0, help='core the server is pinned to')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.requests, args.clients, args.port, args.cpu)
+
+    print('\n{:60} | {:>6} | {:>10} | {}'.format('path', 'mode', 'req/s', 'statuses'))
+    print('-'*95)
+    for path, mode, rps, statuses in results:
+        print('{:60} | {:>6} | {:>10.0f} | {}'.format(path, mode, rps, statuses))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Load-testing harness for MerchBot.
+
+Replays synthetic Telegram updates through a real dispatcher with the bot's
+handlers. context.bot is a recording fake that simulates upload latency.
+Reports throughput and p50/p95/p99 handler and end-to-end latency.
+
+    python benchmarks/bench_load.py --updates 500 --users 100 --rate 50 \
+        --mix /stats=0.5,/loans=0.4,/all=0.1
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+from queue import Queue
+from time import perf_counter, sleep, time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('STATS_BOT_TOKEN', 'load-test')
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from main import MerchBot
+
+
+class RecordingBot:
+    """
+    Fake bot recording every call. Uploading bytes takes upload_latency
+    seconds, sending text or an already uploaded file_id takes send_latency.
+    """
+
+    def __init__(self, upload_latency=0.5, send_latency=0.05):
+        self.upload_latency = upload_latency
+        self.send_latency = send_latency
+        self.calls = []
+        self.uploads = 0
+        self._lock = threading.Lock()
+
+    def _record(self, method, chat_id, latency):
+        sleep(latency)
+        with self._lock:
+            self.calls.append((method, chat_id))
+            return len(self.calls)
+
+    def send_message(self, chat_id, text, **kwargs):
+        message_id = self._record('send_message', chat_id, self.send_latency)
+        return SimpleNamespace(message_id=message_id)
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        if isinstance(photo, str):
+            message_id = self._record('send_photo', chat_id, self.send_latency)
+        else:
+            message_id = self._record('upload_photo', chat_id, self.upload_latency)
+            with self._lock:
+                self.uploads += 1
+        file_id = f'recorded-{message_id}'
+        return SimpleNamespace(message_id=message_id, photo=[SimpleNamespace(file_id=file_id)])
+
+
+class TimedMerchBot(MerchBot):
+    """
+    MerchBot recording start and end time of every handled update.
+    """
+
+    def __init__(self, store_file):
+        super().__init__(store_file)
+        self.timings = {}    # update_id -> (start, end)
+        self.done = threading.Semaphore(0)
+
+    def handle_text_messages(self, update, context):
+        start = perf_counter()
+        try:
+            super().handle_text_messages(update, context)
+        finally:
+            self.timings[update.update_id] = (start, perf_counter())
+            self.done.release()
+
+
+# Builds the JSON of a text message update as sent by Telegram
+def synthetic_update_json(update_id, user_id, text):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'User', 'username': f'user{user_id}'}
+    chat = {'id': user_id, 'type': 'private', 'first_name': 'User'}
+    message = {'message_id': update_id, 'date': int(time()), 'chat': chat, 'from': user, 'text': text}
+    return {'update_id': update_id, 'message': message}
+
+
+# Parses a command mix string like '/stats=0.5,/loans=0.5'
+def parse_mix(mix_str):
+    mix = {}
+    for part in mix_str.split(','):
+        command, weight = part.split('=')
+        mix[command.strip()] = float(weight)
+    return mix
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load_test(n_updates=200, n_users=50, rate=20.0, mix=None, workers=4,
+                  upload_latency=0.5, send_latency=0.05, seed=0):
+    '''
+    Sends n_updates synthetic updates from n_users users with Poisson arrivals
+    at rate updates/second through a dispatcher. Returns a dict of results.
+    '''
+    mix = mix or {'/stats': 0.5, '/loans': 0.4, '/all': 0.1}
+    rng = random.Random(seed)
+
+    fake_bot = RecordingBot(upload_latency=upload_latency, send_latency=send_latency)
+    # A store of its own (filled from the legacy csvs), the repo's yield_stats.db stays untouched
+    merch_bot = TimedMerchBot(os.path.join(tempfile.mkdtemp(), 'yield_stats.db'))
+    logging.getLogger().setLevel(logging.WARNING)
+
+    dispatcher = Dispatcher(fake_bot, Queue(), workers=workers, use_context=True)
+    merch_bot.add_handlers(dispatcher)
+    threading.Thread(target=dispatcher.start, name='dispatcher', daemon=True).start()
+
+    commands, weights = list(mix), list(mix.values())
+    enqueued = {}
+
+    start = perf_counter()
+    for update_id in range(1, n_updates + 1):
+        user_id = rng.randint(1, n_users)
+        text = rng.choices(commands, weights)[0]
+        update = Update.de_json(synthetic_update_json(update_id, user_id, text), fake_bot)
+
+        enqueued[update_id] = perf_counter()
+        dispatcher.update_queue.put(update)
+        sleep(rng.expovariate(rate))
+
+    for _ in range(n_updates):
+        merch_bot.done.acquire()
+    duration = perf_counter() - start
+    dispatcher.stop()
+
+    handler = sorted(end - begin for begin, end in merch_bot.timings.values())
+    end_to_end = sorted(merch_bot.timings[i][1] - enqueued[i] for i in merch_bot.timings)
+
+    return {
+        'updates': n_updates,
+        'duration_s': duration,
+        'throughput_per_s': n_updates / duration,
+        'handler_ms': {p: percentile(handler, p) * 1000 for p in (50, 95, 99)},
+        'end_to_end_ms': {p: percentile(end_to_end, p) * 1000 for p in (50, 95, 99)},
+        'bot_calls': len(fake_bot.calls),
+        'uploads': fake_bot.uploads,
+        'coalescing': merch_bot.flights.stats(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test MerchBot with synthetic updates.')
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=20.0, help='arrivals per second')
+    parser.add_argument('--mix', default='/stats=0.5,/loans=0.4,/all=0.1')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--upload-latency', type=float, default=0.5)
+    parser.add_argument('--send-latency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_load_test(
+        n_updates=args.updates,
+        n_users=args.users,
+        rate=args.rate,
+        mix=parse_mix(args.mix),
+        workers=args.workers,
+        upload_latency=args.upload_latency,
+        send_latency=args.send_latency,
+        seed=args.seed
+        )
+
+    print(f"\n{results['updates']} updates in {results['duration_s']:.2f}s "
+          f"({results['throughput_per_s']:.1f} updates/s)")
+    print(f"bot calls: {results['bot_calls']}, uploads: {results['uploads']}")
+    print(f"coalescing: {results['coalescing']}\n")
+    print('{:>12} | {:>10} | {:>10} | {:>10}'.format('latency', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'))
+    print('-'*51)
+    for name in ('handler_ms', 'end_to_end_ms'):
+        p = results[name]
+        print('{:>12} | {:>10.1f} | {:>10.1f} | {:>10.1f}'.format(name[:-3], p[50], p[95], p[99]))
+
+
+if __name__ == "__main__":
+    main()
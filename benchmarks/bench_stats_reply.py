@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the text-only /stats reply of MerchBot.
+Times handle_text_messages() with a fake bot that sends nothing.
+
+    python benchmarks/bench_stats_reply.py [n_requests]
+"""
+import logging
+import os
+import sys
+import tempfile
+from time import perf_counter
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('STATS_BOT_TOKEN', 'benchmark')
+
+from main import MerchBot
+
+
+class NullBot:
+    """Fake bot that discards all messages."""
+    def send_message(self, chat_id, text):
+        pass
+
+
+def fake_update(text):
+    user = SimpleNamespace(username='benchmark')
+    message = SimpleNamespace(text=text, chat_id=1, from_user=user)
+    return SimpleNamespace(message=message)
+
+
+def main(n=10000):
+    # A store of its own (filled from the legacy csvs), the repo's yield_stats.db stays untouched
+    bot = MerchBot(os.path.join(tempfile.mkdtemp(), 'yield_stats.db'))
+    logging.getLogger().setLevel(logging.WARNING)
+    update = fake_update('/stats')
+    context = SimpleNamespace(bot=NullBot())
+
+    # Warm up
+    bot.handle_text_messages(update, context)
+
+    timings = []
+    for _ in range(n):
+        start = perf_counter()
+        bot.handle_text_messages(update, context)
+        timings.append(perf_counter() - start)
+
+    timings.sort()
+    mean = sum(timings) / n
+    p99 = timings[int(n * 0.99) - 1]
+    print(f'/stats handler over {n} requests: mean {mean*1e6:.1f} us, p99 {p99*1e6:.1f} us')
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Minimal local Ethereum JSON-RPC node for tests and benchmarks of batched reads.
+
+Answers eth_blockNumber and eth_call. Calls to the Multicall2 address are
+decoded and every inner call is answered from in-memory contract state
+(Uniswap V2 pairs, ERC20 supplies). Calls to unknown addresses succeed
+with empty return data, like calls to an address without code.
+
+    python benchmarks/fake_node.py     # prices all token_map tokens via the fake node
+"""
+import json
+import os
+import random
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import lookups as lu
+from dex_prices import GET_RESERVES, STABLECOINS, WETH, dex_pairs, pair_address, sort_tokens
+from multicall import (MULTICALL2_ADDRESS, decode_try_block_and_aggregate, encode_results,
+                       encode_uint, http_rpc, selector)
+
+
+TOTAL_SUPPLY = selector('totalSupply()')
+
+
+class FakeNode:
+    """
+    In-memory chain state: {address (lowercase): {calldata: return data}}.
+    """
+
+    def __init__(self, block_number=12000000):
+        self.block_number = block_number
+        self.contracts = {}
+        self.requests = 0
+
+
+    def set_return(self, address, calldata, data):
+        self.contracts.setdefault(address.lower(), {})[calldata] = data
+
+
+    def add_pair(self, token_a, token_b, reserve_a, reserve_b):
+        '''Adds a Uniswap V2 pair with raw (not decimal-adjusted) reserves.'''
+        if sort_tokens(token_a, token_b)[0] != token_a:
+            reserve_a, reserve_b = reserve_b, reserve_a
+        data = encode_uint(reserve_a) + encode_uint(reserve_b) + encode_uint(0)
+        self.set_return(pair_address(token_a, token_b), GET_RESERVES, data)
+
+
+    def add_token(self, address, total_supply):
+        self.set_return(address, TOTAL_SUPPLY, encode_uint(total_supply))
+
+
+    def call(self, to, calldata):
+        if to.lower() == MULTICALL2_ADDRESS.lower() and calldata[:4] == selector('tryBlockAndAggregate(bool,(address,bytes)[])'):
+            _, calls = decode_try_block_and_aggregate(calldata)
+            results = [(True, self.contracts.get(target.lower(), {}).get(data, b'')) for target, data in calls]
+            return encode_results(self.block_number, bytes(32), results)
+        return self.contracts.get(to.lower(), {}).get(calldata, b'')
+
+
+    def handle(self, request):
+        self.requests += 1
+        method, params = request['method'], request.get('params', [])
+        if method == 'eth_blockNumber':
+            result = hex(self.block_number)
+        elif method == 'eth_call':
+            result = '0x' + self.call(params[0]['to'], bytes.fromhex(params[0]['data'][2:])).hex()
+        else:
+            return {'jsonrpc': '2.0', 'id': request.get('id'), 'error': {'code': -32601, 'message': 'Method not found'}}
+        return {'jsonrpc': '2.0', 'id': request.get('id'), 'result': result}
+
+
+    def serve(self, port=0):
+        '''Serves JSON-RPC on 127.0.0.1 from a daemon thread. Returns the URL.'''
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                body = json.dumps(node.handle(request)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# Adds pairs of tokens with WETH and the stablecoins at the given USD prices
+def add_market(node, prices, liquidity_usd=1000000, seed=0):
+    rng = random.Random(seed)
+    for base, quote in dex_pairs(prices):
+        # Every token gets some of its pools, WETH all of them
+        if base == WETH or rng.random() < 0.7:
+            usd = liquidity_usd * rng.uniform(0.1, 2)
+            raw = {t: int(usd / prices[t] * 10**lu.token_map[t]['decimals']) for t in (base, quote)}
+            node.add_pair(base, quote, raw[base], raw[quote])
+
+
+if __name__ == "__main__":
+    from dex_prices import get_dex_prices
+
+    rng = random.Random(1)
+    prices = {token: 1.0 if token in STABLECOINS else rng.uniform(0.1, 3000) for token in lu.token_map}
+    prices[WETH] = 2000.0
+
+    node = FakeNode()
+    add_market(node, prices)
+    url = node.serve()
+
+    start = perf_counter()
+    block, dex = get_dex_prices(rpc=http_rpc(url))
+    seconds = perf_counter() - start
+
+    errors = [abs(dex[t] / prices[t] - 1) for t in dex]
+    print(f'Priced {len(dex)} of {len(prices)} tokens at block {block} '
+          f'in {node.requests} request(s), {seconds * 1000:.1f} ms.')
+    print(f'Max relative error: {max(errors):.2e}')
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Breakdown of active loans by lending token, collateral token and
+(lending, collateral) pair: USD borrowed and collateral, number of loans,
+average interest and collateralization per group.
+
+The loan book is converted to column arrays once, all groups are then
+summed with np.bincount, without a loop over loans per group. The latest
+breakdown is saved as breakdown.json for the /assets reply of MerchBot.
+
+    python breakdown.py     # breakdown of the latest loan run in the store
+"""
+import os
+import json
+
+import numpy as np
+
+import lookups as lu
+
+
+BREAKDOWN_FILE = 'breakdown.json'
+
+GROUPINGS = ('lending', 'collateral', 'pair')
+
+
+# Helper function: Symbol of a token address (the address itself if unknown)
+def token_symbol(token):
+    info = lu.token_info(token)
+    return info['symbol'] if info else token
+
+
+# Converts the active loans of a loan book (format of ALL_LOANS_DATA) into column arrays
+def active_loan_columns(loans_data):
+    '''
+    Returns (tokens, columns). tokens lists every token used by an active loan,
+    columns is a dict of arrays with one entry per active loan: lending and
+    collateral token (index into tokens), decimal-adjusted principal and
+    collateral, interest in percent.
+    '''
+    active = [loan for loan in loans_data.values() if loan['loan_status'] == 0]
+    tokens = sorted({loan[field] for loan in active for field in ('address_lending_token', 'address_collateral_token')})
+    index = {token: i for i, token in enumerate(tokens)}
+    decimals = np.array([(lu.token_info(t) or {'decimals': 0})['decimals'] for t in tokens], dtype=np.float64)
+
+    lending = np.array([index[loan['address_lending_token']] for loan in active], dtype=np.intp)
+    collateral = np.array([index[loan['address_collateral_token']] for loan in active], dtype=np.intp)
+
+    columns = {
+        'lending_token': lending,
+        'collateral_token': collateral,
+        # Raw amounts can exceed int64, so they are converted as floats
+        'principal': np.array([float(loan['principal']) for loan in active]) / 10**decimals[lending],
+        'collateral': np.array([float(loan['collateral']) for loan in active]) / 10**decimals[collateral],
+        'interest': np.array([loan['interest'] for loan in active], dtype=np.float64) / 100,
+        }
+    return tokens, columns
+
+
+# Helper function: Sums of the columns per group in one bincount each
+def group_totals(groups, n_groups, borrowed, collateral, interest):
+    loans = np.bincount(groups, minlength=n_groups)
+    borrowed = np.bincount(groups, weights=borrowed, minlength=n_groups)
+    collateral = np.bincount(groups, weights=collateral, minlength=n_groups)
+    interest = np.bincount(groups, weights=interest, minlength=n_groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_interest = interest / loans
+        collateralization = collateral / borrowed * 100
+
+    return loans, borrowed, collateral, avg_interest, collateralization
+
+
+# Breakdown of the active loans of a loan book at the given prices
+def loan_breakdown(loans_data, prices):
+    '''
+    Takes a loan book (format of ALL_LOANS_DATA) and a dict {token address:
+    USD price}. Returns {'lending': rows, 'collateral': rows, 'pair': rows},
+    each a list of dicts sorted by USD value (collateral for 'collateral',
+    borrowed otherwise):
+
+        token / pair            address(es) of the group
+        symbol                  'DAI' or 'DAI/WETH' for pairs
+        loans                   number of active loans
+        borrowed_USD            USD value of their principal
+        collateral_USD          USD value of their collateral
+        avg_interest_rate       in percent
+        collateralization       collateral USD / borrowed USD in percent
+
+    USD values of groups with tokens without a price are NaN (null once
+    saved, see save_breakdown()).
+    '''
+    tokens, columns = active_loan_columns(loans_data)
+    price = np.array([prices.get(token, np.nan) for token in tokens], dtype=np.float64)
+
+    borrowed = columns['principal'] * price[columns['lending_token']]
+    collateral = columns['collateral'] * price[columns['collateral_token']]
+
+    # Pairs present in the loan book, numbered in one pass
+    pair_keys = columns['lending_token'] * max(len(tokens), 1) + columns['collateral_token']
+    pairs, pair_groups = np.unique(pair_keys, return_inverse=True)
+
+    groupings = {
+        'lending': (columns['lending_token'], len(tokens), [(token,) for token in tokens]),
+        'collateral': (columns['collateral_token'], len(tokens), [(token,) for token in tokens]),
+        'pair': (pair_groups, len(pairs), [(tokens[k // len(tokens)], tokens[k % len(tokens)]) for k in pairs]),
+        }
+
+    breakdown = {}
+    for name, (groups, n_groups, keys) in groupings.items():
+        totals = group_totals(groups, n_groups, borrowed, collateral, columns['interest'])
+        rows = []
+        for key, loans, borrowed_usd, collateral_usd, avg_interest, ratio in zip(keys, *totals):
+            if not loans:
+                continue
+            rows.append({
+                'pair' if name == 'pair' else 'token': list(key) if name == 'pair' else key[0],
+                'symbol': '/'.join(token_symbol(token) for token in key),
+                'loans': int(loans),
+                'borrowed_USD': float(borrowed_usd),
+                'collateral_USD': float(collateral_usd),
+                'avg_interest_rate': float(avg_interest),
+                'collateralization': float(ratio),
+                })
+
+        sort_key = 'collateral_USD' if name == 'collateral' else 'borrowed_USD'
+        rows.sort(key=lambda row: -np.nan_to_num(row[sort_key], nan=-1))
+        breakdown[name] = rows
+
+    return breakdown
+
+
+# Helper function: JSON has no NaN. USD values of groups without a price become None (null).
+def nan_to_none(breakdown):
+    return {
+        name: [{k: None if isinstance(v, float) and np.isnan(v) else v for k, v in row.items()} for row in rows]
+        if isinstance(rows, list) else rows
+        for name, rows in breakdown.items()
+        }
+
+
+# Saves a breakdown with the time it refers to
+def save_breakdown(breakdown, timestamp, path=BREAKDOWN_FILE):
+    # Write to a temporary file first, so readers never see a half-written file
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as file:
+        json.dump(nan_to_none(dict(breakdown, time=timestamp)), file, allow_nan=False)
+    os.replace(tmpfile, path)
+
+
+# Reads the latest breakdown, None if there is none yet
+def read_breakdown(path=BREAKDOWN_FILE):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+# Formats the top groups of a breakdown as a plain text message
+def format_breakdown_text(breakdown, top=5):
+    '''
+    Takes a breakdown (with 'time', as saved by save_breakdown()) and returns
+    a text message listing the top groups by lending token, collateral token and pair.
+    '''
+    # Imported here so computing breakdowns doesn't need PIL
+    from image_manipulation import parse_str
+    from timeseries_store import ts_to_time_str
+
+    if not breakdown or not breakdown['lending']:
+        return 'No asset breakdown available yet. Please try again later.'
+
+    def usd(value):
+        return '?' if value is None or np.isnan(value) else f'${parse_str(value)}'
+
+    def percent(value):
+        return '?' if value is None or np.isnan(value) else f'{parse_str(value)}%'
+
+    lines = ['yield.credit assets of active loans', f"Last updated: {ts_to_time_str(breakdown['time'])}"]
+
+    lines += ['', 'Borrowed:']
+    for row in breakdown['lending'][:top]:
+        lines.append(f"{row['symbol']}: {usd(row['borrowed_USD'])} in {row['loans']} loans, "
+                     f"avg interest {percent(row['avg_interest_rate'])}")
+
+    lines += ['', 'Collateral:']
+    for row in breakdown['collateral'][:top]:
+        lines.append(f"{row['symbol']}: {usd(row['collateral_USD'])} in {row['loans']} loans")
+
+    lines += ['', 'Pairs (borrowed/collateral):']
+    for row in breakdown['pair'][:top]:
+        lines.append(f"{row['symbol']}: {usd(row['borrowed_USD'])} borrowed, "
+                     f"collateralization {percent(row['collateralization'])}")
+
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import data_aggregation as da
+    from time import time
+    from timeseries_store import TimeSeriesStore
+
+    loans_data = TimeSeriesStore().loans_at()
+    da.set_all_loans_data(loans_data)
+    prices = da.prefetch_prices({
+        loan[field] for loan in loans_data.values() if loan['loan_status'] == 0
+        for field in ('address_lending_token', 'address_collateral_token')
+        })
+
+    breakdown = loan_breakdown(loans_data, prices)
+    save_breakdown(breakdown, int(time()))
+    print(format_breakdown_text(read_breakdown(), top=20))
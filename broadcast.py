@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fan-out of infographics to many chats.
+
+A new version of a picture is uploaded once, to the first reachable chat.
+All other chats get it re-sent by its Telegram file_id, so the bytes are
+never uploaded twice. Sends go through a queue served by worker threads,
+spaced to stay within Telegram's limits: about 30 messages per second
+overall and one message per second per chat. Sends hitting a flood limit
+(RetryAfter) pause all workers for the requested time and are retried,
+network errors are retried with backoff, both up to max_attempts times.
+"""
+import os
+import logging
+import threading
+from queue import Queue
+from time import monotonic, sleep
+
+from telegram.error import BadRequest, ChatMigrated, NetworkError, RetryAfter, Unauthorized
+
+from deployments import RateLimiter
+from single_flight import SingleFlight
+
+
+# Telegram's limits for bulk notifications
+MAX_PER_SECOND = 30
+CHAT_INTERVAL = 1.0
+
+
+class Broadcast:
+    """
+    Progress of one fan-out. wait() blocks until every chat was served.
+    """
+
+    def __init__(self, pending):
+        self.sent = 0
+        self.failed = 0
+        self.pending = pending
+        self.started = monotonic()
+        self.finished = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        if not pending:
+            self._finish()
+
+
+    def _finish(self):
+        self.finished = monotonic()
+        self._done.set()
+
+
+    def _record(self, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.pending -= 1
+            if self.pending == 0:
+                self._finish()
+
+
+    def wait(self, timeout=None):
+        '''Returns True if the broadcast finished.'''
+        return self._done.wait(timeout)
+
+
+    @property
+    def seconds(self):
+        return (self.finished or monotonic()) - self.started
+
+
+    def __repr__(self):
+        return f'<Broadcast sent {self.sent}, failed {self.failed}, pending {self.pending}, {self.seconds:.1f}s>'
+
+
+class Broadcaster:
+    """
+    Sends photos to many chats through a rate-limited queue.
+    on_unreachable(chat_id) is called for chats that blocked the bot
+    or don't exist anymore (i.e. to unsubscribe them), on_migrated(chat_id,
+    new_chat_id) for chats that moved to a new id. Uploads go through
+    flights (a SingleFlight shared with the bot), so a broadcast and a
+    user request starting together upload a picture only once.
+    """
+
+    def __init__(self, bot, max_per_second=MAX_PER_SECOND, chat_interval=CHAT_INTERVAL,
+                 workers=8, max_attempts=4, on_unreachable=None, on_migrated=None, flights=None):
+        self.bot = bot
+        self.limiter = RateLimiter(max_per_second)
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.on_unreachable = on_unreachable
+        self.on_migrated = on_migrated
+        self.flights = flights or SingleFlight()
+        self._queue = Queue()
+        self._chat_next = {}         # chat_id -> earliest time of the next send to it
+        self._paused_until = 0       # set by RetryAfter, holds back all workers
+        self._lock = threading.Lock()
+        self._threads = []
+
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'broadcast-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+
+    def broadcast_photo(self, pic_file, chat_ids, caption=None, photo_ids=None):
+        '''
+        Sends pic_file to all chat_ids. Uploads it unless photo_ids
+        (pic_file -> (mtime, file_id), shared with the bot) has the
+        current version. Returns a Broadcast, the sends are queued.
+        '''
+        chat_ids = list(chat_ids)
+        mtime = os.path.getmtime(pic_file)
+        photo_ids = {} if photo_ids is None else photo_ids
+
+        cached = photo_ids.get(pic_file)
+        file_id = cached[1] if cached and cached[0] == mtime else None
+        uploaded, failed = 0, 0
+
+        # Uploads to the first chat that accepts it, that chat is served
+        def upload():
+            nonlocal uploaded, failed
+            with open(pic_file, 'rb') as img:
+                payload = img.read()
+            while chat_ids:
+                message = self._send_now(chat_ids.pop(0), payload, caption)
+                if message:
+                    uploaded = 1
+                    file_id = message.photo[-1].file_id
+                    photo_ids[pic_file] = (mtime, file_id)
+                    return file_id
+                failed += 1
+            raise RuntimeError(f'No chat accepted the upload of {pic_file}.')
+
+        if file_id is None:
+            try:
+                # Same key as MerchBot.sendPic(): a concurrent upload of this version is waited for
+                file_id, _ = self.flights.do(('upload', pic_file, mtime), upload)
+            except Exception as e:
+                logging.warning(f'Broadcast of {pic_file} failed: {e}')
+                chat_ids = []
+
+        return self.send_photo(chat_ids, file_id, caption, sent=uploaded, failed=failed)
+
+
+    def send_photo(self, chat_ids, file_id, caption=None, sent=0, failed=0):
+        '''
+        Queues sending an uploaded photo to all chat_ids. Returns a Broadcast
+        (starting with sent and failed chats served elsewhere).
+        '''
+        chat_ids = list(chat_ids)
+        broadcast = Broadcast(len(chat_ids))
+        broadcast.sent, broadcast.failed = sent, failed
+        for chat_id in chat_ids:
+            self._queue.put((chat_id, file_id, caption, 1, 0, broadcast))
+        return broadcast
+
+
+    def _wait_turn(self, chat_id):
+        '''Blocks until a message may be sent to chat_id.'''
+        while True:
+            delay = self._paused_until - monotonic()
+            if delay <= 0:
+                break
+            sleep(delay)
+
+        with self._lock:
+            now = monotonic()
+            delay = self._chat_next.get(chat_id, 0) - now
+            self._chat_next[chat_id] = max(now, self._chat_next.get(chat_id, 0)) + self.chat_interval
+        if delay > 0:
+            sleep(delay)
+
+        self.limiter.wait()
+
+
+    def _attempt(self, chat_id, photo, caption, attempt):
+        '''
+        One send. Returns ('sent', message), ('failed', None) or
+        ('retry', (chat_id, delay, attempt)) of the next attempt.
+        '''
+        self._wait_turn(chat_id)
+        try:
+            return 'sent', self.bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+
+        except RetryAfter as e:
+            # Flood limit: everyone waits
+            with self._lock:
+                self._paused_until = max(self._paused_until, monotonic() + e.retry_after)
+            if attempt >= self.max_attempts:
+                logging.warning(f'Giving up on chat {chat_id} after {attempt} flood limits.')
+                return 'failed', None
+            logging.warning(f'Broadcast hit the flood limit, pausing for {e.retry_after}s.')
+            return 'retry', (chat_id, 0, attempt + 1)
+
+        except ChatMigrated as e:
+            logging.info(f'Chat {chat_id} migrated to {e.new_chat_id}.')
+            if self.on_migrated:
+                self.on_migrated(chat_id, e.new_chat_id)
+            return 'retry', (e.new_chat_id, 0, attempt)
+
+        except (Unauthorized, BadRequest) as e:
+            logging.info(f'Chat {chat_id} is unreachable: {e}')
+            if isinstance(e, Unauthorized) or 'chat not found' in str(e).lower():
+                if self.on_unreachable:
+                    self.on_unreachable(chat_id)
+            return 'failed', None
+
+        except NetworkError as e:
+            if attempt >= self.max_attempts:
+                logging.warning(f'Giving up on chat {chat_id} after {attempt} attempts: {e}')
+                return 'failed', None
+            return 'retry', (chat_id, 2 ** attempt, attempt + 1)
+
+
+    def _send_now(self, chat_id, photo, caption):
+        '''Sends in the calling thread, retrying as needed. Returns the message or None.'''
+        attempt = 1
+        while True:
+            outcome, result = self._attempt(chat_id, photo, caption, attempt)
+            if outcome != 'retry':
+                return result
+            chat_id, delay, attempt = result
+            sleep(delay)
+
+
+    def _work(self):
+        while True:
+            chat_id, photo, caption, attempt, not_before, broadcast = self._queue.get()
+            try:
+                delay = not_before - monotonic()
+                if delay > 0:
+                    sleep(delay)
+
+                outcome, result = self._attempt(chat_id, photo, caption, attempt)
+                if outcome == 'retry':
+                    chat_id, delay, attempt = result
+                    self._queue.put((chat_id, photo, caption, attempt, monotonic() + delay, broadcast))
+                else:
+                    broadcast._record(outcome == 'sent')
+
+            except Exception:
+                logging.exception(f'Broadcast to {chat_id} failed.')
+                broadcast._record(False)
+
+            finally:
+                self._queue.task_done()
@@ -1,15 +1,22 @@
 import os, inspect, sys
+import csv
+import json
 import random
-import pandas as pd
+import threading
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
 from time import time, sleep
 from datetime import datetime
 
 from etherscan import Etherscan
+from web3 import HTTPProvider, Web3
 from web3.auto.infura import w3
 
 import lookups as lu
+import telemetry as tm
+from erc20_supply import SUPPLY_SERVICE
+from loan_decoder import decode_float_columns, raw_loan_data
 
 logfile = 'statsbot_logging.txt'
 
@@ -20,12 +27,15 @@ logfile = 'statsbot_logging.txt'
 #############################################################################
 
 
-# Initialize Etherscan API
+# Initialize Etherscan API. Default client of collection contexts.
 API_KEY = os.environ['ETHERSCAN_API_KEY']
 etherscan = Etherscan(API_KEY)
 
-# Connect to ETH Node (Infura)
-eth = w3.eth
+# The ETH node connection (Infura, w3) is the default one of collection contexts
+
+# Helper function: Web3 provider of another RPC endpoint (replay.py wraps it to record and replay)
+def make_provider(rpc_url):
+    return HTTPProvider(rpc_url)
 
 # Contract addresses
 loan_address = '0xbFE28f2d7ade88008af64764eA16053F705CF1f0'
@@ -35,29 +45,102 @@ loan_fac_address = '0x49aF18b1ecA40Ef89cE7F605638cF675B70012A7'
 
 #############################################################################
 #
-# Global variables
+# Collection context
+#
+#   All state of a data collection is kept in a CollectionContext instead of
+#   module globals, so several collections can run in one process at the same
+#   time (i.e. a refresh next to a backfill, or one per deployment on threads).
+#   Every function below takes an optional ctx; without one, DEFAULT_CONTEXT
+#   is used.
 #
-#   ABI_LOAN_FAC      abi for smart contract LoanFactory.sol
-#   ABI_LOAN          abi for smart contract Loan.sol
-#   LOAN_FAC          instantiated & queryable smart contract LoanFactory.sol
-#   ALL_LOANS_DATA    dict of dicts: {loan_address_i: {metric1: val, metric2: val, ...}}
-#   SCRAPED_PRICES    temporary storage for asset prices to avoid unnecessary scraping
-#   CONNECTION_ERRORS connection error counter (for debugging phase)
+#   ABIS    ABIs fetched so far {contract address: abi}. ABIs never change,
+#           so this cache is shared by all contexts.
 #
 #############################################################################
 
 
-# Query Etherscan API to get ABI for of contract address
-def get_abi(address):
-    abi = etherscan.get_contract_abi(address)
-    return abi
-
-def instantiate_contract(address, abi):
-    contract = eth.contract(address=address, abi=abi)
+ABIS = {}
+
+
+class CollectionContext:
+    """
+    Clients, caches and counters of one data collection.
+
+        w3, eth             web3 connection (default: Infura mainnet)
+        etherscan           Etherscan client
+        factory_address     address of the LoanFactory.sol deployment
+        rpc_limiter         optional rate limiter of RPC calls (see deployments.py)
+        supply_service      reads token supplies (default: the mainnet SUPPLY_SERVICE of erc20_supply.py)
+        abi_loan_fac        abi for smart contract LoanFactory.sol (default: of the mainnet contract)
+        abi_loan            abi for smart contract Loan.sol (default: of the mainnet contract)
+        loan_fac            instantiated & queryable smart contract LoanFactory.sol
+        all_loans           set of addresses of all loans ever taken out
+        all_loans_data      dict of dicts: {loan_address_i: {metric1: val, metric2: val, ...}}
+        loan_columns        (all_loans_data, its decoded columns), see get_loan_columns()
+        scraped_prices      temporary storage for asset prices to avoid unnecessary scraping
+        connection_errors   connection error counter (for debugging phase)
+
+    ABIs, loan_fac and loan data are loaded on first use (see load_all_loans_data()),
+    so creating a context doesn't query any API.
+    """
+
+    def __init__(self, rpc_url=None, factory_address=None, rpc_limiter=None, etherscan_client=None, abis=None,
+                 supply_service=None):
+        self.w3 = Web3(make_provider(rpc_url)) if rpc_url else w3
+        self.etherscan = etherscan_client or etherscan
+        self.factory_address = factory_address or loan_fac_address
+        self.rpc_limiter = rpc_limiter
+        self.supply_service = supply_service or SUPPLY_SERVICE
+        self.abi_loan_fac, self.abi_loan = abis or (None, None)
+        self.loan_fac = None
+        self.all_loans = set()
+        self.all_loans_data = {}
+        self.loan_columns = None
+        self.scraped_prices = {}
+        self.connection_errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def eth(self):
+        return self.w3.eth
+
+
+DEFAULT_CONTEXT = CollectionContext()
+
+
+# Helper function: The given context or the default one
+def get_context(ctx=None):
+    return DEFAULT_CONTEXT if ctx is None else ctx
+
+
+# Query Etherscan API to get ABI for of contract address (once per address)
+def get_abi(address, ctx=None):
+    if address not in ABIS:
+        with tm.ETHERSCAN_SECONDS.time('getabi'):
+            ABIS[address] = get_context(ctx).etherscan.get_contract_abi(address)
+    return ABIS[address]
+
+# Calls a (view) function of a contract and records the call in the RPC metrics
+def call_contract(caller, method, *args, ctx=None):
+    limiter = get_context(ctx).rpc_limiter
+    if limiter is not None:
+        limiter.wait()
+    with tm.RPC_SECONDS.time(method):
+        return getattr(caller, method)(*args)
+
+def instantiate_contract(address, abi, ctx=None):
+    contract = get_context(ctx).eth.contract(address=address, abi=abi)
     return contract
 
-ABI_LOAN_FAC = get_abi(loan_fac_address)
-ABI_LOAN = get_abi(loan_address)
+# Fetches the ABIs of LoanFactory.sol and Loan.sol once (unless the context has its own)
+def load_abis(ctx=None):
+    ctx = get_context(ctx)
+
+    if ctx.loan_fac is None:
+        if ctx.abi_loan_fac is None:
+            ctx.abi_loan_fac = get_abi(loan_fac_address, ctx)
+            ctx.abi_loan = get_abi(loan_address, ctx)
+        ctx.loan_fac = instantiate_contract(ctx.w3.toChecksumAddress(ctx.factory_address), ctx.abi_loan_fac, ctx)
 
 
 # Appends a row (datetime + log message) to a logfile.
@@ -80,118 +163,126 @@ def log(logfile, _str):
 
 
 
-# ALL_LOANS <- addresses of all loans ever taken out
-LOAN_FAC = instantiate_contract(loan_fac_address, ABI_LOAN_FAC)
-
-try:
-    ALL_LOANS = set(LOAN_FAC.caller.getLoans())
-except Exception as e:
-    message = f"Couldn't query LoanFactory.sol. Aborted data collection. ({e})"
-    print(message)
-    log(logfile, message)
-
-
-
-# Helper function needed by get_loan_data()
-def extract_loan_details(loan_dict):
-    '''Splits up 'loan_details' into single entries, deletes original.'''
-
-    details = loan_dict['loan_details']
-
-    # Add keys and values to dict
-    loan_dict['address_lender'] = details[0]
-    loan_dict['address_borrower'] = details[1]
-    loan_dict['address_lending_token'] = details[2]
-    loan_dict['address_collateral_token'] = details[3]
-    loan_dict['principal'] = details[4]
-    loan_dict['interest'] = details[5]
-    loan_dict['duration'] = details[6]
-    loan_dict['collateral'] = details[7]
-
-    # Remove original entry
-    del loan_dict['loan_details']
-    return loan_dict
-
-# Helper function needed by get_loan_data()
-def extract_meta_data(loan_dict):
-    '''Splits up 'meta_data' into single entries, deletes original.'''
-
-    meta = loan_dict['meta_data']
-
-    # Add keys and values to dict
-    loan_dict['loan_status'] = meta[0]
-    loan_dict['ts_start'] = meta[1]
-    loan_dict['ts_repaid'] = meta[2]
-    loan_dict['liquidatable_t_allowance'] = meta[3]
-
-    # Remove original entry
-    del loan_dict['meta_data']
-    return loan_dict
-
 # Helper function for get_all_loans(): Get a dict of loan data for a loan_address
-def get_loan_data(loan_address):
-    '''Takes a loan address and returns a dictionary of loan data.'''
-    global ABI_LOAN
+def get_loan_data(loan_address, block_identifier='latest', immutable_cache=None, ctx=None):
+    '''
+    Takes a loan address and returns a dictionary of loan data at a block
+    (default: latest). Loan details and due date never change, so if a dict
+    immutable_cache is passed, they are queried only once per loan.
+    '''
+    ctx = get_context(ctx)
+    load_abis(ctx)
 
-    d = {}
     # Instantiate contract to make it callable
-    loan = eth.contract(address=loan_address, abi=ABI_LOAN)
-    caller = loan.caller()
+    loan = instantiate_contract(loan_address, ctx.abi_loan, ctx)
+    caller = loan.caller(block_identifier=block_identifier)
 
     # Get data
-    d['collateral_balance'] = caller.getCollateralBalance()
-    d['loan_details'] = caller.getLoanDetails()
-    d['meta_data'] = caller.getLoanMetadata()
-    d['ts_due'] = caller.getTimestampDue()
-    d['is_defaulted'] = caller.isDefaulted()
-
-    # Extract nested data
-    d = extract_loan_details(d)
-    d = extract_meta_data(d)
+    collateral_balance = call_contract(caller, 'getCollateralBalance', ctx=ctx)
+    if immutable_cache is not None and loan_address in immutable_cache:
+        loan_details, ts_due = immutable_cache[loan_address]
+    else:
+        loan_details = call_contract(caller, 'getLoanDetails', ctx=ctx)
+        ts_due = call_contract(caller, 'getTimestampDue', ctx=ctx)
+        if immutable_cache is not None:
+            immutable_cache[loan_address] = (loan_details, ts_due)
+    meta_data = call_contract(caller, 'getLoanMetadata', ctx=ctx)
+    is_defaulted = call_contract(caller, 'isDefaulted', ctx=ctx)
 
-    return d
+    # Flatten the nested data (see loan_decoder.py)
+    return raw_loan_data(collateral_balance, loan_details, meta_data, ts_due, is_defaulted)
 
 # Data of all loans ever taken out on yield.credit
-ALL_LOANS_DATA = {loan: get_loan_data(loan) for loan in ALL_LOANS}
+def load_all_loans_data(ctx=None):
+    '''
+    Queries LoanFactory.sol for the addresses of all loans ever taken out
+    and (re)loads their data into the context's all_loans and all_loans_data.
+    Returns all_loans_data. Raises if LoanFactory.sol can't be queried.
+    '''
+    ctx = get_context(ctx)
+    load_abis(ctx)
+
+    try:
+        all_loans = set(call_contract(ctx.loan_fac.caller, 'getLoans', ctx=ctx))
+    except Exception as e:
+        message = f"Couldn't query LoanFactory.sol. Aborted data collection. ({e})"
+        print(message)
+        log(logfile, message)
+        raise
+
+    # Build the new data completely before replacing the old one
+    all_loans_data = {loan: get_loan_data(loan, ctx=ctx) for loan in all_loans}
+    ctx.all_loans, ctx.all_loans_data = all_loans, all_loans_data
+
+    return ctx.all_loans_data
+
+# Replaces all_loans_data with previously collected loan data (i.e. from a cache)
+def set_all_loans_data(loans_data, ctx=None):
+    ctx = get_context(ctx)
+    ctx.all_loans, ctx.all_loans_data = set(loans_data), loans_data
 
 # Helper functions: Loan filters
-def get_all_loans():
-    global ALL_LOANS_DATA
-    return ALL_LOANS_DATA
-def get_active_loans():
-    global ALL_LOANS_DATA
-    active = {k: v for k, v, in ALL_LOANS_DATA.items() if v['loan_status'] == 0}
+def get_all_loans(ctx=None):
+    return get_context(ctx).all_loans_data
+def get_active_loans(ctx=None):
+    active = {k: v for k, v, in get_all_loans(ctx).items() if v['loan_status'] == 0}
     return active
-def get_repaid_loans():
-    global ALL_LOANS_DATA
-    repaid = {k: v for k, v, in ALL_LOANS_DATA.items() if v['loan_status'] == 1}
+def get_repaid_loans(ctx=None):
+    repaid = {k: v for k, v, in get_all_loans(ctx).items() if v['loan_status'] == 1}
     return repaid
-def get_defaulted_loans():
-    global ALL_LOANS_DATA
-    defaulted = {k: v for k, v, in ALL_LOANS_DATA.items() if v['loan_status'] == 2}
+def get_defaulted_loans(ctx=None):
+    defaulted = {k: v for k, v, in get_all_loans(ctx).items() if v['loan_status'] == 2}
     return defaulted
-def get_non_defaulted_loans():
-    global ALL_LOANS_DATA
-    non_defaulted = {k: v for k, v, in ALL_LOANS_DATA.items() if v['loan_status'] != 2}
+def get_non_defaulted_loans(ctx=None):
+    non_defaulted = {k: v for k, v, in get_all_loans(ctx).items() if v['loan_status'] != 2}
     return non_defaulted
-def get_loans_w_bogus_status():
+def get_loans_w_bogus_status(ctx=None):
     '''For debugging only'''
-    global ALL_LOANS_DATA
-    bogus = {k: v for k, v, in ALL_LOANS_DATA.items() if v['loan_status'] == 4}
+    bogus = {k: v for k, v, in get_all_loans(ctx).items() if v['loan_status'] == 4}
     return bogus
 
-all_loan_addies = set(get_all_loans().keys())
-active_addies = set(get_active_loans().keys())
-repaid_addies = set(get_repaid_loans().keys())
-defaulted_addies = set(get_defaulted_loans().keys())
-bogus_addies = set(get_loans_w_bogus_status().keys())    # only for debugging
+# Decoded columns of the context's loans (see loan_decoder.py)
+def get_loan_columns(ctx=None):
+    '''
+    Returns {field: tuple of values} of all loans, amounts as floats in
+    token units. Decoded once per loan book, all aggregations share them.
+    '''
+    ctx = get_context(ctx)
+    loans_data, cached = ctx.all_loans_data, ctx.loan_columns
+
+    # Possibility: The loan book was replaced since the columns were decoded
+    if cached is None or cached[0] is not loans_data:
+        cached = ctx.loan_columns = (loans_data, decode_float_columns(loans_data))
+    return cached[1]
+
 
-n_total = len(all_loan_addies)
-n_repaid = len(repaid_addies)
-n_active = len(active_addies)
-n_defaulted = len(defaulted_addies)
 
+# Max seconds to wait after scraping a page (to scrape in a nice way)
+SCRAPE_DELAY = 2
 
+# Factor of all waits after scraping (replay.py sets it to 0, replayed pages need no waits)
+SCRAPE_DELAY_SCALE = 1
+
+# Helper function: Downloads a web page with a browser user agent, returns bytes
+def fetch_page(url):
+    userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
+        ' Chrome/41.0.2228.0 Safari/537.36'
+    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
+    return urllib.request.urlopen(req).read()
+
+# Returns the USD prices of 1 asset between two unix times from CoinGecko's API
+def get_token_price_history(token_str, start, end):
+    '''
+    Takes a token's coingecko_str and a time range. Returns a list of
+    (unix time, USD price), ascending. CoinGecko returns hourly prices
+    for ranges up to 90 days and daily prices for longer ones.
+    '''
+    url = (f'https://api.coingecko.com/api/v3/coins/{token_str}/market_chart/range'
+           f'?vs_currency=usd&from={int(start)}&to={int(end)}')
+    with tm.COINGECKO_SECONDS.time('history'):
+        data = json.loads(fetch_page(url))
+
+    return [(ms // 1000, price) for ms, price in data.get('prices', [])]
 
 # Helper function for Scrapes and returns price of 1 asset from coingecko
 def get_token_price(token_str):
@@ -200,11 +291,9 @@ def get_token_price(token_str):
     Returns float of current asset price (USD) as given on coingecko.com.
     '''
     url = 'https://www.coingecko.com/en/coins/' + token_str
-    userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
-        ' Chrome/41.0.2228.0 Safari/537.36'
-    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
-    html = urllib.request.urlopen(req)
-    bs = BeautifulSoup(html.read(), 'html.parser')
+    with tm.COINGECKO_SECONDS.time('price'):
+        html = fetch_page(url)
+    bs = BeautifulSoup(html, 'html.parser')
 
     # Scrape price data
     varList = bs.findAll('span', {'class': 'no-wrap'})
@@ -212,7 +301,7 @@ def get_token_price(token_str):
     price_usd = float(priceStr.replace(',','').replace('$',''))
 
     # Sleep max 2 seconds before function can be called again
-    sleep(random.random()*2)
+    sleep(random.random() * SCRAPE_DELAY * SCRAPE_DELAY_SCALE)
 
     return price_usd
 
@@ -280,28 +369,28 @@ def clean(string):
 # Helper function: Looks up token symbol in lookups.py file
 def get_token_symbol(token_address, logfile=None):
 
-    try:
-        return lu.token_map[token_address]['symbol']
+    info = lu.token_info(token_address)
+    if info:
+        return info['symbol']
 
-    except KeyError:
-        message = f"get_token_symbol(): No entry in token_map in lookups.py for {token_address}."
-        print(message)
+    message = f"get_token_symbol(): No entry in token_map in lookups.py for {token_address}."
+    print(message)
 
-        if logfile:
-            log(logfile, message)
+    if logfile:
+        log(logfile, message)
 
 # Helper function: Looks up token coingecko str in lookups.py file
 def get_token_str(token_address, logfile=None):
 
-    try:
-        return lu.token_map[token_address]['coingecko_str']
+    info = lu.token_info(token_address)
+    if info:
+        return info['coingecko_str']
 
-    except KeyError:
-        message = f"get_token_str(): No entry in token_map in lookups.py for {token_address}."
-        print(message)
+    message = f"get_token_str(): No entry in token_map in lookups.py (or the tokens of its deployment) for {token_address}."
+    print(message)
 
-        if logfile:
-            log(logfile, message)
+    if logfile:
+        log(logfile, message)
 
 # Helper function: Reverse lookup from token_map
 def get_address_by_symbol(symbol):
@@ -310,62 +399,37 @@ def get_address_by_symbol(symbol):
 
 # Helper function: Looks up token decimals value in lookups.py file
 def get_token_decimals(token_address, logfile=None):
-    try:
-        return lu.token_map[token_address]['decimals']
-    except KeyError:
-        message = f"No entry in token_map in lookups.py for {token_address}."
-        print(message)
-        if logfile:
-            log(logfile, message)
-
-# Decode ERC20 amount based on its number of decimals
-def apply_decimals(amount, token_address=None, token_symbol=None, logfile=None):
-    '''
-    Takes ERC20 address string and looks up / fetches from web3
-    decimal information. Returns correct value based on decimals.
-    '''
-
-    if token_symbol:
-        token_address = get_address_by_symbol(symbol)
-
-    if token_address:
-        decimals = get_token_decimals(token_address, logfile=logfile)
-        DECIMALS = 10**decimals
-
-        return amount // DECIMALS
-
-    else:
-        print('Either a token adress or symbol string has to be specified.')
-
-
+    info = lu.token_info(token_address)
+    if info:
+        return info['decimals']
+    message = f"No entry in token_map in lookups.py for {token_address}."
+    print(message)
+    if logfile:
+        log(logfile, message)
 
-# Some global variables for data fetching
-SCRAPED_PRICES = {}      # temporary storage for asset prices to avoid unnecessary scraping
-CONNECTION_ERRORS = 0    # connection error counter (for debugging phase)
 
 
 # Resets prices stored in memory for sparse scraping.
-def reset_scraped_prices(verbose=False):
+def reset_scraped_prices(verbose=False, ctx=None):
     '''
     Resets the saved prices used for sparse scraping.
     Needs to be reset whenever new metrics are calculated that
     depend on current prices of cryptos.
     '''
-    global SCRAPED_PRICES
-    SCRAPED_PRICES = {}
+    get_context(ctx).scraped_prices = {}
     if verbose:
         print('Cache for previously scraped prices has been cleared.')
 
 # Wrapper to handle connection errors for data fetching functions
-def safe_getter(function, delay_seconds=10, max_tries=None, try_nr=0, verbose=None):
+def safe_getter(function, delay_seconds=10, max_tries=None, try_nr=0, verbose=None, ctx=None):
     '''
     Repeatedly tries to run a function until there are no connection
-    errors. Returns whatever the function returns.
+    errors. Returns whatever the function returns. Connection errors
+    are counted in the context.
     Example:
             a = safe_getter(some_function) (<- func without parentheses)
     '''
-    global CONNECTION_ERRORS
-
+    ctx = get_context(ctx)
     name = function.__name__
     result = None
 
@@ -376,7 +440,9 @@ def safe_getter(function, delay_seconds=10, max_tries=None, try_nr=0, verbose=No
     except ConnectionError as e:
 
         print(f'{name}(): Encountered a connection error.')
-        CONNECTION_ERRORS += 1
+        with ctx._lock:
+            ctx.connection_errors += 1
+        tm.CONNECTION_ERRORS.inc(name)
 
         sleep(delay_seconds)
         print('Trying again...')
@@ -387,28 +453,33 @@ def safe_getter(function, delay_seconds=10, max_tries=None, try_nr=0, verbose=No
 
             # Repeated calling of function until max_tries is reached
             if try_nr < max_tries:
-                safe_getter(function, delay_seconds=delay_seconds, max_tries=max_tries, try_nr=try_nr, verbose=verbose)
+                safe_getter(function, delay_seconds=delay_seconds, max_tries=max_tries, try_nr=try_nr, verbose=verbose, ctx=ctx)
 
             else:
                 print(f'{name}(): Maximum connection attempts ({max_tries}) reached. Returned {result}.')
 
         # Possibility: max_tries not set. Unlimited repetitions.
         else:
-            safe_getter(function, delay_seconds=delay_seconds, max_tries=max_tries, try_nr=try_nr, verbose=verbose)
+            safe_getter(function, delay_seconds=delay_seconds, max_tries=max_tries, try_nr=try_nr, verbose=verbose, ctx=ctx)
 
     return result
 
-# Helper function: Tries to get token price from SCRAPED_PRICES before scraping
-def sparse_scrape(token_addy, logfile=None, verbose=False):
+# Helper function: Tries to get token price from the context's scraped_prices before scraping
+def sparse_scrape(token_addy, logfile=None, verbose=False, ctx=None):
     '''
-    Returns current USD value of 1 token of given address.
-    Scrapes token price from web only if necessary.
-    Alway tries to read from SCRAPED_PRICES dict first.
+    Returns current USD value of 1 token of given address (None if the
+    token has no token map entry). Scrapes token price from web only if necessary.
+    Alway tries to read from the scraped_prices dict first.
     '''
+    scraped_prices = get_context(ctx).scraped_prices
+
     # Scrape every token once only
-    if token_addy in SCRAPED_PRICES:
+    cached = token_addy in scraped_prices
+    tm.count_cache('prices', cached)
+
+    if cached:
         # Read from memory
-        token_price = SCRAPED_PRICES[token_addy]
+        token_price = scraped_prices[token_addy]
 
         # For debugging:
         symbol = get_token_symbol(token_addy)
@@ -418,207 +489,133 @@ def sparse_scrape(token_addy, logfile=None, verbose=False):
     else:
         # Scrape from web
         token_str = get_token_str(token_addy, logfile)
-        token_price = get_token_price(token_str)
-        SCRAPED_PRICES[token_addy] = token_price
 
-    return token_price
+        # Possibility: Token without token map entry (i.e. of another network). It has no price.
+        if token_str is None:
+            return None
 
-# Helper function: Returns (principal amount, principal token) for a loan
-def get_principal_token_tup(loan_addy):
-    '''
-    Returns a tuple (decoded amount, token_addy) for borrowed amount of loan
-    '''
-    loan_data = get_all_loans()[loan_addy]
-    raw = loan_data['principal']
-    token_addy = loan_data['address_lending_token']
-    decoded = apply_decimals(raw, token_addy)
+        token_price = get_token_price(token_str)
+        scraped_prices[token_addy] = token_price
 
-    # For debugging:
-    #token_symbol = get_token_symbol(token_addy)
+    return token_price
 
-    return decoded, token_addy
+# Returns addresses of all tokens used as principal or collateral by any loan
+def get_loan_tokens(ctx=None):
+    tokens = set()
+    for loan in get_all_loans(ctx).values():
+        tokens.add(loan['address_lending_token'])
+        tokens.add(loan['address_collateral_token'])
+    return tokens
 
-# Helper function: Returns (collateral amount, collateral token) for a loan
-def get_collateral_token_tup(loan_addy):
+# Scrapes prices of several tokens concurrently into the context's scraped_prices
+def prefetch_prices(token_addies, max_workers=4, logfile=None, verbose=False, ctx=None):
     '''
-    Returns a tuple (decoded amount, token_addy) for amt collateralized of loan
+    Fills scraped_prices for all token_addies, scraping up to max_workers
+    tokens at the same time. Returns a dict {token_addy: price}, tokens
+    without token map entry are left out.
     '''
-    loan_data = get_all_loans()[loan_addy]
-    raw = loan_data['collateral']
-    token_addy = loan_data['address_collateral_token']
-    decoded = apply_decimals(raw, token_addy)
-
-    # For debugging:
-    #token_symbol = get_token_symbol(token_addy)
-
-    return decoded, token_addy
-
-# Helper function: Returns USD amount *currently* borrowed
-def get_principal_usd_val(loan_addy, logfile=None, verbose=False):
-    amt_raw, token = get_principal_token_tup(loan_addy)
-    token_price = sparse_scrape(token, verbose=verbose)
-    amt_usd = amt_raw * token_price
-
-    # For degugging:
-    #symbol = get_token_symbol(token)
-    #print(f'Loan {loan_addy}:')
-    #print(f'Borrowed {amt_raw} {symbol} ({amt_usd} USD).')
-
-    return amt_usd
-
-# Helper function: Returns USD amount of collateral *currently* borrowed against
-def get_collateral_usd_val(loan_addy, logfile=None, verbose=False):
-    amt_raw, token = get_collateral_token_tup(loan_addy)
-    token_price = sparse_scrape(token, verbose=verbose)
-    amt_usd = amt_raw * token_price
-
-    # For degugging:
-    #symbol = get_token_symbol(token)
-    #print(f'Loan {loan_addy}:')
-    #print(f'Borrowed {amt_raw} {symbol} ({amt_usd} USD).')
-
-    return amt_usd
-
-# Helper function: Returns decoded interest rate for a loan
-def get_interest_rate(loan_addy, logfile=None):
-    loan_data = get_all_loans()[loan_addy]
-    raw = loan_data['interest']
-    decoded = raw / 100
-
-    return decoded
-
-# Helper function: Converts duration in timestamp (seconds) to days
-def ts_duration_to_days(ts):
-
-    if isinstance(ts, str):
-        ts = int(ts)
+    ctx = get_context(ctx)
+    missing = [token for token in token_addies if token not in ctx.scraped_prices]
 
-    return ts // (24 * 3600)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda token: sparse_scrape(token, logfile=logfile, ctx=ctx), missing))
 
-# Helper function: Returns decoded loan duration (days)
-def get_duration_days(loan_addy, logfile=None):
-    loan_data = get_all_loans()[loan_addy]
+    if verbose:
+        print(f'Scraped {len(missing)} token prices.')
 
-    raw = loan_data['duration']
-    decoded = ts_duration_to_days(raw)
+    return {token: ctx.scraped_prices[token] for token in token_addies if token in ctx.scraped_prices}
 
-    return decoded
+# Replaces scraped_prices with previously scraped prices (i.e. from a cache)
+def set_scraped_prices(prices, ctx=None):
+    get_context(ctx).scraped_prices = dict(prices)
 
-# Helper function: Returns the current supply for an ERC20 token (web3 query). Nan if token without totalSupply() function.
-def get_supply_for_erc20(symbol=None, address=None):
+# Helper function: USD values of an amount column of the loans whose status passes a filter
+def get_usd_values(amount_field, token_field, status_filter, logfile=None, verbose=False, ctx=None):
     '''
-    Queries web3 for totalSupply() of token, adjusts value using the
-    correct amount of decimals, returns current total supply.
-    Accepts a token's symbol (i.e. 'LINK') or its contract address.
-    Returns NaN if token doesn't have a totalSupply() function.
+    Takes an amount field (i.e. 'principal'), the field of its token and a
+    function status -> bool. Returns a list of USD values, one per loan.
+    Loans in tokens without a price or token data (amount None) are left out.
     '''
-    # contract.totalSupply() does not work for these tokens
-    not_possible = {'AMPL', 'AAVE', 'TUSD', 'USDC', 'USDT', 'WBTC', 'CRO'}
-    addies_not_possible = {get_address_by_symbol(s) for s in not_possible}
+    columns = get_loan_columns(ctx)
+    prices = {}
+    values = []
+    for amount, token, status in zip(columns[amount_field], columns[token_field], columns['loan_status']):
+        if status_filter(status):
+            if token not in prices:
+                prices[token] = sparse_scrape(token, logfile=logfile, verbose=verbose, ctx=ctx)
+            if prices[token] is not None and amount is not None:
+                values.append(amount * prices[token])
+    return values
 
+# Helper function: Returns the supply of an ERC20 token (see erc20_supply.py)
+def get_supply_for_erc20(symbol=None, address=None, block_identifier='latest', ctx=None):
+    '''
+    Reads totalSupply() of all tokens in token_map in one batched call
+    (cached per block), returns the decimal-adjusted supply of the token
+    at a block (default: current). Accepts a token's symbol (i.e. 'LINK')
+    or its contract address. Raises RuntimeError if the supply can't be read.
+    '''
     if symbol:
-        if symbol in not_possible:
-            return np.nan
-
         address = get_address_by_symbol(symbol)
 
     if address:
-        if address in addies_not_possible:
-            return np.nan
-
-        checksum_address = w3.toChecksumAddress(address)
-        abi_token = get_abi(checksum_address)
-        contract = instantiate_contract(checksum_address, abi_token)
-        raw_supply = contract.caller.totalSupply()
-        decoded = apply_decimals(raw_supply, address)
-
-        return decoded
+        supply = get_context(ctx).supply_service.supply(address, block_identifier)
+        # Possibility: totalSupply() call reverted or token not in token_map
+        if supply is None:
+            raise RuntimeError(f'Could not read the total supply of {symbol or address} at block {block_identifier}.')
+        return supply
 
     else:
         print('Either token adress or symbol string has to be specified.')
 
 
 
-
-
-
 # Get sum of currently borrowed amounts
-def get_currently_borrowed(logfile=None, verbose=False):
+def get_currently_borrowed(logfile=None, verbose=False, ctx=None):
     '''
     Returns sum of borrowed amounts currently.
-    TVL = sum of all collateral USD values of active loans
+    (sum of all principal USD values of active loans)
     '''
-    active_addies = set(get_active_loans().keys())
-    principal_loan_tups = [(get_principal_usd_val(loan, logfile=logfile, verbose=verbose), loan) for loan in active_addies]
-    total = sum(tup[0] for tup in principal_loan_tups)
-
-    # For debugging:
-    #[print(ele) for ele in principal_loan_tups]
-
-    return total
+    return sum(get_usd_values('principal', 'address_lending_token', lambda status: status == 0, logfile, verbose, ctx))
 
 # Get TVL (sum of current collateral values used in loans)
-def get_current_TVL(logfile=None, verbose=False):
+def get_current_TVL(logfile=None, verbose=False, ctx=None):
     '''
     Returns current TVL.
     TVL = sum of all collateral USD values of active loans
     '''
-    active_addies = set(get_active_loans().keys())
-    collateral_loan_tups = [(get_collateral_usd_val(loan, logfile=logfile, verbose=verbose), loan) for loan in active_addies]
-    TVL = sum(tup[0] for tup in collateral_loan_tups)
-
-    # For debugging:
-    #[print(ele) for ele in collateral_loan_tups]
-
-    return TVL
+    return sum(get_usd_values('collateral', 'address_collateral_token', lambda status: status == 0, logfile, verbose, ctx))
 
 # Get avg principal USD value of all non_defaulted loans (statusses active and repaid)
-def get_avg_loan_val(logfile=None, verbose=False):
+def get_avg_loan_val(logfile=None, verbose=False, ctx=None):
     '''
     Returns average loan USD value (= principal) of all loans.
     Defaulted loans with seized collateral are excluded since
-    their principal value is always 0.
+    their principal value is always 0. 0 if there are no such loans.
     '''
-    non_def_addies = set(get_non_defaulted_loans().keys())
-    principal_loan_tups = [(get_principal_usd_val(loan, logfile=logfile, verbose=verbose), loan) for loan in non_def_addies]
-    mean = sum(tup[0] for tup in principal_loan_tups) / len(principal_loan_tups)
-
-    # For debugging:
-    #[print(ele) for ele in principal_loan_tups]
-
-    return mean
+    values = get_usd_values('principal', 'address_lending_token', lambda status: status != 2, logfile, verbose, ctx)
+    return sum(values) / len(values) if values else 0
 
 # Get avg interest rate of all loans (active, repaid, and defaulted included)
-def get_avg_interest_rate(logfile=None):
+def get_avg_interest_rate(logfile=None, ctx=None):
     '''
-    Returns average interest rate of all loans.
+    Returns average interest rate of all loans in percent (0 without loans).
     '''
-    all_addies = set(get_all_loans().keys())
-    interest_loan_tups = [(get_interest_rate(loan, logfile=logfile), loan) for loan in all_addies]
-    mean = sum(tup[0] for tup in interest_loan_tups) / len(interest_loan_tups)
-
-    # For debugging:
-    #[print(ele) for ele in interest_loan_tups]
+    interest = get_loan_columns(ctx)['interest']
+    return sum(interest) / 100 / len(interest) if interest else 0
 
-    return mean
-
-# Get avg interest rate of all loans (active, repaid, and defaulted included)
-def get_avg_loan_duration(logfile=None):
+# Get avg duration of all loans (active, repaid, and defaulted included)
+def get_avg_loan_duration(logfile=None, ctx=None):
     '''
-    Returns average duration of all loans in days.
+    Returns average duration of all loans in days (of whole days per loan),
+    0 without loans.
     '''
-    all_addies = set(get_all_loans().keys())
-    days_loan_tups = [(get_duration_days(loan, logfile=logfile), loan) for loan in all_addies]
-    mean = sum(tup[0] for tup in days_loan_tups) / len(days_loan_tups)
-
-    # For debugging:
-    #[print(ele) for ele in days_loan_tups]
-
-    return mean
+    duration = get_loan_columns(ctx)['duration']
+    return sum(seconds // (24 * 3600) for seconds in duration) / len(duration) if duration else 0
 
 # Get YLD's current total supply. Calls contract function totalSupply()
-def get_YLD_supply():
-    return get_supply_for_erc20(symbol='YLD')
+def get_YLD_supply(block_identifier='latest', ctx=None):
+    return get_supply_for_erc20(symbol='YLD', block_identifier=block_identifier, ctx=ctx)
 
 # Get # of minted or burned YLD since mainnet. Number positive = minted. Negative = burned.
 def get_minted_burned_YLD(current_YLD_supply):
@@ -627,47 +624,68 @@ def get_minted_burned_YLD(current_YLD_supply):
     return minted_burned
 
 # Export specified loan metrics for frontend use or data collection
-def export_loan_metrics_dict(verbose=False):
+def export_loan_metrics_dict(verbose=False, YLD_total_supply=None, timestamp=None, ctx=None, with_YLD=True):
+    '''
+    Returns a dict of current loan metrics of the loans in the context.
+    The YLD supply is queried unless it has been fetched already and is
+    passed as YLD_total_supply. Without with_YLD (loans of other networks
+    than mainnet), the YLD metrics are None. timestamp is the unix time the
+    metrics refer to (default: now).
+    '''
     d = {}
 
     # Get current UTC time
-    timestamp = int(time())
+    timestamp = int(time()) if timestamp is None else int(timestamp)
     parsed_ts = datetime.utcfromtimestamp(timestamp).strftime('%d %b %Y - %H:%M UTC')
 
     # Get data
     d['time'] = parsed_ts
-    d['YLD_total_supply'] = get_YLD_supply()
-    d['YLD_minted_burned'] = get_minted_burned_YLD(d['YLD_total_supply'])
-    d['total_loans'] = len(get_all_loans())
-    d['active_loans'] = len(get_active_loans())
-    d['repaid_loans'] = len(get_repaid_loans())
-    d['defauted_loans'] = len(get_defaulted_loans())
-    d['percent_defauted'] = (d['defauted_loans'] / d['total_loans']) * 100
-    d['total_collateral_in_use_USD'] = get_current_TVL(verbose=verbose)
-    d['total_borrowed_USD'] = get_currently_borrowed(verbose=verbose)
-    d['avg_loan_val_USD'] = get_avg_loan_val(verbose=verbose)
-    d['avg_interest_rate'] = get_avg_interest_rate()
-    d['avg_loan_duration_days'] = get_avg_loan_duration()
+    if with_YLD:
+        d['YLD_total_supply'] = get_YLD_supply(ctx=ctx) if YLD_total_supply is None else YLD_total_supply
+        d['YLD_minted_burned'] = get_minted_burned_YLD(d['YLD_total_supply'])
+    else:
+        d['YLD_total_supply'] = d['YLD_minted_burned'] = None
+    status = get_loan_columns(ctx)['loan_status']
+    d['total_loans'] = len(status)
+    d['active_loans'] = status.count(0)
+    d['repaid_loans'] = status.count(1)
+    d['defauted_loans'] = status.count(2)
+    # Possibility: New deployment without loans yet
+    d['percent_defauted'] = (d['defauted_loans'] / d['total_loans']) * 100 if d['total_loans'] else 0
+    d['total_collateral_in_use_USD'] = get_current_TVL(verbose=verbose, ctx=ctx)
+    d['total_borrowed_USD'] = get_currently_borrowed(verbose=verbose, ctx=ctx)
+    d['avg_loan_val_USD'] = get_avg_loan_val(verbose=verbose, ctx=ctx)
+    d['avg_interest_rate'] = get_avg_interest_rate(ctx=ctx)
+    d['avg_loan_duration_days'] = get_avg_loan_duration(ctx=ctx)
 
     # Round all numerical output to 2 decimals
-    d = {k: round(v, 2) if not isinstance(v, str) else v for k, v in d.items()}
+    d = {k: round(v, 2) if v is not None and not isinstance(v, str) else v for k, v in d.items()}
 
     return d
 
 # Append metrics as new row to csv file
 def append_to_csv(csv_file, metrics_dict, verbose=False):
-    df = pd.DataFrame(metrics_dict, index=[0])
-    df.to_csv(csv_file, mode='a', index=False, header=not os.path.exists(csv_file))
+    '''
+    Appends metrics_dict as row to csv_file. Writes a header first if
+    csv_file doesn't exist yet. Superseded by timeseries_store.py.
+    '''
+    write_header = not os.path.exists(csv_file)
+
+    with open(csv_file, 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(metrics_dict))
+        if write_header:
+            writer.writeheader()
+        writer.writerow(metrics_dict)
 
     if verbose:
         print(f'Appended this row to {csv_file}:\n')
-        print(df.iloc[0])
+        print(metrics_dict)
 
 
 
 
 # Query web3 for ERC20 decimals. Not used currently
-def get_decimals_from_web3(address, logfile=None):
+def get_decimals_from_web3(address, logfile=None, ctx=None):
     '''
     Takes ERC20 address string, gets abi, instantiates contract,
     calls contract.functions.decimals(), returns value.
@@ -685,9 +703,9 @@ def get_decimals_from_web3(address, logfile=None):
 
     else:
         # Query web3
-        checksum_address = w3.toChecksumAddress(address)
-        abi_token = get_abi(checksum_address)
-        contract = instantiate_contract(checksum_address, abi_token)
+        checksum_address = Web3.toChecksumAddress(address)
+        abi_token = get_abi(checksum_address, ctx)
+        contract = instantiate_contract(checksum_address, abi_token, ctx)
         result = contract.functions.decimals().call()
         print(f'Decimals for {address}:', result)
 
@@ -707,11 +725,9 @@ def get_token_metrics(token_str, logfile=None, waitAfter=3):
 
     # Scrape coingecko content for given token
     url = 'https://www.coingecko.com/en/coins/' + token_str
-    userAgent = 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko)' + \
-        ' Chrome/41.0.2228.0 Safari/537.36'
-    req = urllib.request.Request(url, headers= {'User-Agent' : userAgent})
-    html = urllib.request.urlopen(req)
-    bs = BeautifulSoup(html.read(), 'html.parser')
+    with tm.COINGECKO_SECONDS.time('metrics'):
+        html = fetch_page(url)
+    bs = BeautifulSoup(html, 'html.parser')
 
     # Load necessary html tag result sets
     noWrapTags = bs.findAll('span', {'class': 'no-wrap'})  # list of html tags
@@ -770,7 +786,7 @@ def get_token_metrics(token_str, logfile=None, waitAfter=3):
                 log(logfile, message)
 
     # Wait for max {waitAfter} seconds before function can be called again (= scrape in a nice way)
-    sleep(random.random() * waitAfter)
+    sleep(random.random() * waitAfter * SCRAPE_DELAY_SCALE)
 
     return tokenDict
 
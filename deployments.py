@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tracking of several LoanFactory.sol deployments, possibly on several EVM networks.
+
+Deployments are listed in deployments.json (see deployments.example.json):
+
+    [{"name": "mainnet", "network": "mainnet",
+      "rpc_url": "https://mainnet.infura.io/v3/${WEB3_INFURA_PROJECT_ID}",
+      "loan_factory": "0x49aF18b1ecA40Ef89cE7F605638cF675B70012A7",
+      "max_rps": 10}]
+
+rpc_url may reference environment variables and defaults to Infura mainnet.
+max_rps limits the RPC calls per second of a deployment (default: no limit).
+
+Deployments on other networks than mainnet should also list their tokens,
+and may list ABI files if their contracts differ from mainnet's:
+
+    "tokens": {"0x...": {"symbol": "WMATIC", "coingecko_str": "wmatic", "decimals": 18}}
+    "abis": {"loan_factory": "abis/factory.json", "loan": "abis/loan.json"}
+
+tokens is the token map of the network (lookups.token_map only has mainnet
+tokens), abis are ABI files of LoanFactory.sol and Loan.sol (relative to
+deployments.json). Without tokens, loans in tokens of the network have no
+USD value; without abis, the ABIs of the mainnet contracts are used. Both
+are logged. Tokens of other networks are named 'network:address' (see
+lookups.token_info()), like their loans. The YLD supply is a mainnet figure:
+metrics of deployments on other networks have no YLD metrics.
+
+Every deployment is one shard. Shards are collected in a process pool,
+so adding deployments uses more cores instead of lengthening the run.
+"""
+import os
+import json
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from time import monotonic, sleep
+
+import lookups as lu
+
+
+DEPLOYMENTS_FILE = 'deployments.json'
+
+Deployment = namedtuple('Deployment', ['name', 'network', 'rpc_url', 'loan_factory', 'max_rps', 'tokens', 'abis'])
+
+
+# Reads the configured deployments
+def load_deployments(path=DEPLOYMENTS_FILE):
+    '''
+    Returns a list of Deployments from path or None if path doesn't exist.
+    Raises ValueError if the file lists no or duplicate deployments.
+    '''
+    if not os.path.isfile(path):
+        return None
+
+    with open(path) as file:
+        entries = json.load(file)
+
+    deployments = []
+    for entry in entries:
+        rpc_url = entry.get('rpc_url')
+        deployments.append(Deployment(
+            name=entry['name'],
+            network=entry.get('network', 'mainnet'),
+            rpc_url=os.path.expandvars(rpc_url) if rpc_url else None,
+            loan_factory=entry['loan_factory'],
+            max_rps=entry.get('max_rps'),
+            tokens=entry.get('tokens', {}),
+            abis=load_abi_files(entry['abis'], os.path.dirname(path)) if 'abis' in entry else None
+            ))
+
+    names = [d.name for d in deployments]
+    if not names:
+        raise ValueError(f'{path} lists no deployments.')
+    if len(set(names)) != len(names):
+        raise ValueError(f'{path} lists deployments with the same name.')
+
+    for d in deployments:
+        if d.network == 'mainnet':
+            continue
+        if not d.tokens:
+            logging.warning(f'Deployment {d.name} lists no tokens of {d.network}: loans in its tokens have no USD value.')
+        if not d.abis:
+            logging.warning(f'Deployment {d.name} lists no abis: using the ABIs of the mainnet contracts on {d.network}.')
+
+    return deployments
+
+
+# Helper function: Reads the ABI files of a deployment, returns (LoanFactory.sol ABI, Loan.sol ABI)
+def load_abi_files(files, directory=''):
+    abis = []
+    for contract in ('loan_factory', 'loan'):
+        with open(os.path.join(directory, files[contract])) as file:
+            abis.append(json.load(file))
+    return tuple(abis)
+
+
+# Helper function: Name of a token or loan address on a network ('network:address' off mainnet)
+def network_key(network, address):
+    return address if network == 'mainnet' else f'{network}:{address}'
+
+
+# Makes the token maps of all deployments known to lookups.token_info()
+def register_tokens(deployments):
+    for d in deployments:
+        if d.network != 'mainnet':
+            lu.network_token_maps.setdefault(d.network, {}).update(d.tokens)
+
+
+class RateLimiter:
+    """
+    Spaces calls to wait() at least 1 / max_per_second seconds apart.
+    """
+
+    def __init__(self, max_per_second):
+        self.interval = 1 / max_per_second
+        self._next = 0
+        self._lock = threading.Lock()
+
+
+    def wait(self):
+        with self._lock:
+            now = monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+
+# Collects the loans of one deployment. Runs in a worker process.
+def collect_shard(deployment):
+    '''
+    Returns ALL_LOANS_DATA of the LoanFactory.sol deployment.
+    '''
+    import data_aggregation as da
+
+    limiter = RateLimiter(deployment.max_rps) if deployment.max_rps else None
+    ctx = da.CollectionContext(rpc_url=deployment.rpc_url, factory_address=deployment.loan_factory,
+                               rpc_limiter=limiter, abis=deployment.abis)
+    return da.load_all_loans_data(ctx)
+
+
+# Pool the shards are collected in. replay.py collects them on threads instead,
+# so their RPC calls go through the recording / replaying providers of this process.
+SHARD_POOL = ProcessPoolExecutor
+
+
+# Collects the loans of all deployments in parallel
+def collect_shards(deployments, max_workers=None):
+    '''
+    Runs collect_shard() for every deployment in a SHARD_POOL (default: a
+    process pool). Returns a dict {deployment name: loans data}. Raises the
+    error of the first failing shard.
+    '''
+    max_workers = max_workers or min(len(deployments), os.cpu_count() or 1)
+
+    with SHARD_POOL(max_workers=max_workers) as executor:
+        futures = {d.name: executor.submit(collect_shard, d) for d in deployments}
+        shards = {}
+        for name, future in futures.items():
+            try:
+                shards[name] = future.result()
+            except Exception as e:
+                logging.error(f'Collecting loans of deployment {name} failed: {e}')
+                raise
+
+    return shards
+
+
+# Names the tokens of loans on other networks than mainnet 'network:address'
+def network_loans(loans_data, network):
+    '''
+    Returns loans_data with the token fields of every loan replaced by
+    network_key(network, token), so tokens of different networks with the
+    same address don't mix. Mainnet loans are returned as they are.
+    '''
+    if network == 'mainnet':
+        return loans_data
+
+    fields = ('address_lending_token', 'address_collateral_token')
+    return {
+        address: dict(loan, **{field: network_key(network, loan[field]) for field in fields})
+        for address, loan in loans_data.items()
+        }
+
+
+# Merges the loans of all shards into one loans data dict
+def merge_shards(shards, deployments):
+    '''
+    Returns a dict {loan key: loan data} of all loans. Loans on mainnet
+    keep their address as key, loans on other networks get 'network:address'
+    (their tokens too, see network_loans()).
+    '''
+    networks = {d.name: d.network for d in deployments}
+    merged = {}
+    for name, loans_data in shards.items():
+        network = networks[name]
+        for address, loan in network_loans(loans_data, network).items():
+            merged[network_key(network, address)] = loan
+    return merged
+
+
+# Helper function: Store file of a single deployment, i.e. yield_stats.polygon.db
+def deployment_store_file(store_file, name):
+    root, ext = os.path.splitext(store_file)
+    return f'{root}.{name}{ext}'
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+USD prices of token_map tokens derived from Uniswap V2 pool reserves.
+
+Every token is paired with the stablecoins and WETH. The pair addresses are
+computed (CREATE2), not queried, and the reserves of all pairs are read with
+a single multicall, so all prices come from the same block in one round trip.
+A token's price is taken from its deepest pool with enough liquidity.
+"""
+from eth_utils import keccak
+
+import lookups as lu
+from multicall import multicall, selector
+
+
+UNISWAP_V2_FACTORY = '0x5C69bEe701ef814a2B6a3EDD4B1652CB9cc5aA6f'
+UNISWAP_V2_INIT_CODE_HASH = bytes.fromhex('96e8ac4277198ff8b6f785478aa9a39f403cb768dd02cbee326c3e7da348845f')
+
+GET_RESERVES = selector('getReserves()')
+
+WETH = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+STABLECOINS = {
+    '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48',   # USDC
+    '0x6B175474E89094C44Da98b954EedeAC495271d0F',   # DAI
+    '0xdAC17F958D2ee523a2206206994597C13D831ec7',   # USDT
+    }
+
+# Pools with less liquidity (USD value of the quote token's reserve) are ignored
+MIN_LIQUIDITY_USD = 10000
+
+
+# Helper function: Uniswap orders the tokens of a pair by address
+def sort_tokens(token_a, token_b):
+    return tuple(sorted((token_a, token_b), key=lambda address: int(address, 16)))
+
+
+# Computes the address of the Uniswap V2 pair of two tokens (no RPC call needed)
+def pair_address(token_a, token_b, factory=UNISWAP_V2_FACTORY, init_code_hash=UNISWAP_V2_INIT_CODE_HASH):
+    token0, token1 = sort_tokens(token_a, token_b)
+    salt = keccak(bytes.fromhex(token0[2:]) + bytes.fromhex(token1[2:]))
+    return '0x' + keccak(b'\xff' + bytes.fromhex(factory[2:]) + salt + init_code_hash)[12:].hex()
+
+
+# Returns the (base, quote) pairs needed to price tokens
+def dex_pairs(tokens):
+    pairs = [(WETH, stable) for stable in sorted(STABLECOINS)]
+    for token in tokens:
+        if token not in STABLECOINS and token != WETH:
+            pairs += [(token, WETH)] + [(token, stable) for stable in sorted(STABLECOINS)]
+    return pairs
+
+
+# Helper function: Decodes getReserves() into decimal-adjusted (base amount, quote amount)
+def decode_reserves(data, base, quote):
+    if not data or len(data) < 64:
+        return None
+    reserve0, reserve1 = int.from_bytes(data[:32], 'big'), int.from_bytes(data[32:64], 'big')
+    if base != sort_tokens(base, quote)[0]:
+        reserve0, reserve1 = reserve1, reserve0
+    return (reserve0 / 10**lu.token_map[base]['decimals'],
+            reserve1 / 10**lu.token_map[quote]['decimals'])
+
+
+# Helper function: Price of base from its deepest pool, given the quote prices
+def best_price(pools, quote_prices):
+    '''Takes a list of (quote, base amount, quote amount).'''
+    best, best_liquidity = None, MIN_LIQUIDITY_USD
+    for quote, base_amount, quote_amount in pools:
+        if quote not in quote_prices or not base_amount:
+            continue
+        liquidity = quote_amount * quote_prices[quote]
+        if liquidity >= best_liquidity:
+            best, best_liquidity = quote_amount / base_amount * quote_prices[quote], liquidity
+    return best
+
+
+# Reads USD prices of tokens from Uniswap V2 reserves at one block
+def get_dex_prices(tokens=None, block_identifier='latest', rpc=None):
+    '''
+    Returns (block number, {token address: USD price}). Stablecoins count
+    as 1 USD. Tokens without a pool of enough liquidity are left out.
+    '''
+    tokens = [token for token in (tokens or lu.token_map) if token in lu.token_map]
+    pairs = dex_pairs(tokens)
+
+    calls = [(pair_address(base, quote), GET_RESERVES) for base, quote in pairs]
+    block_number, results = multicall(calls, block_identifier, rpc=rpc)
+
+    pools = {}
+    for (base, quote), data in zip(pairs, results):
+        reserves = decode_reserves(data, base, quote)
+        if reserves:
+            pools.setdefault(base, []).append((quote,) + reserves)
+
+    prices = {stable: 1.0 for stable in STABLECOINS}
+    weth_price = best_price(pools.get(WETH, []), prices)
+    if weth_price:
+        prices[WETH] = weth_price
+
+    for token in tokens:
+        if token not in prices:
+            price = best_price(pools.get(token, []), prices)
+            if price:
+                prices[token] = price
+
+    return block_number, {token: prices[token] for token in tokens if token in prices}
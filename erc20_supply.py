@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Total supplies of all token_map tokens, read in one batched call.
+
+totalSupply() is called through a minimal built-in ERC20 ABI (just the
+function selector), so no Etherscan ABI is needed and proxy tokens work
+like any other token: the call to the proxy is delegated to its
+implementation. Implementations of EIP-1967 proxies can be resolved for
+display. Supplies are cached per block; 'latest' is resolved to the block
+number of the last read for a few seconds, so it hits the cache too.
+
+    python erc20_supply.py      # supply view of all tokens
+"""
+import threading
+from time import time
+
+import lookups as lu
+from multicall import (
+    MulticallNotDeployedError, RPCError, block_param, decode_address, multicall, selector, web3_rpc)
+
+
+TOTAL_SUPPLY = selector('totalSupply()')
+
+# Storage slot of the implementation address of EIP-1967 proxies
+EIP1967_IMPLEMENTATION_SLOT = '0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc'
+
+
+class SupplyService:
+    """
+    Reads totalSupply() of tokens in one multicall per block. Results for a
+    block number are cached, so repeated reads of the same block are free.
+    Reads of 'latest' within latest_ttl seconds of the last one are answered
+    from the block that read returned (about one block time). At blocks
+    before Multicall2 was deployed, every token is read with an eth_call of its own.
+    """
+
+    def __init__(self, tokens=None, rpc=None, max_blocks=16, latest_ttl=12):
+        self.tokens = list(tokens or lu.token_map)
+        self.rpc = rpc
+        self.max_blocks = max_blocks
+        self.latest_ttl = latest_ttl
+        self._latest = None     # (block number, unix time) of the last read of 'latest'
+        self._cache = {}
+        self._implementations = {}
+        self._lock = threading.Lock()
+
+
+    def supplies(self, block_identifier='latest'):
+        '''
+        Returns (block number, {token address: decimal-adjusted supply}).
+        Tokens whose totalSupply() call failed are left out.
+        '''
+        latest = self._latest
+        if block_identifier == 'latest' and latest and time() - latest[1] < self.latest_ttl:
+            block_identifier = latest[0]
+
+        if isinstance(block_identifier, int) and block_identifier in self._cache:
+            return block_identifier, self._cache[block_identifier]
+
+        calls = [(token, TOTAL_SUPPLY) for token in self.tokens]
+        try:
+            block_number, results = multicall(calls, block_identifier, rpc=self.rpc)
+        # Possibility: Block before Multicall2 was deployed (i.e. early blocks of a backfill)
+        except MulticallNotDeployedError:
+            block_number, results = self._direct_calls(calls, block_identifier)
+
+        supplies = {
+            token: int.from_bytes(data[:32], 'big') / 10**lu.token_map[token]['decimals']
+            for token, data in zip(self.tokens, results) if data and len(data) >= 32
+            }
+
+        with self._lock:
+            if block_identifier == 'latest':
+                self._latest = (block_number, time())
+            self._cache[block_number] = supplies
+            while len(self._cache) > self.max_blocks:
+                del self._cache[min(self._cache)]
+
+        return block_number, supplies
+
+
+    def _direct_calls(self, calls, block_identifier):
+        '''Like multicall(), but one eth_call per call. Returns (block number, [data or None]).'''
+        rpc = self.rpc or web3_rpc
+        if not isinstance(block_identifier, int):
+            block_identifier = int(rpc('eth_getBlockByNumber', [block_identifier, False])['number'], 16)
+
+        results = []
+        for target, data in calls:
+            try:
+                result = rpc('eth_call', [{'to': target, 'data': '0x' + data.hex()}, block_param(block_identifier)])
+                results.append(bytes.fromhex(result[2:]))
+            # Possibility: Token not deployed yet at this block
+            except RPCError:
+                results.append(None)
+        return block_identifier, results
+
+
+    def supply(self, token, block_identifier='latest'):
+        '''Returns the supply of one token (None if unknown). Reads all tokens at once.'''
+        return self.supplies(block_identifier)[1].get(token)
+
+
+    def implementation(self, token):
+        '''Returns the implementation address of an EIP-1967 proxy token, or None.'''
+        if token not in self._implementations:
+            rpc = self.rpc or web3_rpc
+            slot = rpc('eth_getStorageAt', [token, EIP1967_IMPLEMENTATION_SLOT, block_param('latest')])
+            address = decode_address(bytes.fromhex(slot[2:].rjust(64, '0')))
+            self._implementations[token] = None if int(address, 16) == 0 else address
+        return self._implementations[token]
+
+
+# Default supply service of all collection contexts (see data_aggregation.CollectionContext)
+SUPPLY_SERVICE = SupplyService()
+
+
+# Text table of the supplies of all tokens
+def format_supply_view(block_number, supplies, implementations=None):
+    # Imported here so data_aggregation doesn't need PIL through this module
+    from image_manipulation import parse_str
+
+    lines = [f'Token supplies at block {block_number}:', '']
+    for token in sorted(supplies, key=lambda t: lu.token_map[t]['symbol']):
+        line = '{:6} {:>10}'.format(lu.token_map[token]['symbol'], parse_str(supplies[token]))
+        if implementations and implementations.get(token):
+            line += f'  (proxy of {implementations[token]})'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import data_aggregation as da
+
+    block_number, supplies = SUPPLY_SERVICE.supplies()
+    implementations = {token: SUPPLY_SERVICE.implementation(token) for token in supplies}
+    print(format_supply_view(block_number, supplies, implementations))
+    minted_burned = da.get_minted_burned_YLD(da.get_YLD_supply(block_number))
+    print(f'\nYLD minted (+) / burned (-): {minted_burned:+,.2f}')
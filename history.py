@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replies to '/history <metric> <range>' from the precomputed rollups
+of the time-series store, i.e. '/history tvl 90d'.
+"""
+import re
+from time import time
+
+from image_manipulation import parse_str
+from timeseries_store import DAY, METRIC_FIELDS
+
+
+# Short names users can type, mapped to metrics and display labels
+HISTORY_METRICS = {
+    'tvl': ('total_collateral_in_use_USD', 'TVL ($)'),
+    'borrowed': ('total_borrowed_USD', 'Borrowed ($)'),
+    'loans': ('total_loans', 'Loans taken'),
+    'active': ('active_loans', 'Active loans'),
+    'defaulted': ('percent_defauted', 'Defaulted (%)'),
+    'value': ('avg_loan_val_USD', 'Avg loan value ($)'),
+    'interest': ('avg_interest_rate', 'Avg loan interest (%)'),
+    'duration': ('avg_loan_duration_days', 'Avg loan duration (days)'),
+    'supply': ('YLD_total_supply', 'YLD total supply'),
+    }
+
+# Range units in days
+RANGE_UNITS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+# Ranges up to this many days are answered from daily rollups, longer ones from weekly
+MAX_DAILY_RANGE = 120
+
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+
+USAGE = (
+    'Usage: /history <metric> <range>, i.e. /history tvl 90d\n'
+    f"Metrics: {', '.join(HISTORY_METRICS)}\n"
+    'Range: number + d (days), w (weeks), m (months) or y (years)'
+    )
+
+
+# Parses the arguments of a /history command into (metric, label, days)
+def parse_history_args(args):
+    '''
+    Takes the words after '/history' and returns (metric, label, days).
+    Raises ValueError if they can't be parsed.
+    '''
+    if len(args) < 1:
+        raise ValueError('No metric given.')
+
+    name = args[0].lower()
+    if name in HISTORY_METRICS:
+        metric, label = HISTORY_METRICS[name]
+    else:
+        matches = [field for field in METRIC_FIELDS if field.lower() == name]
+        if not matches:
+            raise ValueError(f'Unknown metric: {args[0]}')
+        metric = label = matches[0]
+
+    range_str = args[1].lower() if len(args) > 1 else '30d'
+    match = re.fullmatch(r'(\d+)([dwmy])', range_str)
+    if not match:
+        raise ValueError(f'Unknown range: {range_str}')
+    days = int(match.group(1)) * RANGE_UNITS[match.group(2)]
+
+    return metric, label, days
+
+
+# Helper function: Draws values as a line of unicode blocks
+def sparkline(values):
+    low, high = min(values), max(values)
+    span = (high - low) or 1
+    return ''.join(SPARK_CHARS[int((v - low) / span * (len(SPARK_CHARS) - 1))] for v in values)
+
+
+# Builds the reply to a /history command
+def history_reply(store, args, now=None):
+    '''
+    Takes a TimeSeriesStore and the words after '/history'.
+    Returns a text message summarizing the metric over the range.
+    '''
+    try:
+        metric, label, days = parse_history_args(args)
+    except ValueError as e:
+        return f'{e}\n\n{USAGE}'
+
+    now = time() if now is None else now
+    period = 'day' if days <= MAX_DAILY_RANGE else 'week'
+    rollups = store.read_rollups(metric, period, start=now - days * DAY, end=now)
+
+    if not rollups:
+        return f'No data for {label} in the last {days} days.'
+
+    first = rollups[0]['last']
+    last = rollups[-1]['last']
+    low = min(r['min'] for r in rollups)
+    high = max(r['max'] for r in rollups)
+    mean = sum(r['mean'] * r['count'] for r in rollups) / sum(r['count'] for r in rollups)
+    change = f' ({(last - first) / first * 100:+.1f}%)' if first else ''
+    period_label = 'daily' if period == 'day' else 'weekly'
+
+    lines = [
+        f'{label}, last {days} days ({period_label}):',
+        sparkline([r['last'] for r in rollups]),
+        '',
+        f'Start: {parse_str(first)}   Now: {parse_str(last)}{change}',
+        f'Low: {parse_str(low)}   High: {parse_str(high)}   Mean: {parse_str(mean)}',
+        ]
+
+    return '\n'.join(lines)
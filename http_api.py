@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read-only HTTP JSON API of the loan metrics, for dashboards and other tools.
+
+    GET /api/latest                         newest metrics snapshot
+    GET /api/history?start=&end=&fields=    raw snapshots (unix times, fields comma separated)
+    GET /api/history?metric=&period=week    daily (default) or weekly rollups of one metric
+    GET /api/breakdown                      active loans per token and pair (see breakdown.py)
+    GET /api/loans.png                      the rendered infographic
+
+Responses are built once per version of the underlying file and served
+from memory. Every response has a strong ETag (hash of the body), so
+clients revalidating with If-None-Match get an empty 304. Cache-Control
+max-age is derived from the age of the snapshot: fresh data may be cached
+until the next refresh is due.
+
+    python http_api.py --port 8080
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib.parse import parse_qs, urlsplit
+
+import telemetry as tm
+from asset_registry import AssetRegistry
+from breakdown import BREAKDOWN_FILE, nan_to_none
+from timeseries_store import METRIC_FIELDS, STORE_FILE, TimeSeriesStore, time_str_to_ts
+
+
+# Bounds of Cache-Control max-age in seconds
+MIN_MAX_AGE = 10
+MAX_MAX_AGE = 3600
+
+# Number of distinct history queries kept in memory
+HISTORY_CACHE_SIZE = 256
+
+# A response body with its validators
+#   modified    unix time of the data (for Last-Modified and max-age)
+Resource = namedtuple('Resource', ['body', 'etag', 'content_type', 'modified'])
+
+
+# Helper function: Resource with a strong ETag of its body
+def make_resource(body, content_type, modified):
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return Resource(body, etag, content_type, modified)
+
+
+def json_resource(data, modified):
+    return make_resource(json.dumps(data, separators=(',', ':')).encode(), 'application/json', modified)
+
+
+# Loaders for AssetRegistry: file -> Resource, called once per version of the file
+def load_latest(store_file):
+    latest = TimeSeriesStore(store_file).latest()
+    if not latest:
+        return None
+    ts = time_str_to_ts(latest['time'])
+    return json_resource(dict(latest, ts=ts), ts)
+
+
+def load_image(path):
+    with open(path, 'rb') as file:
+        return make_resource(file.read(), 'image/png', os.path.getmtime(path))
+
+
+def load_breakdown(path):
+    # Breakdowns saved by older versions may hold NaN, which strict JSON parsers reject
+    with open(path) as file:
+        breakdown = nan_to_none(json.load(file))
+    return json_resource(breakdown, breakdown.get('time') or os.path.getmtime(path))
+
+
+# Helper function: True if an If-None-Match header matches etag
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # Weak comparison, as RFC 7232 requires for If-None-Match
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+# Seconds a response may be cached, given the age of its data
+def cache_max_age(age, refresh_seconds=None):
+    '''
+    With a known refresh interval, data is fresh until the next refresh is
+    due (at least MIN_MAX_AGE, overdue data is revalidated soon). Without
+    one, 10% of the data's age, the usual heuristic for Last-Modified.
+    '''
+    if refresh_seconds:
+        max_age = refresh_seconds - age
+    else:
+        max_age = age / 10
+    return int(min(MAX_MAX_AGE, max(MIN_MAX_AGE, max_age)))
+
+
+class MetricsApi:
+    """
+    Resolves API paths to in-memory Resources. Files are reloaded only when
+    their modification time changes (see AssetRegistry). History responses
+    are cached per query until the store changes.
+    """
+
+    def __init__(self, store_file=STORE_FILE, image_file='loans.png', breakdown_file=BREAKDOWN_FILE,
+                 refresh_seconds=None):
+        self.store = TimeSeriesStore(store_file)
+        self.refresh_seconds = refresh_seconds
+        self.assets = AssetRegistry()
+        self.assets.register('latest', store_file, loader=load_latest)
+        self.assets.register('loans.png', image_file, loader=load_image)
+        self.assets.register('breakdown', breakdown_file, loader=load_breakdown)
+        self._history = OrderedDict()    # query -> Resource
+        self._history_version = None     # latest Resource the history cache belongs to
+        self._lock = threading.Lock()
+
+
+    def resource(self, path, query):
+        '''
+        Returns the Resource of path, or None if there is no data yet.
+        Raises KeyError for unknown paths, ValueError for bad parameters.
+        '''
+        if path == '/api/latest':
+            return self.assets.get('latest')
+        if path == '/api/loans.png':
+            return self.assets.get('loans.png')
+        if path == '/api/breakdown':
+            return self.assets.get('breakdown')
+        if path == '/api/history':
+            return self.history(query)
+        raise KeyError(path)
+
+
+    def history(self, query):
+        latest = self.assets.get('latest')
+        key = tuple(sorted((name, tuple(values)) for name, values in query.items()))
+
+        with self._lock:
+            # A new snapshot outdates all cached history responses
+            if latest is not self._history_version:
+                self._history.clear()
+                self._history_version = latest
+            if key in self._history:
+                self._history.move_to_end(key)
+                return self._history[key]
+
+        resource = self._read_history(query, latest)
+
+        with self._lock:
+            self._history[key] = resource
+            while len(self._history) > HISTORY_CACHE_SIZE:
+                self._history.popitem(last=False)
+        return resource
+
+
+    def _read_history(self, query, latest):
+        def param(name, default=None):
+            return query.get(name, [default])[0]
+
+        try:
+            start = int(param('start')) if param('start') else None
+            end = int(param('end')) if param('end') else None
+        except ValueError:
+            raise ValueError('start and end must be unix times.')
+
+        modified = latest.modified if latest else time()
+        metric = param('metric')
+
+        if metric:
+            period = param('period', 'day')
+            rows = self.store.read_rollups(metric, period=period, start=start, end=end)
+            return json_resource({'metric': metric, 'period': period, 'rollups': rows}, modified)
+
+        fields = param('fields')
+        fields = fields.split(',') if fields else METRIC_FIELDS
+        rows = self.store.read_range(start=start, end=end, fields=fields)
+        return json_resource({'fields': fields, 'rows': rows}, modified)
+
+
+class ApiServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering from a MetricsApi.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, listen, port, api):
+        self.api = api
+        super().__init__((listen, port), ApiHandler)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    GET and HEAD requests of the API. Keeps connections alive (HTTP/1.1).
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, Nagle's algorithm would delay the body
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        url = urlsplit(self.path)
+        endpoint = url.path
+
+        try:
+            resource = self.server.api.resource(url.path, parse_qs(url.query))
+        except KeyError:
+            endpoint = 'unknown'
+            return self.send_error_json(404, 'Not found.', endpoint, send_body)
+        except ValueError as e:
+            return self.send_error_json(400, str(e), endpoint, send_body)
+
+        if resource is None:
+            return self.send_error_json(404, 'No data yet.', endpoint, send_body)
+
+        age = max(0, time() - resource.modified)
+        max_age = cache_max_age(age, self.server.api.refresh_seconds)
+        not_modified = etag_matches(self.headers.get('If-None-Match'), resource.etag)
+
+        self.send_response(304 if not_modified else 200)
+        self.send_header('ETag', resource.etag)
+        self.send_header('Cache-Control', f'public, max-age={max_age}')
+        self.send_header('Last-Modified', formatdate(resource.modified, usegmt=True))
+        self.send_header('Age', str(int(age)))
+        if not_modified:
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_header('Content-Type', resource.content_type)
+            self.send_header('Content-Length', str(len(resource.body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(resource.body)
+
+        tm.API_REQUESTS.inc(endpoint, '304' if not_modified else '200')
+
+    def send_error_json(self, status, message, endpoint, send_body):
+        body = json.dumps({'error': message}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+        tm.API_REQUESTS.inc(endpoint, str(status))
+
+    def log_message(self, format, *args):
+        logging.debug('api: ' + format % args)
+
+
+# Serves the API from a daemon thread
+def start_api_server(port, listen='127.0.0.1', api=None):
+    server = ApiServer(listen, port, api or MetricsApi())
+    threading.Thread(target=server.serve_forever, name='http-api', daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the loan metrics as read-only JSON API.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--listen', default='127.0.0.1')
+    parser.add_argument('--store', default=STORE_FILE)
+    parser.add_argument('--image', default='loans.png')
+    parser.add_argument('--refresh-minutes', type=float, help='update interval, for Cache-Control')
+    args = parser.parse_args()
+
+    refresh_seconds = args.refresh_minutes * 60 if args.refresh_minutes else None
+    server = ApiServer(args.listen, args.port, MetricsApi(args.store, args.image, refresh_seconds=refresh_seconds))
+    print(f'Serving on http://{args.listen}:{args.port}/api/latest')
+    server.serve_forever()
@@ -48,15 +48,14 @@ def draw_str(s, img, pos, fontsize=20, color=(255, 255, 255), font='GothamBook.t
     d1.text(pos, s, font=myFont, fill=color)
 
 # Update loans.png with current values and save file
-def update_loan_stats(d, verbose=False):
+def update_loan_stats(d, outfile='loans.png', template='loans_template.png', verbose=False):
     '''
     Saves new version of loans.png with updated statistics.
     d is assumed to be a dictionary of loan metrics.
     '''
     global WHITE, GOLD, DARK, GREY
 
-    outfile = 'loans.png'
-    img = Image.open('loans_template.png')
+    img = Image.open(template)
 
     # Define metrics
     loans_total = d['total_loans']
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Decoding of raw loan data into compact loan records, driven by lookups.type_map.
+
+The decoders are generated once from type_map at import: every field gets an
+inline conversion for its type, so decoding a loan is a single function call
+without per-field lookups. Token amounts become exact fixed-point Decimals
+in token units (i.e. Decimal('1234.5') DAI), not floored integers.
+
+    raw_loan_data(collateral_balance, loan_details, meta_data, ts_due, is_defaulted)
+                                    raw contract return values -> dict as in ALL_LOANS_DATA
+    decode_loan(address, collateral_balance, loan_details, meta_data, ts_due, is_defaulted)
+                                    raw contract return values -> LoanRecord
+    decode_loans(loans_data)        ALL_LOANS_DATA -> list of LoanRecords
+    decode_columns(loans_data)      ALL_LOANS_DATA -> {field: tuple of values}
+    decode_float_columns(loans_data)
+                                    same, amounts as floats (for aggregation)
+
+ALL_LOANS_DATA keeps the raw values (the store, caches and bundles persist
+it), data_aggregation.py aggregates over decode_float_columns(). Amounts
+stay exact integers until then; the float of an amount is the correctly
+rounded quotient of raw value and 10**decimals (16 significant digits,
+far more than metrics rounded to cents need), and floats aggregate
+several times faster than Decimals.
+
+Amounts of tokens without token data (see lookups.token_info()) are
+unknown: they decode to None and the token is logged once.
+"""
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+import lookups as lu
+
+
+# Fields of a loan record in type_map order
+FIELDS = ('address',) + tuple(lu.type_map)
+
+# Durations among the 'ts' fields, all others are unix times
+DURATION_FIELDS = {'duration', 'liquidatable_t_allowance'}
+
+
+# Tokens without token data that have been logged
+unknown_tokens = set()
+
+# Helper function: Logs a token without token data (once). Its amounts are unknown.
+def unknown_token(token):
+    if token not in unknown_tokens:
+        unknown_tokens.add(token)
+        logging.warning(f'No token data for {token} (lookups.py or deployments.json), its amounts are unknown.')
+
+# Helper function: Exact amount in token units (string construction doesn't round)
+def to_amount(raw, token):
+    info = lu.token_info(token)
+    if info is None:
+        return unknown_token(token)
+    return Decimal(f"{raw}e-{info['decimals']}")
+
+# Helper function: Amount in token units as float (int / int division rounds correctly)
+def to_float(raw, token):
+    info = lu.token_info(token)
+    if info is None:
+        return unknown_token(token)
+    return raw / 10**info['decimals']
+
+
+class LoanRecord:
+    """
+    Decoded data of one loan. Uses __slots__, so it needs a fraction of
+    the memory of a dict per loan.
+    """
+    __slots__ = FIELDS
+
+    @property
+    def interest_rate(self):
+        '''Interest in percent.'''
+        return self.interest / 100
+
+    @property
+    def duration_days(self):
+        return self.duration / (24 * 3600)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return f'<LoanRecord {self.address}: {self.principal} of {self.address_lending_token}, status {self.loan_status}>'
+
+
+#############################################################################
+#
+#   Decoder generation
+#
+#############################################################################
+
+
+# Python expression converting the value of a field (given as source) to its type
+def conversion(field, value, amount='to_amount'):
+    kind = lu.type_map[field]
+    if kind == 'uint256' and field in lu.amount_tokens:
+        return f'{amount}({value}, {lu.amount_tokens[field]})'
+    if kind == 'bool':
+        return f'bool({value})'
+    if kind == 'address':
+        return f'str({value})'
+    return f'int({value})'
+
+
+# Helper function: Compiles function source, returns the function
+def compile_function(name, source):
+    namespace = {'to_amount': to_amount, 'to_float': to_float, 'LoanRecord': LoanRecord}
+    exec(compile(source, f'<{name} generated from type_map>', 'exec'), namespace)
+    return namespace[name]
+
+
+def _init_source():
+    '''Source of LoanRecord.__init__(): one assignment per field.'''
+    lines = [f"def __init__(self, {', '.join(FIELDS)}):"]
+    lines += [f'    self.{field} = {field}' for field in FIELDS]
+    return '\n'.join(lines)
+
+
+# Helper function: First lines of a function taking raw contract return values
+def _raw_args_source(name, args):
+    lines = [f"def {name}({', '.join(args)}):"]
+    lines.append(f"    ({', '.join(lu.loan_details_fields)},) = loan_details")
+    lines.append(f"    ({', '.join(lu.meta_data_fields)},) = meta_data")
+    return lines
+
+
+def _raw_data_source():
+    '''Source of raw_loan_data(): raw contract return values -> dict as in ALL_LOANS_DATA.'''
+    lines = _raw_args_source('raw_loan_data', ['collateral_balance', 'loan_details', 'meta_data', 'ts_due', 'is_defaulted'])
+    lines.append('    return {' + ', '.join(f"'{field}': {field}" for field in lu.type_map) + '}')
+    return '\n'.join(lines)
+
+
+def _loan_source():
+    '''Source of decode_loan(): raw contract return values -> LoanRecord.'''
+    lines = _raw_args_source('decode_loan', ['address', 'collateral_balance', 'loan_details', 'meta_data', 'ts_due', 'is_defaulted'])
+    values = ['address'] + [conversion(field, field) for field in lu.type_map]
+    lines.append(f"    return LoanRecord({', '.join(values)})")
+    return '\n'.join(lines)
+
+
+def _record_source():
+    '''Source of decode_record(): (address, dict as in ALL_LOANS_DATA) -> LoanRecord.'''
+    tokens = sorted(set(lu.amount_tokens.values()))
+    lines = ['def decode_record(address, loan):']
+    lines += [f"    {token} = loan['{token}']" for token in tokens]
+    values = ['address'] + [field if field in tokens else conversion(field, f"loan['{field}']") for field in lu.type_map]
+    lines.append(f"    return LoanRecord({', '.join(values)})")
+    return '\n'.join(lines)
+
+
+def _columns_source(name='decode_columns', amount='to_amount'):
+    '''Source of decode_columns(): dict as ALL_LOANS_DATA -> {field: tuple}, in one pass.'''
+    tokens = sorted(set(lu.amount_tokens.values()))
+    lines = [f'def {name}(loans_data):']
+    lines += [f'    col_{field} = []' for field in FIELDS]
+    lines.append('    for address, loan in loans_data.items():')
+    lines += [f"        {token} = loan['{token}']" for token in tokens]
+    lines.append('        col_address.append(address)')
+    for field in lu.type_map:
+        value = field if field in tokens else conversion(field, f"loan['{field}']", amount)
+        lines.append(f'        col_{field}.append({value})')
+    lines.append('    return {' + ', '.join(f"'{field}': tuple(col_{field})" for field in FIELDS) + '}')
+    return '\n'.join(lines)
+
+
+LoanRecord.__init__ = compile_function('__init__', _init_source())
+raw_loan_data = compile_function('raw_loan_data', _raw_data_source())
+decode_loan = compile_function('decode_loan', _loan_source())
+decode_record = compile_function('decode_record', _record_source())
+decode_columns = compile_function('decode_columns', _columns_source())
+decode_float_columns = compile_function('decode_float_columns', _columns_source('decode_float_columns', 'to_float'))
+
+
+# Batch decode of a loan book
+def decode_loans(loans_data):
+    '''Takes a dict as ALL_LOANS_DATA. Returns a list of LoanRecords.'''
+    return [decode_record(address, loan) for address, loan in loans_data.items()]
+
+
+# Consumer of lookups.type_map: Readable values of one loan
+def convert_values_to_human_readable(loan):
+    '''
+    Takes a dict as in ALL_LOANS_DATA or a LoanRecord. Returns a dict with
+    amounts in token units, times as UTC strings (None if 0), durations in
+    days, interest in percent and the status as text.
+    '''
+    record = loan if isinstance(loan, LoanRecord) else decode_record(None, loan)
+    readable = {}
+
+    for field, kind in lu.type_map.items():
+        value = getattr(record, field)
+        if kind == 'ts' and field in DURATION_FIELDS:
+            value = value / (24 * 3600)
+        elif kind == 'ts':
+            value = datetime.utcfromtimestamp(value).strftime('%Y %b %d %H:%M UTC') if value else None
+        readable[field] = value
+
+    readable['interest'] = record.interest_rate
+    readable['loan_status'] = {0: 'active', 1: 'repaid', 2: 'defaulted'}.get(record.loan_status, record.loan_status)
+    return readable
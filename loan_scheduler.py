@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scheduler of loan deadlines: the moment an active loan becomes due
+(ts_due) and the moment it becomes liquidatable (ts_due + liquidatable_t_allowance).
+
+Upcoming events are kept in a min-heap, so the next one is found in
+O(log n) without rescanning the loan book. Updating the loans only pushes
+entries for loans whose deadlines changed; outdated entries stay in the heap
+and are skipped when they come up (each loan has a version number). A single
+thread sleeps until exactly the next event, or until new loans arrive.
+"""
+import heapq
+import logging
+import threading
+from collections import namedtuple
+from time import time
+
+import lookups as lu
+
+
+# A deadline of a loan. kind is 'due' or 'liquidatable'.
+LoanEvent = namedtuple('LoanEvent', ['ts', 'kind', 'loan', 'loan_data'])
+
+
+class LoanScheduler:
+    """
+    Calls on_event(LoanEvent) when an active loan becomes due or liquidatable.
+    """
+
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self._heap = []              # (ts, seq, loan, kind, version)
+        self._seq = 0
+        self._versions = {}          # loan -> version of its current heap entries
+        self._deadlines = {}         # loan -> (ts_due, ts_liquidatable) of its current heap entries
+        self._loans = {}             # loan -> loan data
+        self._condition = threading.Condition()
+        self._running = False
+
+
+    def update_loans(self, loans_data, now=None):
+        '''
+        Takes a loan book (format of ALL_LOANS_DATA). Schedules the future
+        deadlines of active loans; loans that aren't active anymore are dropped.
+        Returns the number of loans whose deadlines changed.
+        '''
+        now = time() if now is None else now
+        changed = 0
+
+        with self._condition:
+            active = {loan: data for loan, data in loans_data.items() if data['loan_status'] == 0}
+
+            for loan in set(self._loans) - set(active):
+                self._invalidate(loan)
+                del self._loans[loan]
+                changed += 1
+
+            for loan, data in active.items():
+                deadlines = (data['ts_due'], data['ts_due'] + data['liquidatable_t_allowance'])
+                self._loans[loan] = data
+                if self._deadlines.get(loan) == deadlines:
+                    continue
+
+                version = self._invalidate(loan)
+                self._deadlines[loan] = deadlines
+                for ts, kind in zip(deadlines, ('due', 'liquidatable')):
+                    if ts > now:
+                        self._seq += 1
+                        heapq.heappush(self._heap, (ts, self._seq, loan, kind, version))
+                changed += 1
+
+            # Wakes up the thread, the next event might have changed
+            self._condition.notify()
+
+        return changed
+
+
+    def _invalidate(self, loan):
+        '''Outdates the heap entries of loan. Returns its new version.'''
+        self._versions[loan] = self._versions.get(loan, 0) + 1
+        self._deadlines.pop(loan, None)
+        return self._versions[loan]
+
+
+    def _pop_stale(self):
+        while self._heap and self._heap[0][4] != self._versions.get(self._heap[0][2]):
+            heapq.heappop(self._heap)
+
+
+    def next_event(self):
+        '''Returns (ts, kind, loan) of the next event or None.'''
+        with self._condition:
+            self._pop_stale()
+            if not self._heap:
+                return None
+            ts, _, loan, kind, _ = self._heap[0]
+            return ts, kind, loan
+
+
+    def pending(self):
+        '''Returns the number of scheduled events (including outdated ones).'''
+        return len(self._heap)
+
+
+    def run(self):
+        '''Fires events as they come up until stop() is called.'''
+        while True:
+            with self._condition:
+                while self._running:
+                    self._pop_stale()
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(timeout=delay)
+
+                if not self._running:
+                    return
+                ts, _, loan, kind, _ = heapq.heappop(self._heap)
+                event = LoanEvent(ts, kind, loan, self._loans.get(loan))
+
+            try:
+                self.on_event(event)
+            except Exception as e:
+                logging.error(f'Loan {loan}: {kind} event handler failed: {e}')
+
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name='loan-scheduler', daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+
+# Helper function: Amount of a token with its symbol, i.e. '1,500.00 DAI'
+def format_amount(raw, token):
+    info = lu.token_info(token)
+    if info is None:
+        return f'{raw} of {token}'
+    return f"{raw / 10**info['decimals']:,.2f} {info['symbol']}"
+
+
+# Text of an alert about a loan event
+def format_loan_event(event):
+    data = event.loan_data
+    loan = f'Loan {event.loan[:10]}…'
+    if data:
+        loan += (f" ({format_amount(data['principal'], data['address_lending_token'])} borrowed"
+                 f" against {format_amount(data['collateral'], data['address_collateral_token'])})")
+
+    if event.kind == 'due':
+        return f'⏰ {loan} is due now.'
+    return f'⚠️ {loan} is liquidatable now.'
@@ -3,7 +3,7 @@
 
 # TODO: Store ABIs here
 
-# Map keys to data types for converion by convert_values_to_human_readable()
+# Map keys to data types for converion by convert_values_to_human_readable() (see loan_decoder.py)
 type_map = {
     'collateral_balance': 'uint256',
     'ts_due': 'ts',
@@ -22,6 +22,20 @@ type_map = {
     'liquidatable_t_allowance': 'ts'
     }
 
+# Order of the values returned by Loan.sol's getLoanDetails() and getLoanMetadata()
+loan_details_fields = (
+    'address_lender', 'address_borrower', 'address_lending_token', 'address_collateral_token',
+    'principal', 'interest', 'duration', 'collateral'
+    )
+meta_data_fields = ('loan_status', 'ts_start', 'ts_repaid', 'liquidatable_t_allowance')
+
+# Token amounts among the uint256 fields, mapped to the field holding their token
+amount_tokens = {
+    'collateral_balance': 'address_collateral_token',
+    'principal': 'address_lending_token',
+    'collateral': 'address_collateral_token'
+    }
+
 # Map linking each supported token to some data needed frequently
 
 token_map = {
@@ -97,3 +111,15 @@ token_map = {
         {'symbol': 'YFI', 'coingecko_str': 'yearn-finance', 'decimals': 18},
     '0xE41d2489571d322189246DaFA5ebDe1F4699F498':
         {'symbol': 'ZRX', 'coingecko_str': '0x', 'decimals': 18}}
+
+
+# Token maps of LoanFactory.sol deployments on other networks {network: {address: token data}},
+# filled from deployments.json (see deployments.py). Their tokens are named 'network:address'.
+network_token_maps = {}
+
+# Helper function: Token data of a token address or 'network:address', None if unknown
+def token_info(token):
+    if ':' in token:
+        network, address = token.split(':', 1)
+        return network_token_maps.get(network, {}).get(address)
+    return token_map.get(token)
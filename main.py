@@ -7,7 +7,21 @@ all other files by Al Matty <al@almatty.com>.
 import time, os
 import random
 import logging
+import threading
+from functools import partial
+from time import perf_counter
 from telegram.ext import CommandHandler, Filters, MessageHandler, Updater
+from asset_registry import AssetRegistry
+from single_flight import SingleFlight
+from metrics_snapshot import read_latest_metrics, format_stats_text
+from timeseries_store import STORE_FILE, open_store
+from history import history_reply
+import telemetry as tm
+from refresh import BackgroundRefresher, SnapshotStore, run_refresh
+from subscriptions import Subscriptions
+from loan_scheduler import LoanScheduler, format_loan_event
+from broadcast import Broadcaster
+from breakdown import BREAKDOWN_FILE, read_breakdown, format_breakdown_text
 
 
 class MerchBot:
@@ -15,24 +29,93 @@ class MerchBot:
     A class to encapsulate all relevant methods of the bot.
     """
 
-    def __init__(self):
+    def __init__(self, store_file=STORE_FILE):
         """
         Constructor of the class. Initializes certain instance variables
         and checks if everything's O.K. for the bot to work as expected.
+        store_file is the metrics store the bot reads and refreshes.
         """
 
         # This environment variable should be set before using the bot
         self.token = os.environ['STATS_BOT_TOKEN']
 
+        # Optional configuration. 'polling' (default) or 'webhook' mode,
+        # number of worker threads handling updates concurrently
+        self.mode = os.environ.get('STATS_BOT_MODE', 'polling')
+        self.workers = int(os.environ.get('STATS_BOT_WORKERS', 4))
+
+        # Webhook mode only: Embedded HTTP server settings. The public url is
+        # registered with Telegram if set. Leave it unset for local testing.
+        self.webhook_listen = os.environ.get('STATS_BOT_WEBHOOK_LISTEN', '0.0.0.0')
+        self.webhook_port = int(os.environ.get('STATS_BOT_WEBHOOK_PORT', 8443))
+        self.webhook_path = os.environ.get('STATS_BOT_WEBHOOK_PATH', '/telegram')
+        self.webhook_url = os.environ.get('STATS_BOT_WEBHOOK_URL')
+        self.webhook_secret = os.environ.get('STATS_BOT_WEBHOOK_SECRET')
+
+        # If set, loan metrics and loans.png are refreshed in-process every
+        # n minutes instead of by a separately scheduled update.py
+        refresh_minutes = os.environ.get('STATS_BOT_REFRESH_MINUTES')
+        self.refresh_minutes = float(refresh_minutes) if refresh_minutes else None
+
+        # If set (together with STATS_BOT_REFRESH_MINUTES), USD figures and
+        # loans.png are also refreshed every n minutes from current prices
+        # and the loan book of the last full refresh
+        price_refresh_minutes = os.environ.get('STATS_BOT_PRICE_REFRESH_MINUTES')
+        self.price_refresh_minutes = float(price_refresh_minutes) if price_refresh_minutes else None
+
+        # If set, counters and histograms are served in Prometheus format
+        # on http://127.0.0.1:<port>/metrics
+        metrics_port = os.environ.get('STATS_BOT_METRICS_PORT')
+        self.metrics_port = int(metrics_port) if metrics_port else None
+
+        # If set, the metrics, their history and loans.png are served as
+        # read-only JSON API on http://127.0.0.1:<port>/api/ (see http_api.py)
+        api_port = os.environ.get('STATS_BOT_API_PORT')
+        self.api_port = int(api_port) if api_port else None
+
+        # Messages per second of broadcasts to /subscribe'd chats.
+        # Telegram allows about 30 for bulk notifications.
+        self.broadcast_rps = float(os.environ.get('STATS_BOT_BROADCAST_RPS', 30))
 
         # These will be checked against as substrings within each
         # message, so different variations are not required if their
         # radix is present (e.g. "all" covers "/all" and "ball")
-        self.menu_trigger = ['/all', '/stats']
+        self.menu_trigger = ['/all']
+        self.stats_text_trigger = ['/stats']
+        self.history_trigger = ['/history']
         self.loan_stats_trigger = ['/loans']
-        self.il_trigger = ['/IL']
+        self.il_trigger = ['/il']
         self.assets_trigger = ['/assets']
+        self.alerts_trigger = ['/alerts']
+        self.subscribe_trigger = ['/subscribe']
+        self.unsubscribe_trigger = ['/unsubscribe']
 
+        # Static messages are read from disk once and kept in memory.
+        # A file is only read again after its modification time changed.
+        self.text_assets = AssetRegistry()
+        for textfile in ['menu_msg.txt', 'signature_msg.txt', 'under_construction.txt']:
+            self.text_assets.register(textfile, textfile)
+
+        # Latest row of the metrics store, kept in memory for text replies
+        self.store_file = store_file
+        self.store = open_store(store_file)
+        self.text_assets.register('metrics', store_file, loader=read_latest_metrics)
+
+        # Latest breakdown of active loans per token, for /assets
+        self.text_assets.register('breakdown', BREAKDOWN_FILE, loader=read_breakdown)
+
+        # Snapshot of the latest in-process refresh (if enabled)
+        self.snapshots = SnapshotStore()
+
+        # Identical concurrent work (i.e. uploading the same infographic) is
+        # only done once. Uploaded images are re-sent by their Telegram file_id.
+        self.flights = SingleFlight()
+        self.photo_ids = {}    # pic_file -> (mtime, file_id)
+
+        # Chats subscribed to alerts or to loans.png after every refresh,
+        # and the scheduler firing alerts when active loans become due or liquidatable
+        self.subscriptions = Subscriptions()
+        self.scheduler = LoanScheduler(self.send_alert)
 
         # Stops runtime if the token has not been set
         if self.token is None:
@@ -40,6 +123,11 @@ class MerchBot:
                 "FATAL: No token was found. " + \
                 "You might need to specify one or more environment variables.")
 
+        # Stops runtime if webhook mode is set up without a secret token
+        if self.mode == 'webhook' and not self.webhook_secret:
+            raise RuntimeError(
+                "FATAL: Webhook mode requires STATS_BOT_WEBHOOK_SECRET to be set.")
+
         # Configures logging in debug level to check for errors
         logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
                             level=logging.INFO)
@@ -47,30 +135,207 @@ class MerchBot:
 
     def run_bot(self):
         """
-        Sets up the required bot handlers and starts the polling
-        thread in order to successfully reply to messages.
+        Sets up the required bot handlers and starts either the polling
+        thread or the webhook server in order to successfully reply to messages.
         """
 
         # Instantiates the bot updater
-        self.updater = Updater(self.token, use_context=True)
+        self.updater = Updater(self.token, workers=self.workers, use_context=True)
         self.dispatcher = self.updater.dispatcher
 
+        self.add_handlers(self.dispatcher)
+
+        if self.metrics_port:
+            tm.start_metrics_server(self.metrics_port)
+
+        if self.api_port:
+            from http_api import MetricsApi, start_api_server
+            refresh_minutes = self.price_refresh_minutes or self.refresh_minutes
+            api = MetricsApi(self.store_file, refresh_seconds=refresh_minutes * 60 if refresh_minutes else None)
+            start_api_server(self.api_port, api=api)
+
+        # Sends refreshed infographics to subscribed chats
+        self.broadcaster = Broadcaster(
+            self.updater.bot,
+            max_per_second=self.broadcast_rps,
+            on_unreachable=lambda chat_id: self.subscriptions.unsubscribe(chat_id, 'loans'),
+            on_migrated=self.subscriptions.migrate,
+            flights=self.flights
+            )
+        self.broadcaster.start()
+
+        # Schedules alerts for the loans of the latest run in the store
+        self.scheduler.update_loans(self.store.loans_at())
+        self.scheduler.start()
+
+        # Refreshes data in the background. Users never wait on a refresh.
+        if self.refresh_minutes:
+            self.refresher = BackgroundRefresher(self.snapshots, self.refresh_minutes,
+                                                 refresh_func=partial(run_refresh, store_file=self.store_file),
+                                                 price_interval_minutes=self.price_refresh_minutes)
+            self.refresher.add_listener(self.reschedule_loans)
+            self.refresher.add_listener(self.broadcast_loans)
+            self.refresher.start()
+
+        if self.mode == 'webhook':
+            self.start_webhook()
+        else:
+            # Fires up the polling thread. We're live!
+            self.updater.start_polling()
+
+
+    def add_handlers(self, dispatcher):
+        """
+        Adds the bot's handlers to a dispatcher.
+        """
+
         # Declares and adds a handler for text messages that will reply with
-        # content if a user message includes a trigger word
-        text_handler = MessageHandler(Filters.text, self.handle_text_messages)
-        self.dispatcher.add_handler(text_handler)
+        # content if a user message includes a trigger word. Runs on the
+        # dispatcher's worker threads so slow uploads don't block other users.
+        text_handler = MessageHandler(Filters.text, self.handle_text_messages, run_async=True)
+        dispatcher.add_handler(text_handler)
+
+
+    def start_webhook(self):
+        """
+        Starts the dispatcher and an embedded HTTP server receiving updates
+        from Telegram. Registers the webhook if a public url is configured.
+        """
+        from webhook_server import WebhookServer
+
+        # Dispatcher thread consuming the update queue
+        threading.Thread(target=self.dispatcher.start, name='dispatcher').start()
+
+        self.webhook_server = WebhookServer(
+            self.webhook_listen,
+            self.webhook_port,
+            self.webhook_path,
+            self.webhook_secret,
+            self.dispatcher
+            )
+
+        if self.webhook_url:
+            self.updater.bot.set_webhook(
+                url=self.webhook_url,
+                api_kwargs={'secret_token': self.webhook_secret}
+                )
+
+        logging.info(f'Listening for webhook updates on port {self.webhook_port}.')
+
+        # Fires up the webhook server. We're live!
+        threading.Thread(target=self.webhook_server.serve_forever, name='webhook').start()
 
-        # Fires up the polling thread. We're live!
-        self.updater.start_polling()
+
+    def reschedule_loans(self, snapshot):
+        """
+        Refresh listener: Updates the alert schedule with the refreshed loans.
+        """
+        if snapshot.mode != 'full':
+            return
+        changed = self.scheduler.update_loans(self.store.loans_at())
+        logging.info(f'Rescheduled alerts of {changed} loans.')
+
+
+    def broadcast_loans(self, snapshot):
+        """
+        Refresh listener: Sends the new loans.png to all chats subscribed to it.
+        The picture is uploaded once, the queued sends run in the background.
+        Only full refreshes are broadcast, price-only ones would be too frequent.
+        """
+        if snapshot.mode != 'full':
+            return
+        chats = self.subscriptions.chats('loans')
+        if not chats:
+            return
+        broadcast = self.broadcaster.broadcast_photo('loans.png', sorted(chats), photo_ids=self.photo_ids)
+        logging.info(f'Broadcasting loans.png to {len(chats)} chats: {broadcast}')
+
+
+    def send_alert(self, event):
+        """
+        Sends a loan event (due or liquidatable) to all chats subscribed to alerts.
+        The schedule is only updated after full refreshes, so the loan is read
+        again first: alerts of loans repaid or defaulted since are dropped.
+        """
+        # Imported here so the bot starts without connecting to a node
+        import data_aggregation as da
+
+        try:
+            loan_data = da.get_loan_data(event.loan)
+        # Possibility: Node unreachable. Alert with the state of the last refresh.
+        except Exception as e:
+            logging.warning(f'Could not re-check loan {event.loan} before alerting: {e}')
+            loan_data = None
+
+        if loan_data and loan_data['loan_status'] != 0:
+            logging.info(f'Dropped {event.kind} alert of loan {event.loan}: it is not active anymore.')
+            return
+
+        msg = format_loan_event(event._replace(loan_data=loan_data or event.loan_data))
+        if loan_data is None:
+            msg += '\n(Loan state as of the last refresh, it may have been repaid since.)'
+        for chat_id in self.subscriptions.chats('alerts'):
+            try:
+                self.updater.bot.send_message(chat_id=chat_id, text=msg)
+            except Exception as e:
+                logging.warning(f'Could not send alert to {chat_id}: {e}')
+
+
+    def toggle_alerts(self, update, context):
+        """
+        Subscribes or unsubscribes a chat from loan alerts.
+        '/alerts on', '/alerts off' or just '/alerts' to toggle.
+        """
+        chat_id = update.message.chat_id
+        words = update.message.text.lower().split()
+        subscribe = not self.subscriptions.is_subscribed(chat_id, 'alerts')
+        if 'on' in words or 'off' in words:
+            subscribe = 'on' in words
+
+        if subscribe:
+            self.subscriptions.subscribe(chat_id, 'alerts')
+            msg = 'Alerts on: You will be notified when loans become due or liquidatable.'
+        else:
+            self.subscriptions.unsubscribe(chat_id, 'alerts')
+            msg = 'Alerts off.'
+
+        next_event = self.scheduler.next_event()
+        if subscribe and next_event:
+            ts, kind, loan = next_event
+            msg += f"\nNext: loan {loan[:10]}… becomes {kind} on {time.strftime('%d %b %Y %H:%M UTC', time.gmtime(ts))}."
+
+        self.send_str(msg, update, context)
+
+
+    def set_subscription(self, subscribe, update, context):
+        """
+        Subscribes or unsubscribes a chat from loans.png after every refresh.
+        """
+        chat_id = update.message.chat_id
+
+        if subscribe:
+            self.subscriptions.subscribe(chat_id, 'loans')
+            msg = 'Subscribed: You will get the loan stats after every update. /unsubscribe to stop.'
+            if not self.refresh_minutes:
+                msg += '\n(Updates are currently not scheduled by the bot.)'
+        else:
+            self.subscriptions.unsubscribe(chat_id, 'loans')
+            msg = 'Unsubscribed from loan stats updates.'
+
+        self.send_str(msg, update, context)
 
 
     def send_textfile(self, textfile, update, context):
         """
         Takes a textfile (path) and sends it as mesage to the user.
+        Registered textfiles are served from memory.
         """
 
-        with open(textfile, 'r') as file:
-            MSG = file.read()
+        try:
+            MSG = self.text_assets.get(textfile)
+        except KeyError:
+            with open(textfile, 'r') as file:
+                MSG = file.read()
 
         context.bot.send_message(chat_id=update.message.chat_id, text=MSG)
 
@@ -99,20 +364,74 @@ class MerchBot:
         self.send_textfile(msg_file, update, context)
 
 
+    def show_stats_text(self, update, context):
+        """
+        Sends the current loan stats as plain text, served from memory.
+        Uses the in-process snapshot if there is one, else the metrics store.
+        """
+        snapshot = self.snapshots.get()
+
+        if snapshot:
+            msg = format_stats_text(snapshot.metrics, stale=snapshot.stale)
+        else:
+            msg = format_stats_text(self.text_assets.get('metrics'))
+
+        self.send_str(msg, update, context)
+
+
+    def show_history(self, update, context):
+        """
+        Replies to '/history <metric> <range>' from the metrics rollups.
+        """
+        words = update.message.text.split()
+        lowered = [word.lower() for word in words]
+        index = next(i for i, word in enumerate(lowered) if word.startswith('/history'))
+
+        msg = history_reply(self.store, words[index + 1:index + 3])
+        self.send_str(msg, update, context)
+
+
     def sendPic(self, pic_file, update, context, caption=None):
         """
-        Sends picture as specified in pic_file.
+        Sends picture as specified in pic_file. Each version of a picture
+        is uploaded once, afterwards it is sent by its Telegram file_id.
+        Concurrent requests for a version still being uploaded wait for
+        that upload instead of uploading the same bytes again.
         """
+        chat_id = update.message.chat_id
+        mtime = os.path.getmtime(pic_file)
 
-        # Send image
-        with open(pic_file, 'rb') as img:
+        cached = self.photo_ids.get(pic_file)
+        file_id = cached[1] if cached and cached[0] == mtime else None
+        tm.count_cache('photo_file_ids', file_id is not None)
 
-            # Sends the picture
-            context.bot.send_photo(
-                chat_id=update.message.chat_id,
-                photo=img,
-                caption=caption
-                )
+        if file_id is None:
+
+            def upload():
+                with open(pic_file, 'rb') as img:
+                    payload = img.read()
+
+                # Sends the picture
+                message = context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=payload,
+                    caption=caption
+                    )
+                file_id = message.photo[-1].file_id
+                self.photo_ids[pic_file] = (mtime, file_id)
+                return file_id
+
+            file_id, shared = self.flights.do(('upload', pic_file, mtime), upload)
+
+            # This request did the upload itself, so the picture has been sent
+            if not shared:
+                time.sleep(0.3)
+                return
+
+            logging.info(f'Coalesced upload of {pic_file}: {self.flights.stats()}')
+
+        # Sends the already uploaded picture
+        context.bot.send_photo(chat_id=chat_id, photo=file_id, caption=caption)
 
         # Some protection against repeatedly calling a bot function
         time.sleep(0.3)
@@ -146,21 +465,30 @@ class MerchBot:
 
     def show_assets(self, update, context):
         """
-        Sends out a preliminary message plus the IL infographic.
+        Sends the USD values of active loans per lending token, collateral
+        token and pair as plain text, served from memory.
         """
-
-        # Send preliminary message
-        msg = 'Some other message...'
+        msg = format_breakdown_text(self.text_assets.get('breakdown'))
         self.send_str(msg, update, context)
 
-        # Send pic
-        self.sendPic('assets.png', update, context)
-
 
     def handle_text_messages(self, update, context):
+        """
+        Replies to a text message and records the handler latency
+        per command in the bot metrics.
+        """
+        start = perf_counter()
+        command = None
+        try:
+            command = self.reply_to_text_message(update, context)
+        finally:
+            tm.BOT_COMMAND_SECONDS.observe(perf_counter() - start, command or 'none')
+
+
+    def reply_to_text_message(self, update, context):
         """
         Encapsulates all logic of the bot to conditionally reply with content
-        based on trigger words.
+        based on trigger words. Returns the trigger that was answered.
         """
 
         # Split user input into single words
@@ -181,7 +509,62 @@ class MerchBot:
                     self.show_menu(update, context)
                     logging.info(f'{chat_user_client} checked out the menu!')
 
-                    return
+                    return Trigger
+
+
+        # Possibility: received command from stats_text_trigger
+        for Trigger in self.stats_text_trigger:
+            for word in words:
+                if word.startswith(Trigger):
+
+                    self.show_stats_text(update, context)
+                    logging.info(f'{chat_user_client} got text stats!')
+
+                    return Trigger
+
+
+        # Possibility: received command from history_trigger
+        for Trigger in self.history_trigger:
+            for word in words:
+                if word.startswith(Trigger):
+
+                    self.show_history(update, context)
+                    logging.info(f'{chat_user_client} checked the history!')
+
+                    return Trigger
+
+
+        # Possibility: received command from alerts_trigger
+        for Trigger in self.alerts_trigger:
+            for word in words:
+                if word.startswith(Trigger):
+
+                    self.toggle_alerts(update, context)
+                    logging.info(f'{chat_user_client} toggled alerts!')
+
+                    return Trigger
+
+
+        # Possibility: received command from unsubscribe_trigger
+        for Trigger in self.unsubscribe_trigger:
+            for word in words:
+                if word.startswith(Trigger):
+
+                    self.set_subscription(False, update, context)
+                    logging.info(f'{chat_user_client} unsubscribed from loan stats!')
+
+                    return Trigger
+
+
+        # Possibility: received command from subscribe_trigger
+        for Trigger in self.subscribe_trigger:
+            for word in words:
+                if word.startswith(Trigger):
+
+                    self.set_subscription(True, update, context)
+                    logging.info(f'{chat_user_client} subscribed to loan stats!')
+
+                    return Trigger
 
 
         # Possibility: received command from loan_stats_trigger
@@ -194,7 +577,7 @@ class MerchBot:
                     self.send_signature(update, context)
                     logging.info(f'{chat_user_client} got loan stats!')
 
-                    return
+                    return Trigger
 
         # Possibility: received command from il_trigger
         for Trigger in self.il_trigger:
@@ -206,19 +589,18 @@ class MerchBot:
                     #self.send_signature(update, context)
                     logging.info(f'{chat_user_client} tried to get IL info!')
 
-                    return
+                    return Trigger
 
         # Possibility: received command from assets_trigger
         for Trigger in self.assets_trigger:
             for word in words:
                 if word.startswith(Trigger):
 
-                    self.send_textfile('under_construction.txt', update, context)
-                    #self.self.show_assets(update, context)
-                    #self.send_signature(update, context)
-                    logging.info(f'{chat_user_client} tried to get asset info!')
+                    self.show_assets(update, context)
+                    self.send_signature(update, context)
+                    logging.info(f'{chat_user_client} got asset info!')
 
-                    return
+                    return Trigger
 
 
 
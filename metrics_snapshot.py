@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Latest loan metrics for text replies of MerchBot.
+"""
+from image_manipulation import parse_str
+from timeseries_store import TimeSeriesStore
+
+
+# Reads the newest row of the metrics store written by update.py
+def read_latest_metrics(store_file):
+    '''
+    Returns the newest row of the time-series store as a dict of metrics
+    in the format of export_loan_metrics_dict().
+    '''
+    return TimeSeriesStore(store_file).latest()
+
+
+# Formats the metrics shown on loans.png as a plain text message
+def format_stats_text(d, stale=False):
+    '''
+    Takes a dict of loan metrics and returns a text message with the
+    same figures update_loan_stats() draws on the infographic.
+    If stale, a note that the figures may be outdated is appended.
+    '''
+    if not d:
+        return 'No loan stats available yet. Please try again later.'
+
+    lines = [
+        'yield.credit loan stats',
+        f"Last updated: {d['time']}",
+        '',
+        f"Loans taken: {parse_str(d['total_loans'])}",
+        f"Active loans: {parse_str(d['active_loans'])}",
+        f"Defaulted: {parse_str(d['percent_defauted'])}%",
+        f"Avg loan value: ${parse_str(d['avg_loan_val_USD'])}",
+        f"Avg loan duration: {parse_str(d['avg_loan_duration_days'])}d",
+        f"Avg loan interest: {parse_str(d['avg_interest_rate'])}%",
+        ]
+
+    if stale:
+        lines += ['', '(Latest update failed, figures may be outdated.)']
+
+    return '\n'.join(lines)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batched contract reads via the Multicall2 contract: many view calls are
+answered by a single eth_call, all from the same block.
+
+Calls are (target address, calldata bytes). The ABI encoding of
+tryBlockAndAggregate() is done here by hand, so the module only needs a
+function rpc(method, params) that performs a JSON-RPC request. By default
+requests go through data_aggregation's web3 provider (and are recorded /
+replayed like every other request, see replay.py); http_rpc() talks to
+any JSON-RPC endpoint, i.e. the fake node in benchmarks/fake_node.py.
+"""
+import json
+import urllib.request
+
+from eth_utils import keccak
+
+import telemetry as tm
+
+
+# Multicall2 on Ethereum mainnet, deployed at block 12336033
+MULTICALL2_ADDRESS = '0x5BA1e12693Dc8F9c48aAD8770482f4739bEeD696'
+
+WORD = 32
+
+
+class RPCError(Exception):
+    '''Raised when a JSON-RPC request returns an error.'''
+
+
+class MulticallNotDeployedError(RPCError):
+    '''Raised when the multicall contract has no code at the requested block.'''
+
+
+# Helper function: First 4 bytes of the keccak hash of a function signature
+def selector(signature):
+    return keccak(text=signature)[:4]
+
+TRY_BLOCK_AND_AGGREGATE = selector('tryBlockAndAggregate(bool,(address,bytes)[])')
+
+
+#############################################################################
+#
+#   ABI encoding
+#
+#############################################################################
+
+
+# Helper functions: ABI words
+def encode_uint(value):
+    return int(value).to_bytes(WORD, 'big')
+
+def encode_address(address):
+    return bytes(12) + bytes.fromhex(address[2:] if address.startswith('0x') else address)
+
+def encode_bytes(data):
+    padding = -len(data) % WORD
+    return encode_uint(len(data)) + data + bytes(padding)
+
+def decode_uint(data, offset=0):
+    return int.from_bytes(data[offset:offset + WORD], 'big')
+
+def decode_address(data, offset=0):
+    return '0x' + data[offset + 12:offset + WORD].hex()
+
+def decode_bytes(data, offset):
+    length = decode_uint(data, offset)
+    return data[offset + WORD:offset + WORD + length]
+
+
+# Helper function: Encodes an array of dynamic elements (offsets, then elements)
+def encode_dynamic_array(elements):
+    head, tail = b'', b''
+    for element in elements:
+        head += encode_uint(len(elements) * WORD + len(tail))
+        tail += element
+    return encode_uint(len(elements)) + head + tail
+
+# Helper function: Returns the start offsets of the elements of a dynamic array
+def decode_dynamic_array(data, offset):
+    n = decode_uint(data, offset)
+    start = offset + WORD
+    return [start + decode_uint(data, start + i * WORD) for i in range(n)]
+
+
+# Encodes the calldata of tryBlockAndAggregate(requireSuccess, calls)
+def encode_try_block_and_aggregate(calls, require_success=False):
+    '''Takes a list of (target address, calldata bytes).'''
+    elements = [encode_address(target) + encode_uint(2 * WORD) + encode_bytes(data) for target, data in calls]
+    return TRY_BLOCK_AND_AGGREGATE + encode_uint(require_success) + encode_uint(2 * WORD) + encode_dynamic_array(elements)
+
+# Decodes the calldata of tryBlockAndAggregate() into (requireSuccess, calls)
+def decode_try_block_and_aggregate(calldata):
+    args = calldata[4:]
+    offsets = decode_dynamic_array(args, decode_uint(args, WORD))
+    calls = [(decode_address(args, o), decode_bytes(args, o + decode_uint(args, o + WORD))) for o in offsets]
+    return bool(decode_uint(args)), calls
+
+# Encodes the return data of tryBlockAndAggregate(): (blockNumber, blockHash, (success, data)[])
+def encode_results(block_number, block_hash, results):
+    elements = [encode_uint(success) + encode_uint(2 * WORD) + encode_bytes(data) for success, data in results]
+    return encode_uint(block_number) + block_hash + encode_uint(3 * WORD) + encode_dynamic_array(elements)
+
+# Decodes the return data of tryBlockAndAggregate() into (block number, [(success, data)])
+def decode_results(data):
+    offsets = decode_dynamic_array(data, decode_uint(data, 2 * WORD))
+    results = [(bool(decode_uint(data, o)), decode_bytes(data, o + decode_uint(data, o + WORD))) for o in offsets]
+    return decode_uint(data), results
+
+
+#############################################################################
+#
+#   Transport
+#
+#############################################################################
+
+
+# Helper function: JSON-RPC through data_aggregation's web3 provider
+def web3_rpc(method, params):
+    import data_aggregation as da
+    response = da.w3.provider.make_request(method, params)
+    if 'error' in response:
+        raise RPCError(response['error'])
+    return response['result']
+
+
+# Returns an rpc function that posts JSON-RPC requests to url
+def http_rpc(url):
+    def rpc(method, params):
+        body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params}).encode()
+        req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        response = json.loads(urllib.request.urlopen(req).read())
+        if 'error' in response:
+            raise RPCError(response['error'])
+        return response['result']
+    return rpc
+
+
+# Helper function: Block identifier in JSON-RPC format
+def block_param(block_identifier):
+    return hex(block_identifier) if isinstance(block_identifier, int) else block_identifier
+
+
+# Runs many view calls in one eth_call
+def multicall(calls, block_identifier='latest', rpc=None, multicall_address=MULTICALL2_ADDRESS):
+    '''
+    Takes a list of (target address, calldata bytes). Returns
+    (block number, [return data bytes or None if the call failed]),
+    all read at the same block. Raises MulticallNotDeployedError at blocks
+    before multicall_address was deployed.
+    '''
+    rpc = rpc or web3_rpc
+    tx = {'to': multicall_address, 'data': '0x' + encode_try_block_and_aggregate(calls).hex()}
+
+    with tm.RPC_SECONDS.time('multicall'):
+        result = rpc('eth_call', [tx, block_param(block_identifier)])
+
+    # Possibility: Calls to addresses without code succeed with empty return data
+    if result in ('0x', ''):
+        raise MulticallNotDeployedError(f'Multicall not deployed at {multicall_address} at block {block_identifier}.')
+
+    block_number, results = decode_results(bytes.fromhex(result[2:]))
+    return block_number, [data if success else None for success, data in results]
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stage-based update pipeline.
+
+A pipeline is a small DAG of named stages with declared dependencies.
+Stages whose dependencies are done run concurrently, so a run takes about
+as long as its critical path. The duration of every stage is recorded and
+its output cached, so a single stage can be re-run from cached inputs.
+"""
+import os
+import pickle
+import logging
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import perf_counter, sleep
+
+import telemetry as tm
+
+
+CACHE_DIR = '.pipeline_cache'
+
+
+# Helper function: Writes a file through a temporary file next to it, so readers never see it half-written
+def replace_atomically(path, write):
+    '''
+    Calls write(temporary path), then moves the temporary file to path.
+    The temporary file keeps the extension of path (i.e. for image formats).
+    '''
+    directory, name = os.path.split(path)
+    root, ext = os.path.splitext(name)
+    fd, tmpfile = tempfile.mkstemp(prefix=root + '.', suffix='.tmp' + ext, dir=directory or '.')
+    os.close(fd)
+    try:
+        write(tmpfile)
+        os.replace(tmpfile, path)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+# Helper function: Stage cache of the update pipeline of a store and mode
+def update_cache_dir(store_file, mode):
+    '''
+    Pipelines in one process (i.e. full and prices refresh, or pipelines of
+    different stores) keep their stage outputs apart.
+    '''
+    store = os.path.splitext(os.path.basename(store_file))[0]
+    return os.path.join(CACHE_DIR, f'{store}.{mode}')
+
+
+class Stage:
+    """
+    A named step of a pipeline. func is called with the outputs of the
+    stages in deps as keyword arguments. Connection errors are retried
+    up to retries times.
+    """
+
+    def __init__(self, name, func, deps=(), retries=0, retry_delay=10):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+
+    def __call__(self, **inputs):
+        for try_nr in range(self.retries + 1):
+            try:
+                return self.func(**inputs)
+            except ConnectionError:
+                if try_nr == self.retries:
+                    raise
+                logging.warning(f'Stage {self.name}: Encountered a connection error. Trying again...')
+                tm.CONNECTION_ERRORS.inc(self.name)
+                sleep(self.retry_delay)
+
+
+class Pipeline:
+    """
+    Runs stages in dependency order, independent stages in parallel.
+    After a run, results holds the output and timings the duration
+    (seconds) of every stage.
+    """
+
+    def __init__(self, stages, max_workers=4, cache_dir=CACHE_DIR):
+        self.stages = {stage.name: stage for stage in stages}
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.results = {}
+        self.timings = {}
+
+        for stage in stages:
+            unknown = set(stage.deps) - set(self.stages)
+            if unknown:
+                raise ValueError(f'Stage {stage.name} depends on unknown stages {unknown}.')
+
+
+    def _run_stage(self, stage, inputs):
+        start = perf_counter()
+        try:
+            return stage(**inputs)
+        finally:
+            self.timings[stage.name] = perf_counter() - start
+            tm.STAGE_SECONDS.observe(self.timings[stage.name], stage.name)
+
+
+    def run(self):
+        '''
+        Runs all stages. Returns a dict {stage name: output}.
+        Raises the exception of the first failing stage.
+        '''
+        self.results, self.timings = {}, {}
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+
+                # Start every stage whose dependencies are done
+                for name, stage in list(pending.items()):
+                    if all(dep in self.results for dep in stage.deps):
+                        inputs = {dep: self.results[dep] for dep in stage.deps}
+                        running[executor.submit(self._run_stage, stage, inputs)] = name
+                        del pending[name]
+
+                if not running:
+                    raise ValueError(f'Stages {list(pending)} have cyclic dependencies.')
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+                    self._save(name, self.results[name])
+
+        return self.results
+
+
+    def run_stage(self, name):
+        '''
+        Runs a single stage with the cached outputs of its dependencies
+        from a previous run. Returns the stage's output.
+        '''
+        stage = self.stages[name]
+        inputs = {dep: self._load(dep) for dep in stage.deps}
+        result = self._run_stage(stage, inputs)
+        self.results[name] = result
+        self._save(name, result)
+        return result
+
+
+    def critical_path_time(self):
+        '''
+        Returns the summed duration of the slowest dependency chain of the last run.
+        '''
+        finish = {}
+
+        def finish_time(name):
+            if name not in finish:
+                deps = self.stages[name].deps
+                finish[name] = self.timings.get(name, 0) + max((finish_time(d) for d in deps), default=0)
+            return finish[name]
+
+        return max((finish_time(name) for name in self.stages), default=0)
+
+
+    def _cache_file(self, name):
+        return os.path.join(self.cache_dir, name + '.pkl')
+
+
+    def _save(self, name, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        def write(path):
+            with open(path, 'wb') as file:
+                pickle.dump(result, file)
+
+        replace_atomically(self._cache_file(name), write)
+
+
+    def _load(self, name):
+        try:
+            with open(self._cache_file(name), 'rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            raise RuntimeError(f'No cached output of stage {name}. Run the whole pipeline first.')
+
+
+# Builds the pipeline run by update.py and the in-process refresh
+def build_update_pipeline(store_file=None, outfile='loans.png', template='loans_template.png',
+                          max_workers=4, verbose=False, deployments=None, price_source='coingecko',
+                          breakdown_file=None, mode='full'):
+    '''
+    Returns a Pipeline with the stages
+
+        loans       read data of all loans from LoanFactory.sol
+        yld_supply  query YLD's total supply          (parallel to loans, prices)
+        prices      scrape prices of all loan tokens  (after loans). With
+                    price_source='dex', prices are read from Uniswap V2
+                    reserves in one multicall, only tokens without a pool
+                    are scraped
+        metrics     aggregate loan metrics            (after loans, prices, yld_supply)
+        store       append metrics and loan states to the time-series store
+        render      draw metrics onto outfile         (parallel to store)
+        breakdown   USD values of active loans per token and pair, saved
+                    to breakdown_file                 (after loans, prices, store)
+
+    If a list of deployments is given (see deployments.py), two stages are added:
+
+        shards              collect the loans of every deployment in a process pool
+                            (loans then merges them)
+        deployment_metrics  aggregate metrics per deployment, stored in
+                            one store per deployment  (parallel to metrics).
+                            Deployments on other networks than mainnet
+                            get no YLD metrics (the YLD supply is mainnet's)
+
+    With mode='prices', no chain state is read: loans (and shards) come
+    from the latest loan run in the store(s), the YLD supply from the latest
+    metrics. Only prices are fetched, USD metrics recomputed and outfile
+    re-rendered; no new loan run is stored.
+
+    The pipeline collects into its own da.CollectionContext and caches its
+    stage outputs in update_cache_dir(store_file, mode), so several
+    pipelines can run in one process at the same time.
+    '''
+    if mode not in ('full', 'prices'):
+        raise ValueError(f"Unknown refresh mode {mode}, use 'full' or 'prices'.")
+
+    # Imported here so importing this module doesn't query any API
+    import data_aggregation as da
+    from deployments import collect_shards, deployment_store_file, merge_shards, network_loans, register_tokens
+    from breakdown import BREAKDOWN_FILE, loan_breakdown, save_breakdown
+    from image_manipulation import update_loan_stats
+    from timeseries_store import STORE_FILE, open_store
+
+    store_file = store_file or STORE_FILE
+    ctx = da.CollectionContext()
+    breakdown_file = breakdown_file or BREAKDOWN_FILE
+    if deployments:
+        register_tokens(deployments)
+
+    def loans():
+        return da.load_all_loans_data(ctx)
+
+    def shards():
+        return collect_shards(deployments)
+
+    # Prices mode: Loan snapshot of the latest full run
+    def cached_loans(path=None):
+        loans_data = open_store(path or store_file, legacy_csvs=(), verbose=verbose).loans_at()
+        if not loans_data:
+            raise RuntimeError(f'No loan snapshot in {path or store_file}. Run a full update first.')
+        return loans_data
+
+    def cached_shards():
+        return {d.name: cached_loans(deployment_store_file(store_file, d.name)) for d in deployments}
+
+    def cached_yld_supply():
+        supply = open_store(store_file, legacy_csvs=(), verbose=verbose).latest().get('YLD_total_supply')
+        return da.get_YLD_supply(ctx=ctx) if supply is None else supply
+
+    def merged_loans(shards):
+        loans_data = merge_shards(shards, deployments)
+        da.set_all_loans_data(loans_data, ctx)
+        return loans_data
+
+    # Every deployment is aggregated in a context of its own
+    def deployment_metrics(shards, prices, yld_supply):
+        networks = {d.name: d.network for d in deployments}
+        per_deployment = {}
+        for name, loans_data in shards.items():
+            shard_ctx = da.CollectionContext()
+            da.set_all_loans_data(network_loans(loans_data, networks[name]), shard_ctx)
+            da.set_scraped_prices(prices, shard_ctx)
+            per_deployment[name] = da.export_loan_metrics_dict(
+                YLD_total_supply=yld_supply, ctx=shard_ctx, with_YLD=networks[name] == 'mainnet')
+        return per_deployment
+
+    def store_deployments(deployment_metrics, shards, store):
+        for name, metrics in deployment_metrics.items():
+            ts_store = open_store(deployment_store_file(store_file, name), legacy_csvs=(), verbose=verbose)
+            ts_store.append(metrics, ts=store)
+            if mode == 'full':
+                ts_store.record_loan_run(shards[name], ts=store)
+        return list(deployment_metrics)
+
+    def yld_supply():
+        return da.get_YLD_supply(ctx=ctx)
+
+    def prices(loans):
+        da.set_all_loans_data(loans, ctx)
+        da.reset_scraped_prices(verbose=verbose, ctx=ctx)
+        if price_source == 'dex':
+            from dex_prices import get_dex_prices
+            block_number, dex_prices = get_dex_prices(da.get_loan_tokens(ctx))
+            da.set_scraped_prices(dex_prices, ctx)
+            if verbose:
+                print(f'Read {len(dex_prices)} token prices from Uniswap V2 at block {block_number}.')
+        return da.prefetch_prices(da.get_loan_tokens(ctx), max_workers=max_workers, verbose=verbose, ctx=ctx)
+
+    def metrics(loans, prices, yld_supply):
+        da.set_all_loans_data(loans, ctx)
+        da.set_scraped_prices(prices, ctx)
+        return da.export_loan_metrics_dict(verbose=verbose, YLD_total_supply=yld_supply, ctx=ctx)
+
+    def store(metrics, loans):
+        ts_store = open_store(store_file, verbose=verbose)
+        ts = ts_store.append(metrics)
+        if mode == 'full':
+            ts_store.record_loan_run(loans, ts=ts)
+        return ts
+
+    def render(metrics):
+        # Render to a temporary file of its own first so readers never see a half-written image
+        with tm.RENDER_SECONDS.time(os.path.basename(outfile)):
+            replace_atomically(outfile, lambda tmpfile: update_loan_stats(metrics, outfile=tmpfile, template=template))
+        if verbose:
+            print(f'\n{outfile} has been updated with the current data.')
+        return outfile
+
+    def breakdown(loans, prices, store):
+        breakdown = loan_breakdown(loans, prices)
+        save_breakdown(breakdown, store, breakdown_file)
+        return breakdown
+
+    # Prices mode reads no chain state. A missing loan snapshot won't appear by retrying.
+    cached = mode == 'prices'
+    chain_retries = 0 if cached else 3
+
+    stages = [
+        Stage('loans', cached_loans if cached else loans, retries=chain_retries),
+        Stage('yld_supply', cached_yld_supply if cached else yld_supply, retries=3),
+        Stage('prices', prices, deps=['loans'], retries=3),
+        Stage('metrics', metrics, deps=['loans', 'prices', 'yld_supply']),
+        Stage('store', store, deps=['metrics', 'loans']),
+        Stage('render', render, deps=['metrics']),
+        Stage('breakdown', breakdown, deps=['loans', 'prices', 'store']),
+        ]
+
+    if deployments:
+        stages[0] = Stage('loans', merged_loans, deps=['shards'])
+        stages += [
+            Stage('shards', cached_shards if cached else shards, retries=chain_retries),
+            Stage('deployment_metrics', deployment_metrics, deps=['shards', 'prices', 'yld_supply']),
+            Stage('store_deployments', store_deployments, deps=['deployment_metrics', 'shards', 'store']),
+            ]
+
+    return Pipeline(stages, max_workers=max_workers, cache_dir=update_cache_dir(store_file, mode))
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Historical USD prices of all tokens in lookups.token_map and TVL / borrowed
+time series computed from them.
+
+Prices are kept as a token x time matrix on a regular grid (daily or hourly)
+and saved compactly as price_history.npz. They are bulk-loaded from
+CoinGecko with one request per token:
+
+    python price_history.py fetch --days 365             # daily prices
+    python price_history.py fetch --days 60 --hourly     # hourly prices
+    python price_history.py update                       # append up to now
+    python price_history.py series                       # TVL / borrowed series
+
+The series of the whole history are computed for the loan book in one
+pass of numpy operations, without any request per token and day.
+"""
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import numpy as np
+
+import lookups as lu
+
+
+PRICE_HISTORY_FILE = 'price_history.npz'
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# CoinGecko's public API allows about 10-50 calls a minute
+COINGECKO_MAX_RPS = 0.5
+
+
+class PriceHistory:
+    """
+    USD prices of tokens on a regular time grid.
+
+        tokens  token addresses (rows)
+        times   unix times of the grid (columns), ascending, step seconds apart
+        prices  float matrix len(tokens) x len(times), NaN where unknown
+    """
+
+    def __init__(self, tokens, times, prices, step):
+        self.tokens = list(tokens)
+        self.times = np.asarray(times, dtype=np.int64)
+        self.prices = np.asarray(prices, dtype=np.float64)
+        self.step = int(step)
+        self.index = {token: i for i, token in enumerate(self.tokens)}
+
+
+    @classmethod
+    def empty(cls, start, end, step=DAY, tokens=None):
+        '''Returns a history of NaN prices for start <= t <= end, aligned to step.'''
+        tokens = list(tokens or lu.token_map)
+        times = np.arange(start - start % step, end + 1, step, dtype=np.int64)
+        return cls(tokens, times, np.full((len(tokens), len(times)), np.nan), step)
+
+
+    def ingest(self, token, points):
+        '''
+        Fills the row of token with (unix time, price) points. Each grid time
+        gets the last price at or before it, at most one step old.
+        '''
+        if not points:
+            return
+        ts, prices = np.array(points, dtype=np.float64).T
+        order = np.argsort(ts, kind='stable')
+        ts, prices = ts[order], prices[order]
+
+        i = np.searchsorted(ts, self.times, side='right') - 1
+        valid = (i >= 0) & (self.times - ts[np.maximum(i, 0)] <= self.step)
+        self.prices[self.index[token]] = np.where(valid, prices[np.maximum(i, 0)], np.nan)
+
+
+    def extend(self, other):
+        '''Appends the grid times of other after the last time of this history.'''
+        if other.step != self.step:
+            raise ValueError(f'Can\'t extend a history of step {self.step}s with step {other.step}s.')
+
+        new = other.times > (self.times[-1] if len(self.times) else -1)
+        rows = [other.index.get(token) for token in self.tokens]
+        appended = np.full((len(self.tokens), new.sum()), np.nan)
+        for i, row in enumerate(rows):
+            if row is not None:
+                appended[i] = other.prices[row, new]
+
+        self.times = np.concatenate([self.times, other.times[new]])
+        self.prices = np.concatenate([self.prices, appended], axis=1)
+
+
+    def price_at(self, token, ts):
+        '''Returns the price of token at the last grid time at or before ts (NaN if unknown).'''
+        i = np.searchsorted(self.times, ts, side='right') - 1
+        return self.prices[self.index[token], i] if i >= 0 else np.nan
+
+
+    def save(self, path=PRICE_HISTORY_FILE):
+        tmpfile = path + '.tmp.npz'
+        np.savez_compressed(tmpfile, tokens=np.array(self.tokens), times=self.times,
+                            prices=self.prices.astype(np.float32), step=self.step)
+        os.replace(tmpfile, path)
+
+
+    @classmethod
+    def load(cls, path=PRICE_HISTORY_FILE):
+        with np.load(path) as data:
+            return cls(data['tokens'].tolist(), data['times'], data['prices'], int(data['step']))
+
+
+    def __repr__(self):
+        known = np.isfinite(self.prices).mean() * 100 if self.prices.size else 0
+        return (f'<PriceHistory: {len(self.tokens)} tokens x {len(self.times)} times '
+                f'(step {self.step}s), {known:.0f}% known>')
+
+
+# Bulk-loads prices of all tokens in token_map from CoinGecko
+def fetch_price_history(start, end, step=DAY, tokens=None, max_workers=4, verbose=False):
+    '''
+    Returns a PriceHistory for start <= t <= end. One request per token.
+    For hourly prices (step=HOUR), the range must be at most 90 days.
+    '''
+    # Imported here so importing this module doesn't query any API
+    import data_aggregation as da
+    from deployments import RateLimiter
+
+    history = PriceHistory.empty(start, end, step, tokens)
+    limiter = RateLimiter(COINGECKO_MAX_RPS)
+
+    def fetch(token):
+        limiter.wait()
+        points = da.get_token_price_history(lu.token_map[token]['coingecko_str'], start - step, end)
+        if verbose:
+            print(f"Fetched {len(points)} prices of {lu.token_map[token]['symbol']}.")
+        return points
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for token, points in zip(history.tokens, executor.map(fetch, history.tokens)):
+            history.ingest(token, points)
+
+    return history
+
+
+#############################################################################
+#
+#   Vectorized series
+#
+#############################################################################
+
+
+# Helper function: Unix time a loan stopped being active
+def loan_end(loan):
+    if loan['loan_status'] == 1:
+        return loan['ts_repaid']
+    if loan['loan_status'] == 2:
+        return loan['ts_due'] + loan['liquidatable_t_allowance']
+    return np.iinfo(np.int64).max
+
+
+# Converts a loan book (format of ALL_LOANS_DATA) into column arrays
+def loan_book_arrays(loans_data, history):
+    '''
+    Returns a dict of arrays, one entry per loan with known tokens:
+    lending / collateral token rows in history, decoded principal and
+    collateral amounts, start and end times of the loan.
+    '''
+    loans = [
+        loan for loan in loans_data.values()
+        if loan['address_lending_token'] in history.index
+        and loan['address_collateral_token'] in history.index
+        ]
+
+    def decoded(field, token_field):
+        return np.array([
+            loan[field] / 10**lu.token_map[loan[token_field]]['decimals'] for loan in loans
+            ], dtype=np.float64)
+
+    return {
+        'lending_token': np.array([history.index[l['address_lending_token']] for l in loans], dtype=np.intp),
+        'collateral_token': np.array([history.index[l['address_collateral_token']] for l in loans], dtype=np.intp),
+        'principal': decoded('principal', 'address_lending_token'),
+        'collateral': decoded('collateral', 'address_collateral_token'),
+        'start': np.array([l['ts_start'] for l in loans], dtype=np.int64),
+        'end': np.array([loan_end(l) for l in loans], dtype=np.int64),
+        }
+
+
+# Helper function: Amounts held per token at every grid time
+def active_amounts(history, token_rows, amounts, start, end):
+    '''
+    Returns a token x time matrix of the summed amounts of loans active at each
+    grid time (start <= t < end). Every loan adds its amount where it starts
+    and removes it where it ends; a cumulative sum over time gives the totals.
+    '''
+    n_times = len(history.times)
+    deltas = np.zeros((len(history.tokens), n_times + 1))
+    np.add.at(deltas, (token_rows, np.searchsorted(history.times, start, side='left')), amounts)
+    np.add.at(deltas, (token_rows, np.searchsorted(history.times, end, side='left')), -amounts)
+    return np.cumsum(deltas, axis=1)[:, :n_times]
+
+
+# TVL and borrowed USD of the loan book at every time of a price history
+def tvl_series(loans_data, history):
+    '''
+    Returns (times, TVL, borrowed) arrays. TVL is the USD value of the
+    collateral of active loans, borrowed the USD value of their principal,
+    both at the prices of each grid time. Unknown prices count as 0.
+    '''
+    book = loan_book_arrays(loans_data, history)
+    prices = np.nan_to_num(history.prices)
+
+    collateral = active_amounts(history, book['collateral_token'], book['collateral'], book['start'], book['end'])
+    principal = active_amounts(history, book['lending_token'], book['principal'], book['start'], book['end'])
+
+    return history.times, (collateral * prices).sum(axis=0), (principal * prices).sum(axis=0)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    args = sys.argv[2:]
+
+    if command == 'fetch':
+        days = float(args[args.index('--days') + 1]) if '--days' in args else 365
+        step = HOUR if '--hourly' in args else DAY
+        now = int(time())
+        history = fetch_price_history(now - int(days * DAY), now, step, verbose=True)
+        history.save()
+        print(f'Saved {history} to {PRICE_HISTORY_FILE}.')
+
+    elif command == 'update':
+        history = PriceHistory.load()
+        history.extend(fetch_price_history(int(history.times[-1]) + history.step, int(time()), history.step))
+        history.save()
+        print(f'Saved {history} to {PRICE_HISTORY_FILE}.')
+
+    elif command == 'series':
+        from image_manipulation import parse_str
+        from timeseries_store import TimeSeriesStore, ts_to_time_str
+
+        history = PriceHistory.load()
+        start = time()
+        times, tvl, borrowed = tvl_series(TimeSeriesStore().loans_at(), history)
+        print(f'Computed {len(times)} points in {(time() - start) * 1000:.1f} ms.\n')
+        print('{:^25} | {:^12} | {:^12}'.format('time', 'TVL ($)', 'borrowed ($)'))
+        for t, v, b in zip(times, tvl, borrowed):
+            print('{:25} | {:>12} | {:>12}'.format(ts_to_time_str(t), parse_str(v), parse_str(b)))
+
+    else:
+        print(__doc__)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process scheduled refresh of loan metrics for MerchBot.
+
+The collect -> aggregate -> render pipeline of update.py runs in a background
+thread. Every successful run atomically swaps in a new immutable snapshot.
+If a run fails, the last good snapshot keeps being served, marked as stale.
+
+Full refreshes read the loan book from the chain. Optionally, price-only
+refreshes run in between on a faster schedule: they reuse the loan book
+of the last full refresh and only fetch prices, so USD figures stay fresh
+without an RPC sweep every few minutes.
+"""
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime
+from time import time
+from types import MappingProxyType
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from deployments import load_deployments
+from pipeline import build_update_pipeline
+from timeseries_store import STORE_FILE
+
+
+# Immutable result of one successful refresh.
+#   metrics     read-only dict as returned by export_loan_metrics_dict()
+#   created_at  unix time of the refresh
+#   stale       True if a later refresh failed
+#   error       message of the failed refresh (or None)
+#   mode        'full' or 'prices' (see build_update_pipeline())
+Snapshot = namedtuple('Snapshot', ['metrics', 'created_at', 'stale', 'error', 'mode'], defaults=['full'])
+
+
+class SnapshotStore:
+    """
+    Holds the current snapshot. Readers never block: replacing the snapshot
+    is a single reference assignment.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+
+
+    def get(self):
+        '''Returns the current Snapshot or None if there's none yet.'''
+        return self._snapshot
+
+
+    def swap(self, metrics, mode='full'):
+        '''Replaces the current snapshot with a fresh one. Returns it.'''
+        snapshot = Snapshot(MappingProxyType(dict(metrics)), time(), False, None, mode)
+        self._snapshot = snapshot
+        return snapshot
+
+
+    def mark_stale(self, error):
+        '''Keeps the current snapshot, but flags it as stale.'''
+        snapshot = self._snapshot
+        if snapshot:
+            self._snapshot = snapshot._replace(stale=True, error=str(error))
+
+
+# Runs the full update pipeline once: collect, aggregate, store, render
+def run_refresh(store_file=STORE_FILE, outfile='loans.png', template='loans_template.png', mode='full'):
+    '''
+    Reads loan data from the blockchain (mode='full') or the store
+    (mode='prices'), computes loan metrics, appends them to the time-series
+    store and renders outfile. Returns the metrics dict.
+    '''
+    pipeline = build_update_pipeline(store_file=store_file, outfile=outfile, template=template,
+                                     deployments=load_deployments(), mode=mode)
+    results = pipeline.run()
+
+    timings = ', '.join(f'{name} {t:.1f}s' for name, t in pipeline.timings.items())
+    logging.info(f'Refresh ({mode}) stage timings: {timings}')
+
+    return results['metrics']
+
+
+class BackgroundRefresher:
+    """
+    Runs run_refresh() on a schedule in a background thread and publishes
+    the results to a SnapshotStore. Listeners are called with every new
+    snapshot (i.e. to push updates to users).
+
+    If price_interval_minutes is set, price-only refreshes run on their own
+    schedule. They are skipped while a full refresh is running.
+    """
+
+    def __init__(self, store, interval_minutes, refresh_func=run_refresh, price_interval_minutes=None):
+        self.store = store
+        self.interval_minutes = interval_minutes
+        self.price_interval_minutes = price_interval_minutes
+        self.refresh_func = refresh_func
+        self.listeners = []
+        self.scheduler = BackgroundScheduler(daemon=True)
+        self._running = threading.Lock()    # one refresh at a time, both write the store
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def start(self):
+        '''Starts the schedule. The first refresh runs right away.'''
+        self.scheduler.add_job(
+            self.refresh,
+            'interval',
+            minutes=self.interval_minutes,
+            next_run_time=datetime.now(),
+            max_instances=1,
+            coalesce=True
+            )
+        if self.price_interval_minutes:
+            self.scheduler.add_job(
+                self.refresh,
+                'interval',
+                kwargs={'mode': 'prices'},
+                minutes=self.price_interval_minutes,
+                max_instances=1,
+                coalesce=True
+                )
+        self.scheduler.start()
+
+
+    def stop(self):
+        self.scheduler.shutdown(wait=False)
+
+
+    def refresh(self, mode='full'):
+        '''Runs one refresh. Failures keep the last good snapshot.'''
+        # A full refresh waits for a running price refresh, a price refresh isn't needed during a full one
+        if not self._running.acquire(blocking=(mode == 'full')):
+            logging.info('Skipped price refresh, a full refresh is running.')
+            return
+
+        start = time()
+        try:
+            metrics = self.refresh_func(mode=mode)
+        except Exception as e:
+            logging.exception(f'Refresh ({mode}) failed, serving last good snapshot.')
+            self.store.mark_stale(e)
+            return
+        finally:
+            self._running.release()
+
+        snapshot = self.store.swap(metrics, mode)
+        logging.info(f'Refreshed loan metrics ({mode}) in {time() - start:.1f}s.')
+
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception:
+                logging.exception(f'Refresh listener {listener} failed.')
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Record-and-replay bundles of all external data used by one update run.
+
+In record mode every Ethereum RPC response, Etherscan ABI and scraped
+CoinGecko page is captured while the run talks to the live services.
+save_bundle() writes them to a gzip-compressed JSON bundle:
+
+    python update.py --record run.json.gz
+
+Requests to the RPC endpoints of other deployments (see deployments.py)
+are kept apart by the endpoint's host. Their shards are then collected on
+threads instead of worker processes, so their requests are captured too.
+
+In replay mode the same data is served from memory by an in-process
+transport, so the run needs no network access and no scraping delays:
+
+    python update.py --replay run.json.gz --store replay.db --image replay.png
+"""
+import os
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from urllib.parse import urlparse
+
+from web3.providers.base import BaseProvider
+
+
+BUNDLE_VERSION = 1
+
+
+class ReplayMissError(LookupError):
+    '''Raised when a replayed run requests data the bundle doesn't contain.'''
+
+
+# Helper function: Key of an RPC request in a bundle
+def rpc_key(method, params, endpoint=None):
+    '''
+    endpoint tells the providers of other RPC endpoints than the default
+    one apart (see endpoint_name()). Requests to the default one have none.
+    '''
+    request = [method, params] if endpoint is None else [endpoint, method, params]
+    return json.dumps(request, sort_keys=True, default=str)
+
+# Helper function: Name of an RPC endpoint in a bundle. Its host only,
+# so API keys in the url are neither recorded nor needed to replay.
+def endpoint_name(rpc_url):
+    return urlparse(rpc_url).hostname or rpc_url
+
+
+# Helper function: Scraped pages are bytes, bundles are JSON
+def page_to_text(page):
+    return page.decode('utf-8', 'surrogateescape')
+
+def text_to_page(text):
+    return text.encode('utf-8', 'surrogateescape')
+
+
+class Bundle:
+    """
+    Recorded responses of one run:
+
+        rpc    {rpc_key(method, params): [response, ...]} in order of the requests
+        abi    {contract address: abi}
+        pages  {url: page text}
+    """
+
+    def __init__(self, rpc=None, abi=None, pages=None, created=None):
+        self.rpc = rpc or {}
+        self.abi = abi or {}
+        self.pages = pages or {}
+        self.created = created or int(time())
+        self._lock = threading.Lock()
+
+
+    def add_rpc(self, method, params, response, endpoint=None):
+        with self._lock:
+            self.rpc.setdefault(rpc_key(method, params, endpoint), []).append(response)
+
+
+    def add_abi(self, address, abi):
+        with self._lock:
+            self.abi[address] = abi
+
+
+    def add_page(self, url, page):
+        with self._lock:
+            self.pages[url] = page_to_text(page)
+
+
+    def save(self, path):
+        data = {
+            'version': BUNDLE_VERSION,
+            'created': self.created,
+            'rpc': self.rpc,
+            'abi': self.abi,
+            'pages': self.pages
+            }
+        with gzip.open(path, 'wt', encoding='utf-8') as file:
+            json.dump(data, file)
+
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('version') != BUNDLE_VERSION:
+            raise ValueError(f'{path} has bundle version {data.get("version")}, expected {BUNDLE_VERSION}.')
+        return cls(data['rpc'], data['abi'], data['pages'], data['created'])
+
+
+    def __repr__(self):
+        n_rpc = sum(len(responses) for responses in self.rpc.values())
+        return f'<Bundle: {n_rpc} RPC responses, {len(self.abi)} ABIs, {len(self.pages)} pages>'
+
+
+#############################################################################
+#
+#   Recording
+#
+#############################################################################
+
+
+class RecordingProvider(BaseProvider):
+    """
+    Passes requests on to the live provider and records the responses.
+    """
+
+    def __init__(self, provider, bundle, endpoint=None):
+        self.provider = provider
+        self.bundle = bundle
+        self.endpoint = endpoint
+
+    def make_request(self, method, params):
+        response = self.provider.make_request(method, params)
+        self.bundle.add_rpc(method, params, response, self.endpoint)
+        return response
+
+    def isConnected(self):
+        return self.provider.isConnected()
+
+
+class RecordingEtherscan:
+    """
+    Passes ABI requests on to the Etherscan API and records the ABIs.
+    """
+
+    def __init__(self, etherscan, bundle):
+        self.etherscan = etherscan
+        self.bundle = bundle
+
+    def get_contract_abi(self, address):
+        abi = self.etherscan.get_contract_abi(address)
+        self.bundle.add_abi(address, abi)
+        return abi
+
+
+# Starts recording all external data used by data_aggregation
+def install_recorder():
+    '''
+    Wraps the Ethereum providers, Etherscan API and page downloads of
+    data_aggregation. Returns the Bundle the data is recorded to.
+    '''
+    import data_aggregation as da
+    import deployments
+
+    bundle = Bundle()
+    fetch_page = da.fetch_page
+    make_provider = da.make_provider
+
+    def recording_make_provider(rpc_url):
+        return RecordingProvider(make_provider(rpc_url), bundle, endpoint_name(rpc_url))
+
+    def recording_fetch_page(url):
+        page = fetch_page(url)
+        bundle.add_page(url, page)
+        return page
+
+    # Contexts created from now on use these clients, the default context too
+    da.w3.provider = RecordingProvider(da.w3.provider, bundle)
+    da.make_provider = recording_make_provider
+    da.etherscan = da.DEFAULT_CONTEXT.etherscan = RecordingEtherscan(da.etherscan, bundle)
+    da.fetch_page = recording_fetch_page
+    # Worker processes would record into copies of the bundle
+    deployments.SHARD_POOL = ThreadPoolExecutor
+    return bundle
+
+
+#############################################################################
+#
+#   Replaying
+#
+#############################################################################
+
+
+class ReplayProvider(BaseProvider):
+    """
+    Answers RPC requests from a bundle. Repeated requests get the recorded
+    responses in order; once they are used up, the last one is repeated.
+    """
+
+    def __init__(self, bundle, endpoint=None):
+        self.bundle = bundle
+        self.endpoint = endpoint
+        self._served = {}
+        self._lock = threading.Lock()
+
+    def make_request(self, method, params):
+        key = rpc_key(method, params, self.endpoint)
+        responses = self.bundle.rpc.get(key)
+        if not responses:
+            raise ReplayMissError(f'No recorded response for RPC request {key}.')
+
+        with self._lock:
+            i = self._served.get(key, 0)
+            self._served[key] = i + 1
+        return responses[min(i, len(responses) - 1)]
+
+    def isConnected(self):
+        return True
+
+
+class ReplayEtherscan:
+    """
+    Answers ABI requests from a bundle.
+    """
+
+    def __init__(self, bundle):
+        self.bundle = bundle
+
+    def get_contract_abi(self, address):
+        try:
+            return self.bundle.abi[address]
+        except KeyError:
+            raise ReplayMissError(f'No recorded ABI for {address}.')
+
+
+# Serves all external data used by data_aggregation from a bundle
+def install_replayer(bundle):
+    '''
+    Takes a Bundle or the path of a bundle file. Replaces the Ethereum
+    providers, Etherscan API and page downloads of data_aggregation, so
+    no network access is needed. Returns the Bundle.
+    '''
+    if not isinstance(bundle, Bundle):
+        bundle = Bundle.load(bundle)
+
+    # data_aggregation reads these at import time, but replaying doesn't use them
+    os.environ.setdefault('ETHERSCAN_API_KEY', 'replay')
+    os.environ.setdefault('WEB3_INFURA_PROJECT_ID', 'replay')
+    import data_aggregation as da
+    import deployments
+
+    def replay_make_provider(rpc_url):
+        return ReplayProvider(bundle, endpoint_name(rpc_url))
+
+    def replay_fetch_page(url):
+        try:
+            return text_to_page(bundle.pages[url])
+        except KeyError:
+            raise ReplayMissError(f'No recorded page for {url}.')
+
+    # Contexts created from now on use these clients, the default context too
+    da.w3.provider = ReplayProvider(bundle)
+    da.make_provider = replay_make_provider
+    da.etherscan = da.DEFAULT_CONTEXT.etherscan = ReplayEtherscan(bundle)
+    da.fetch_page = replay_fetch_page
+    da.SCRAPE_DELAY_SCALE = 0
+    deployments.SHARD_POOL = ThreadPoolExecutor
+    return bundle
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Single-flight coalescing of identical concurrent work for MerchBot.
+"""
+import threading
+
+
+class _Call:
+    """
+    One in-flight execution that concurrent callers wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Merges concurrent calls with the same key into one execution.
+    The first caller runs the function, all callers arriving while it
+    runs wait and receive the same result (or exception).
+
+    Example:
+            >>>payload, shared = flights.do(('read', 'loans.png'), read_func)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0          # total calls of do()
+        self.executions = 0     # calls that actually ran the function
+        self.coalesced = 0      # calls that were served by another call
+
+
+    def do(self, key, function):
+        '''
+        Runs function() unless an identical call is in flight.
+        Returns a tuple (result, shared). shared is False for the
+        caller that executed the function.
+        '''
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+
+            if call:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+    def stats(self):
+        '''
+        Returns a dict of coalescing statistics.
+        '''
+        with self._lock:
+            saved = self.coalesced / self.calls * 100 if self.calls else 0.0
+            return {
+                'calls': self.calls,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'percent_saved': round(saved, 2)
+                }
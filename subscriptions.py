@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Chats subscribed to bot notifications, by topic (i.e. 'alerts').
+Kept in memory and saved to subscriptions.json on every change.
+"""
+import os
+import json
+import threading
+
+
+SUBSCRIPTIONS_FILE = 'subscriptions.json'
+
+
+class Subscriptions:
+    """
+    {topic: set of chat ids}, persisted as JSON.
+    """
+
+    def __init__(self, path=SUBSCRIPTIONS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._topics = {}
+
+        if os.path.isfile(path):
+            with open(path) as file:
+                self._topics = {topic: set(chats) for topic, chats in json.load(file).items()}
+
+
+    def subscribe(self, chat_id, topic):
+        '''Returns False if the chat was subscribed already.'''
+        with self._lock:
+            chats = self._topics.setdefault(topic, set())
+            if chat_id in chats:
+                return False
+            chats.add(chat_id)
+            self._save()
+        return True
+
+
+    def unsubscribe(self, chat_id, topic):
+        '''Returns False if the chat wasn't subscribed.'''
+        with self._lock:
+            chats = self._topics.get(topic, set())
+            if chat_id not in chats:
+                return False
+            chats.discard(chat_id)
+            self._save()
+        return True
+
+
+    def migrate(self, chat_id, new_chat_id):
+        '''Moves the subscriptions of a chat to its new id (i.e. a group that became a supergroup).'''
+        with self._lock:
+            moved = False
+            for chats in self._topics.values():
+                if chat_id in chats:
+                    chats.discard(chat_id)
+                    chats.add(new_chat_id)
+                    moved = True
+            if moved:
+                self._save()
+        return moved
+
+
+    def is_subscribed(self, chat_id, topic):
+        return chat_id in self._topics.get(topic, ())
+
+
+    def chats(self, topic):
+        '''Returns a copy of the chat ids subscribed to topic.'''
+        with self._lock:
+            return set(self._topics.get(topic, ()))
+
+
+    def _save(self):
+        # Write to a temporary file first, so a crash never leaves a half-written file
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, 'w') as file:
+            json.dump({topic: sorted(chats) for topic, chats in self._topics.items()}, file)
+        os.replace(tmpfile, self.path)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Counters and histograms for RPC calls, scraping, caches, pipeline stages,
+rendering and bot commands, exposed in Prometheus text format.
+
+The metrics can be served by a local HTTP endpoint (start_metrics_server())
+or written to a file for node_exporter's textfile collector (write_textfile()).
+"""
+import os
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+
+# Default histogram buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+# Helper function: Copies histogram bucket counts so exposition sees a consistent state
+def _copy(value):
+    return (list(value[0]),) + value[1:] if isinstance(value, tuple) else value
+
+
+class _Metric:
+    """
+    Base class of metrics with optional labels.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        labels = tuple(str(label) for label in labels)
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {labels}.')
+        return labels
+
+    def _label_str(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((key, _copy(value)) for key, value in self._values.items())
+        for key, value in items:
+            lines += self._sample_lines(key, value)
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, i.e. number of requests.
+    """
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _sample_lines(self, key, value):
+        return [f'{self.name}_total{self._label_str(key)} {value}']
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, i.e. durations in seconds.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, n + 1)
+
+    @contextmanager
+    def time(self, *labels):
+        '''Observes the duration of a with block.'''
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *labels)
+
+    def count(self, *labels):
+        return self._values.get(self._key(labels), (None, None, 0))[2]
+
+    def _sample_lines(self, key, value):
+        counts, total, n = value
+        lines = [
+            f'{self.name}_bucket{self._label_str(key, [("le", repr(float(bound)))])} {count}'
+            for bound, count in zip(self.buckets, counts)
+            ]
+        lines.append(f'{self.name}_bucket{self._label_str(key, [("le", "+Inf")])} {n}')
+        lines.append(f'{self.name}_sum{self._label_str(key)} {total}')
+        lines.append(f'{self.name}_count{self._label_str(key)} {n}')
+        return lines
+
+
+class Registry:
+    """
+    Collection of metrics that are exposed together.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def expose(self):
+        '''Returns all metrics in Prometheus text format.'''
+        lines = []
+        for metric in self._metrics:
+            lines += metric.expose()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+#############################################################################
+#
+#   Metrics
+#
+#############################################################################
+
+RPC_SECONDS = Histogram(
+    'statsbot_rpc_seconds', 'Duration of Ethereum RPC calls by contract method.', ['method'])
+ETHERSCAN_SECONDS = Histogram(
+    'statsbot_etherscan_seconds', 'Duration of Etherscan API requests by endpoint.', ['endpoint'])
+COINGECKO_SECONDS = Histogram(
+    'statsbot_coingecko_seconds', 'Duration of CoinGecko requests by page.', ['page'])
+CACHE_REQUESTS = Counter(
+    'statsbot_cache_requests', 'Cache lookups by cache and result (hit or miss).', ['cache', 'result'])
+CONNECTION_ERRORS = Counter(
+    'statsbot_connection_errors', 'Connection errors during data collection by function.', ['function'])
+STAGE_SECONDS = Histogram(
+    'statsbot_stage_seconds', 'Duration of update pipeline stages.', ['stage'])
+RENDER_SECONDS = Histogram(
+    'statsbot_render_seconds', 'Duration of rendering infographics.', ['image'])
+BOT_COMMAND_SECONDS = Histogram(
+    'statsbot_bot_command_seconds', 'Handler latency of bot commands.', ['command'])
+API_REQUESTS = Counter(
+    'statsbot_api_requests', 'HTTP API requests by endpoint and status.', ['endpoint', 'status'])
+
+
+# Helper function: Counts a cache hit or miss
+def count_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+#############################################################################
+#
+#   Exposition
+#
+#############################################################################
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ('/metrics', '/'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = self.server.registry.expose().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves /metrics in Prometheus text format from a daemon thread
+def start_metrics_server(port, listen='127.0.0.1', registry=REGISTRY):
+    server = ThreadingHTTPServer((listen, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+# Writes all metrics to a file for node_exporter's textfile collector
+def write_textfile(path, registry=REGISTRY):
+    tmpfile = path + '.tmp'
+    with open(tmpfile, 'w') as file:
+        file.write(registry.expose())
+    os.replace(tmpfile, path)
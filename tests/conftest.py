@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules under test live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# data_aggregation reads these at import time, the tests don't use them
+os.environ.setdefault('ETHERSCAN_API_KEY', 'test')
+os.environ.setdefault('WEB3_INFURA_PROJECT_ID', 'test')
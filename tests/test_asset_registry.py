@@ -0,0 +1,48 @@
+import os
+
+from asset_registry import AssetRegistry
+
+
+def write(path, text, mtime):
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_reloads_only_when_mtime_changes(tmp_path):
+    path = tmp_path / 'menu_msg.txt'
+    write(path, 'menu v1', 1000)
+    reads = []
+
+    def loader(p):
+        reads.append(p)
+        return open(p).read()
+
+    assets = AssetRegistry(check_interval=0)
+    assets.register('menu', str(path), loader)
+    assert assets.get('menu') == 'menu v1'
+    assert assets.get('menu') == 'menu v1'
+    assert len(reads) == 1
+
+    write(path, 'menu v2', 2000)
+    assert assets.get('menu') == 'menu v2'
+    assert len(reads) == 2
+
+
+def test_check_interval_and_missing_file(tmp_path):
+    path = tmp_path / 'signature_msg.txt'
+    write(path, 'signature', 1000)
+
+    assets = AssetRegistry(check_interval=3600)
+    assets.register('signature', str(path))
+    write(path, 'edited', 2000)
+    # Not checked again before check_interval is over
+    assert assets.get('signature') == 'signature'
+
+    assets.check_interval = 0
+    path.unlink()
+    assert assets.get('signature') == 'signature'
+
+    assets.register('later', str(tmp_path / 'under_construction.txt'))
+    assert assets.get('later') is None
+    write(tmp_path / 'under_construction.txt', 'soon', 1000)
+    assert assets.get('later') == 'soon'
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+import backfill
+
+
+DAI = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+USDC = '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48'
+
+
+def chain(latest=1000):
+    '''Fake context of a chain with one block every 10 seconds, counting block reads.'''
+    reads = []
+
+    def getBlock(block_number):
+        reads.append(block_number)
+        return {'timestamp': block_number * 10}
+
+    return SimpleNamespace(eth=SimpleNamespace(getBlock=getBlock, blockNumber=latest)), reads
+
+
+def test_blocks_at_timestamps():
+    ctx, _ = chain()
+
+    assert backfill.blocks_at_timestamps([5, 10, 4321, 99999], ctx=ctx) == {5: 0, 10: 1, 4321: 432, 99999: 1000}
+    assert backfill.block_at_timestamp(4320, ctx=ctx) == 432
+
+
+def test_blocks_at_timestamps_reuses_bounds():
+    timestamps = [10 * block + 5 for block in range(100, 1000, 100)]
+    ctx, reads = chain()
+    blocks = backfill.blocks_at_timestamps(timestamps, ctx=ctx)
+
+    serial_ctx, serial_reads = chain()
+    assert blocks == {ts: backfill.block_at_timestamp(ts, ctx=serial_ctx) for ts in timestamps}
+    assert len(reads) == len(set(reads))
+    assert len(reads) < len(serial_reads)
+
+
+def loan(lending_token=DAI, collateral_token=USDC):
+    return {
+        'collateral_balance': 10**6, 'ts_due': 2000, 'is_defaulted': False,
+        'address_lender': '0x1', 'address_borrower': '0x2',
+        'address_lending_token': lending_token, 'address_collateral_token': collateral_token,
+        'principal': 10**18, 'interest': 500, 'duration': 30 * 86400, 'collateral': 2 * 10**6,
+        'loan_status': 0, 'ts_start': 1000, 'ts_repaid': 0, 'liquidatable_t_allowance': 0
+        }
+
+
+@pytest.fixture
+def fake_chain(monkeypatch):
+    '''Blocks 1-3 at one day apart. Block 3 can't be read, USDC has no price at block 2.'''
+    day = backfill.MAX_PRICE_AGE
+
+    def loans_at_block(block_number, immutable_cache, ctx=None):
+        if block_number == 3:
+            raise ConnectionError('pruned state')
+        return block_number * 2 * day, {'0xa': loan()}, 1000
+
+    def price_histories(tokens, start, end, max_workers=4):
+        return {DAI: [(2 * day, 1.0), (4 * day, 1.0)], USDC: [(2 * day, 1.0)]}
+
+    monkeypatch.setattr(backfill, 'loans_at_block', loans_at_block)
+    monkeypatch.setattr(backfill, 'price_histories', price_histories)
+
+
+def test_backfill_skips_blocks_without_prices_or_state(fake_chain, tmp_path):
+    results = backfill.backfill([1, 2, 3], store_file=str(tmp_path / 'store.db'), max_workers=2)
+
+    assert list(results) == [1]
+    assert results[1]['total_loans'] == 1
+    assert results[1]['total_collateral_in_use_USD'] == 2
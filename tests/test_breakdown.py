@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from breakdown import loan_breakdown, save_breakdown
+
+
+DAI = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+USDC = '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48'
+WETH = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+
+
+def loan(lending, principal, collateral_token, collateral, interest, status=0):
+    return {
+        'address_lending_token': lending, 'principal': principal,
+        'address_collateral_token': collateral_token, 'collateral': collateral,
+        'interest': interest, 'loan_status': status,
+        }
+
+
+LOANS = {
+    '0xa': loan(DAI, 1000 * 10**18, WETH, 1 * 10**18, 500),
+    '0xb': loan(DAI, 500 * 10**18, WETH, 10**18 // 2, 1000),
+    '0xc': loan(USDC, 2000 * 10**6, WETH, 2 * 10**18, 300),
+    '0xd': loan(USDC, 100 * 10**6, DAI, 200 * 10**18, 400),
+    '0xe': loan(DAI, 9999 * 10**18, WETH, 9 * 10**18, 100, status=1),    # repaid
+    }
+PRICES = {DAI: 1.0, USDC: 1.0, WETH: 2000.0}
+
+
+def test_groups_sum_to_the_active_loan_book():
+    breakdown = loan_breakdown(LOANS, PRICES)
+
+    for name in ('lending', 'collateral', 'pair'):
+        rows = breakdown[name]
+        assert sum(row['loans'] for row in rows) == 4
+        assert sum(row['borrowed_USD'] for row in rows) == pytest.approx(3600)
+        assert sum(row['collateral_USD'] for row in rows) == pytest.approx(7200)
+
+    usdc, dai = breakdown['lending']
+    assert (usdc['symbol'], usdc['loans'], usdc['borrowed_USD']) == ('USDC', 2, pytest.approx(2100))
+    assert (dai['symbol'], dai['loans'], dai['borrowed_USD']) == ('DAI', 2, pytest.approx(1500))
+    assert dai['avg_interest_rate'] == pytest.approx(7.5)
+
+    assert [row['symbol'] for row in breakdown['collateral']] == ['WETH', 'DAI']
+    assert [row['symbol'] for row in breakdown['pair']] == ['USDC/WETH', 'DAI/WETH', 'USDC/DAI']
+    assert breakdown['pair'][1]['collateralization'] == pytest.approx(200)
+
+
+def test_groups_without_price_are_null_once_saved(tmp_path):
+    breakdown = loan_breakdown(LOANS, {DAI: 1.0, USDC: 1.0})
+    path = str(tmp_path / 'breakdown.json')
+    save_breakdown(breakdown, 1700000000, path)
+
+    with open(path) as file:
+        saved = json.load(file)
+    # Groups with known prices come first
+    assert [row['symbol'] for row in saved['collateral']] == ['DAI', 'WETH']
+    assert saved['collateral'][1]['collateral_USD'] is None
+    assert saved['lending'][0]['borrowed_USD'] == pytest.approx(2100)
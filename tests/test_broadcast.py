@@ -0,0 +1,91 @@
+import os
+import threading
+from time import sleep
+from types import SimpleNamespace
+
+from telegram.error import ChatMigrated, RetryAfter
+
+from broadcast import Broadcaster
+from single_flight import SingleFlight
+from subscriptions import Subscriptions
+
+
+class FakeBot:
+    """
+    Records sends. errors maps chat ids to an exception raised on every send to them.
+    """
+
+    def __init__(self, errors=None, upload_started=None, upload_release=None):
+        self.errors = errors or {}
+        self.upload_started = upload_started
+        self.upload_release = upload_release
+        self.sends = []
+        self._lock = threading.Lock()
+
+    def send_photo(self, chat_id, photo, caption=None):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        if isinstance(photo, bytes) and self.upload_started:
+            self.upload_started.set()
+            self.upload_release.wait(5)
+        with self._lock:
+            self.sends.append((chat_id, 'upload' if isinstance(photo, bytes) else photo))
+        return SimpleNamespace(photo=[SimpleNamespace(file_id='file-1')])
+
+
+def broadcaster(bot, **kwargs):
+    b = Broadcaster(bot, max_per_second=1000, chat_interval=0, workers=2, **kwargs)
+    b.start()
+    return b
+
+
+def picture(tmp_path):
+    path = tmp_path / 'loans.png'
+    path.write_bytes(b'png')
+    return str(path)
+
+
+def test_flood_limited_chat_gives_up(tmp_path):
+    bot = FakeBot({2: RetryAfter(0)})
+    broadcast = broadcaster(bot, max_attempts=3).broadcast_photo(picture(tmp_path), [1, 2, 3])
+
+    assert broadcast.wait(5)
+    assert (broadcast.sent, broadcast.failed) == (2, 1)
+    assert sorted(bot.sends) == [(1, 'upload'), (3, 'file-1')]
+
+
+def test_migrated_chat_is_persisted(tmp_path):
+    subscriptions = Subscriptions(str(tmp_path / 'subscriptions.json'))
+    subscriptions.subscribe(2, 'loans')
+    bot = FakeBot({2: ChatMigrated(-1002)})
+    b = broadcaster(bot, on_migrated=subscriptions.migrate)
+
+    assert b.broadcast_photo(picture(tmp_path), [1, 2]).wait(5)
+    assert (-1002, 'file-1') in bot.sends
+    assert Subscriptions(str(tmp_path / 'subscriptions.json')).chats('loans') == {-1002}
+
+
+def test_upload_shared_with_concurrent_request(tmp_path):
+    pic_file = picture(tmp_path)
+    started, release = threading.Event(), threading.Event()
+    bot = FakeBot(upload_started=started, upload_release=release)
+    flights = SingleFlight()
+    b = broadcaster(bot, flights=flights)
+
+    thread = threading.Thread(target=lambda: b.broadcast_photo(pic_file, [1, 2]).wait(5))
+    thread.start()
+    assert started.wait(5)
+
+    # A user request for the same version waits for the broadcast's upload
+    key = ('upload', pic_file, os.path.getmtime(pic_file))
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(flights.do(key, lambda: 'uploaded again')))
+    waiter.start()
+    while flights.coalesced < 1:
+        sleep(0.001)
+    release.set()
+    waiter.join(5)
+    thread.join(5)
+
+    assert result == [('file-1', True)]
+    assert [send for send in bot.sends if send[1] == 'upload'] == [(1, 'upload')]
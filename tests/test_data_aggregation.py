@@ -0,0 +1,40 @@
+import data_aggregation as da
+
+
+def loan(status, principal=10**21):
+    return {
+        'collateral_balance': 0, 'ts_due': 2000, 'is_defaulted': status == 2,
+        'address_lender': '0x1', 'address_borrower': '0x2',
+        'address_lending_token': '0x3', 'address_collateral_token': '0x4',
+        'principal': principal, 'interest': 500, 'duration': 30 * 86400, 'collateral': 10**21,
+        'loan_status': status, 'ts_start': 1000, 'ts_repaid': 0, 'liquidatable_t_allowance': 0
+        }
+
+
+def shard_metrics(loans_data):
+    ctx = da.CollectionContext()
+    da.set_all_loans_data(loans_data, ctx)
+    da.set_scraped_prices({}, ctx)
+    return da.export_loan_metrics_dict(ctx=ctx, with_YLD=False, timestamp=0)
+
+
+def test_metrics_of_empty_shard():
+    metrics = shard_metrics({})
+
+    assert metrics['total_loans'] == 0
+    assert metrics['percent_defauted'] == 0
+    assert metrics['avg_loan_val_USD'] == 0
+    assert metrics['avg_interest_rate'] == 0
+    assert metrics['avg_loan_duration_days'] == 0
+    assert metrics['YLD_total_supply'] is None
+
+
+def test_metrics_of_defaulted_shard():
+    metrics = shard_metrics({'0xa': loan(2), '0xb': loan(2)})
+
+    assert (metrics['total_loans'], metrics['defauted_loans']) == (2, 2)
+    assert metrics['percent_defauted'] == 100
+    assert metrics['avg_loan_val_USD'] == 0
+    assert metrics['avg_interest_rate'] == 5
+    assert metrics['avg_loan_duration_days'] == 30
+    assert metrics['total_collateral_in_use_USD'] == 0
@@ -0,0 +1,36 @@
+import json
+import os
+
+import deployments as dep
+
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'deployments.example.json')
+
+
+def test_example_loads_as_shipped():
+    deployments = dep.load_deployments(EXAMPLE)
+
+    assert [(d.name, d.network) for d in deployments] == [('mainnet', 'mainnet'), ('polygon', 'polygon')]
+    assert deployments[1].tokens and deployments[1].abis is None
+
+
+def test_abi_files_are_relative_to_deployments_file(tmp_path):
+    (tmp_path / 'abis').mkdir()
+    (tmp_path / 'abis' / 'factory.json').write_text('[{"name": "getLoans"}]')
+    (tmp_path / 'abis' / 'loan.json').write_text('[]')
+    (tmp_path / 'deployments.json').write_text(json.dumps([{
+        'name': 'polygon', 'network': 'polygon', 'loan_factory': '0x2',
+        'abis': {'loan_factory': 'abis/factory.json', 'loan': 'abis/loan.json'}}]))
+
+    deployment, = dep.load_deployments(str(tmp_path / 'deployments.json'))
+    assert deployment.abis == ([{'name': 'getLoans'}], [])
+
+
+def test_merge_shards_names_tokens_by_network():
+    deployments = dep.load_deployments(EXAMPLE)
+    loan = {'address_lending_token': '0xt', 'address_collateral_token': '0xc'}
+
+    merged = dep.merge_shards({'mainnet': {'0xa': loan}, 'polygon': {'0xa': loan}}, deployments)
+
+    assert merged['0xa'] == loan
+    assert merged['polygon:0xa'] == {'address_lending_token': 'polygon:0xt', 'address_collateral_token': 'polygon:0xc'}
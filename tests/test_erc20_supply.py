@@ -0,0 +1,62 @@
+import pytest
+
+import multicall as mc
+from erc20_supply import SupplyService
+
+
+DAI = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+USDC = '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48'
+
+
+def fake_rpc(block_numbers):
+    requests = []
+
+    def rpc(method, params):
+        requests.append(params[1])
+        results = [(True, (10**24).to_bytes(32, 'big')), (False, b'')]
+        return '0x' + mc.encode_results(block_numbers[len(requests) - 1], b'\x11' * 32, results).hex()
+
+    return rpc, requests
+
+
+def test_latest_is_cached_by_block_number():
+    rpc, requests = fake_rpc([100, 100])
+    service = SupplyService(tokens=[DAI, USDC], rpc=rpc)
+
+    assert service.supplies() == (100, {DAI: 1000000.0})
+    assert service.supply(DAI) == 1000000.0
+    assert service.supply(USDC) is None
+    assert service.supplies(100) == (100, {DAI: 1000000.0})
+    assert requests == ['latest']
+
+
+def test_latest_expires():
+    rpc, requests = fake_rpc([100, 101])
+    service = SupplyService(tokens=[DAI, USDC], rpc=rpc, latest_ttl=0)
+
+    assert service.supplies()[0] == 100
+    assert service.supplies()[0] == 101
+    assert requests == ['latest', 'latest']
+
+
+def test_blocks_before_multicall_use_direct_calls():
+    requests = []
+
+    def rpc(method, params):
+        requests.append(params[0]['to'])
+        if params[0]['to'] == mc.MULTICALL2_ADDRESS:
+            return '0x'
+        if params[0]['to'] == DAI:
+            return '0x' + (10**24).to_bytes(32, 'big').hex()
+        raise mc.RPCError({'message': 'execution reverted'})
+
+    service = SupplyService(tokens=[DAI, USDC], rpc=rpc)
+
+    assert service.supplies(12000000) == (12000000, {DAI: 1000000.0})
+    assert requests == [mc.MULTICALL2_ADDRESS, DAI, USDC]
+    assert 0 not in service._cache
+
+
+def test_multicall_raises_without_contract():
+    with pytest.raises(mc.MulticallNotDeployedError):
+        mc.multicall([(DAI, mc.selector('totalSupply()'))], 12000000, rpc=lambda method, params: '0x')
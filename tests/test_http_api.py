@@ -0,0 +1,69 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from breakdown import save_breakdown
+from http_api import MetricsApi, start_api_server
+
+
+BREAKDOWN = {
+    'lending': [{'token': '0xa', 'symbol': 'DAI', 'loans': 2, 'borrowed_USD': 2000.0, 'collateral_USD': float('nan'),
+                 'avg_interest_rate': 5.0, 'collateralization': float('nan')}],
+    'collateral': [],
+    'pair': [],
+    }
+
+
+def strict_loads(body):
+    def reject(constant):
+        raise ValueError(f'{constant} is not JSON')
+    return json.loads(body, parse_constant=reject)
+
+
+@pytest.fixture
+def api_url(tmp_path):
+    save_breakdown(BREAKDOWN, 1700000000, path=str(tmp_path / 'breakdown.json'))
+    api = MetricsApi(store_file=str(tmp_path / 'store.db'), image_file=str(tmp_path / 'loans.png'),
+                     breakdown_file=str(tmp_path / 'breakdown.json'))
+    server = start_api_server(0, api=api)
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def get(url, etag=None):
+    request = urllib.request.Request(url, headers={'If-None-Match': etag} if etag else {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_breakdown_is_strict_json(api_url):
+    status, headers, body = get(api_url + '/api/breakdown')
+
+    assert status == 200
+    breakdown = strict_loads(body)
+    assert breakdown['time'] == 1700000000
+    assert breakdown['lending'][0]['collateral_USD'] is None
+    assert breakdown['lending'][0]['borrowed_USD'] == 2000.0
+
+
+def test_etag_revalidation(api_url):
+    status, headers, body = get(api_url + '/api/breakdown')
+    etag = headers['ETag']
+
+    status, headers, body = get(api_url + '/api/breakdown', etag=etag)
+    assert (status, body) == (304, b'')
+    assert headers['ETag'] == etag
+
+    status, _, body = get(api_url + '/api/breakdown', etag='"other"')
+    assert status == 200 and body
+
+
+def test_unknown_path_and_no_data(api_url):
+    assert get(api_url + '/api/nothing')[0] == 404
+    assert get(api_url + '/api/latest')[0] == 404
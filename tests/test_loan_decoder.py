@@ -0,0 +1,40 @@
+from decimal import Decimal
+
+import loan_decoder as ld
+import lookups as lu
+
+
+DAI = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+USDC = '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48'
+
+
+def loan(lending_token, collateral_token):
+    return {
+        'collateral_balance': 5 * 10**17, 'ts_due': 2000, 'is_defaulted': False,
+        'address_lender': '0x1', 'address_borrower': '0x2',
+        'address_lending_token': lending_token, 'address_collateral_token': collateral_token,
+        'principal': 1234500000, 'interest': 500, 'duration': 86400, 'collateral': 10**18,
+        'loan_status': 0, 'ts_start': 1000, 'ts_repaid': 0, 'liquidatable_t_allowance': 0
+        }
+
+
+def test_amounts_in_token_units():
+    assert lu.token_map[USDC]['decimals'] == 6
+    record = ld.decode_record('0xa', loan(USDC, DAI))
+    columns = ld.decode_float_columns({'0xa': loan(USDC, DAI)})
+
+    assert record.principal == Decimal('1234.5')
+    assert record.collateral == Decimal(1)
+    assert columns['principal'] == (1234.5,)
+    assert columns['collateral_balance'] == (0.5,)
+
+
+def test_unknown_token_amounts_are_none(caplog):
+    ld.unknown_tokens.discard('polygon:0xdead')
+    columns = ld.decode_float_columns({'0xa': loan('polygon:0xdead', DAI), '0xb': loan('polygon:0xdead', DAI)})
+
+    assert columns['principal'] == (None, None)
+    assert columns['collateral'] == (1.0, 1.0)
+    assert ld.decode_record('0xa', loan('polygon:0xdead', DAI)).principal is None
+    assert [r.message for r in caplog.records].count(
+        'No token data for polygon:0xdead (lookups.py or deployments.json), its amounts are unknown.') == 1
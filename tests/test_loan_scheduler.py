@@ -0,0 +1,40 @@
+from loan_scheduler import LoanScheduler
+
+
+def loan(ts_due, status=0, allowance=100):
+    return {'loan_status': status, 'ts_due': ts_due, 'liquidatable_t_allowance': allowance}
+
+
+def test_update_loans_schedules_active_loans():
+    scheduler = LoanScheduler(on_event=None)
+    changed = scheduler.update_loans({'0xa': loan(2000), '0xb': loan(1500), '0xc': loan(1000, status=1)}, now=0)
+
+    assert changed == 2
+    assert scheduler.next_event() == (1500, 'due', '0xb')
+    assert scheduler.pending() == 4
+
+
+def test_update_loans_reschedules_changed_deadlines():
+    scheduler = LoanScheduler(on_event=None)
+    scheduler.update_loans({'0xa': loan(2000), '0xb': loan(1500)}, now=0)
+
+    # Unchanged loans push no entries
+    assert scheduler.update_loans({'0xa': loan(2000), '0xb': loan(1500)}, now=0) == 0
+    assert scheduler.pending() == 4
+
+    # A new due date outdates the old entries of 0xb
+    assert scheduler.update_loans({'0xa': loan(2000), '0xb': loan(3000)}, now=0) == 1
+    assert scheduler.next_event() == (2000, 'due', '0xa')
+
+    # Repaid or disappeared loans are dropped
+    assert scheduler.update_loans({'0xa': loan(2000, status=1), '0xb': loan(3000)}, now=0) == 1
+    assert scheduler.next_event() == (3000, 'due', '0xb')
+    assert scheduler.update_loans({}, now=0) == 1
+    assert scheduler.next_event() is None
+
+
+def test_update_loans_skips_past_deadlines():
+    scheduler = LoanScheduler(on_event=None)
+    scheduler.update_loans({'0xa': loan(1000, allowance=500)}, now=1200)
+
+    assert scheduler.next_event() == (1500, 'liquidatable', '0xa')
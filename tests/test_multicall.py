@@ -0,0 +1,71 @@
+import multicall as mc
+
+
+DAI = '0x6b175474e89094c44da98b954eedeac495271d0f'
+USDC = '0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48'
+
+TOTAL_SUPPLY = bytes.fromhex('18160ddd')
+BALANCE_OF = bytes.fromhex('70a08231' + '00' * 12 + '5ba1e12693dc8f9c48aad8770482f4739beed696')
+
+CALLS = [(DAI, TOTAL_SUPPLY), (USDC, BALANCE_OF)]
+
+# tryBlockAndAggregate(false, CALLS) as encoded by eth_abi
+CALLDATA = bytes.fromhex('399542e9' + ''.join([
+    '0000000000000000000000000000000000000000000000000000000000000000',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '0000000000000000000000000000000000000000000000000000000000000002',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '00000000000000000000000000000000000000000000000000000000000000c0',
+    '0000000000000000000000006b175474e89094c44da98b954eedeac495271d0f',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '0000000000000000000000000000000000000000000000000000000000000004',
+    '18160ddd00000000000000000000000000000000000000000000000000000000',
+    '000000000000000000000000a0b86991c6218b36c1d19d4a2e9eb0ce3606eb48',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '0000000000000000000000000000000000000000000000000000000000000024',
+    '70a082310000000000000000000000005ba1e12693dc8f9c48aad8770482f473',
+    '9beed69600000000000000000000000000000000000000000000000000000000',
+    ]))
+
+# Return data (12345678, 0x11..11, [(true, 10**24), (false, '')]) as encoded by eth_abi
+RESULTS = bytes.fromhex(''.join([
+    '0000000000000000000000000000000000000000000000000000000000bc614e',
+    '1111111111111111111111111111111111111111111111111111111111111111',
+    '0000000000000000000000000000000000000000000000000000000000000060',
+    '0000000000000000000000000000000000000000000000000000000000000002',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '00000000000000000000000000000000000000000000000000000000000000c0',
+    '0000000000000000000000000000000000000000000000000000000000000001',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '0000000000000000000000000000000000000000000000000000000000000020',
+    '00000000000000000000000000000000000000000000d3c21bcecceda1000000',
+    '0000000000000000000000000000000000000000000000000000000000000000',
+    '0000000000000000000000000000000000000000000000000000000000000040',
+    '0000000000000000000000000000000000000000000000000000000000000000',
+    ]))
+
+
+def test_selector():
+    assert mc.TRY_BLOCK_AND_AGGREGATE == bytes.fromhex('399542e9')
+
+
+def test_encode_try_block_and_aggregate():
+    assert mc.encode_try_block_and_aggregate(CALLS) == CALLDATA
+    assert mc.decode_try_block_and_aggregate(CALLDATA) == (False, CALLS)
+
+
+def test_results_round_trip():
+    expected = [(True, (10**24).to_bytes(32, 'big')), (False, b'')]
+    assert mc.decode_results(RESULTS) == (12345678, expected)
+    assert mc.encode_results(12345678, b'\x11' * 32, expected) == RESULTS
+
+
+def test_multicall_with_rpc():
+    requests = []
+
+    def rpc(method, params):
+        requests.append((method, params))
+        return '0x' + RESULTS.hex()
+
+    assert mc.multicall(CALLS, block_identifier=12345678, rpc=rpc) == (12345678, [(10**24).to_bytes(32, 'big'), None])
+    assert requests == [('eth_call', [{'to': mc.MULTICALL2_ADDRESS, 'data': '0x' + CALLDATA.hex()}, '0xbc614e'])]
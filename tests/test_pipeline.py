@@ -0,0 +1,115 @@
+import os
+
+import pytest
+
+from deployments import Deployment, deployment_store_file
+from pipeline import Pipeline, Stage, build_update_pipeline, replace_atomically, update_cache_dir
+from timeseries_store import open_store
+
+
+def test_update_pipelines_have_own_caches():
+    dirs = {update_cache_dir(store, mode) for store in ('yield_stats.db', 'replay.db') for mode in ('full', 'prices')}
+    assert len(dirs) == 4
+
+
+def test_replace_atomically_keeps_old_file_on_error(tmp_path):
+    path = str(tmp_path / 'loans.png')
+    replace_atomically(path, lambda tmpfile: open(tmpfile, 'w').write('old'))
+
+    def fail(tmpfile):
+        open(tmpfile, 'w').write('half')
+        raise OSError('disk full')
+
+    with pytest.raises(OSError):
+        replace_atomically(path, fail)
+    assert open(path).read() == 'old'
+    assert os.listdir(str(tmp_path)) == ['loans.png']
+
+
+def test_pipelines_dont_share_cached_outputs(tmp_path):
+    full = Pipeline([Stage('loans', lambda: 'full')], cache_dir=str(tmp_path / 'full'))
+    prices = Pipeline([Stage('loans', lambda: 'prices'), Stage('metrics', lambda loans: loans, deps=['loans'])],
+                      cache_dir=str(tmp_path / 'prices'))
+    prices.run()
+    full.run()
+
+    assert prices.run_stage('metrics') == 'prices'
+
+
+def test_stages_run_after_their_dependencies(tmp_path):
+    order = []
+
+    def stage(name, deps=()):
+        def func(**inputs):
+            assert set(inputs) == set(deps)
+            order.append(name)
+            return name + ''.join(inputs[dep] for dep in deps)
+        return Stage(name, func, deps)
+
+    pipeline = Pipeline([
+        stage('metrics', ['loans', 'prices']), stage('prices', ['loans']), stage('loans'), stage('supply'),
+        ], cache_dir=str(tmp_path))
+    results = pipeline.run()
+
+    assert order.index('loans') < order.index('prices') < order.index('metrics')
+    assert results['prices'] == 'pricesloans'
+    assert results['metrics'] == 'metrics' + 'loans' + 'pricesloans'
+    assert set(pipeline.timings) == {'loans', 'prices', 'metrics', 'supply'}
+
+
+def test_cyclic_and_unknown_dependencies(tmp_path):
+    cyclic = Pipeline([Stage('a', lambda b: b, ['b']), Stage('b', lambda a: a, ['a'])], cache_dir=str(tmp_path))
+    with pytest.raises(ValueError, match='cyclic'):
+        cyclic.run()
+
+    with pytest.raises(ValueError, match='unknown'):
+        Pipeline([Stage('a', lambda missing: missing, ['missing'])])
+
+
+def test_run_stage_uses_cached_inputs(tmp_path):
+    calls = []
+
+    def loans():
+        calls.append('loans')
+        return [1, 2]
+
+    pipeline = Pipeline([Stage('loans', loans), Stage('total', lambda loans: sum(loans), ['loans'])],
+                        cache_dir=str(tmp_path))
+    with pytest.raises(RuntimeError, match='Run the whole pipeline first'):
+        pipeline.run_stage('total')
+
+    pipeline.run()
+    rerun = Pipeline([Stage('loans', loans), Stage('total', lambda loans: sum(loans) * 10, ['loans'])],
+                     cache_dir=str(tmp_path))
+
+    assert rerun.run_stage('total') == 30
+    assert calls == ['loans']
+
+
+def test_prices_mode_reads_loans_from_the_store(tmp_path):
+    store_file = str(tmp_path / 'yield_stats.db')
+    full = build_update_pipeline(store_file, mode='full')
+    prices = build_update_pipeline(store_file, mode='prices')
+
+    assert (full.stages['loans'].func.__name__, full.stages['loans'].retries) == ('loans', 3)
+    assert (prices.stages['loans'].func.__name__, prices.stages['loans'].retries) == ('cached_loans', 0)
+    assert prices.stages['yld_supply'].func.__name__ == 'cached_yld_supply'
+    with pytest.raises(RuntimeError, match='Run a full update first'):
+        prices.stages['loans']()
+
+    book = {'0xa': {'loan_status': 0, 'principal': 10**21}}
+    store = open_store(store_file, legacy_csvs=())
+    store.append({'YLD_total_supply': 1234.5}, ts=1000)
+    store.record_loan_run(book, ts=1000)
+
+    assert prices.stages['loans']() == book
+    assert prices.stages['yld_supply']() == 1234.5
+
+    polygon = Deployment('polygon', 'polygon', 'https://polygon-rpc.com', '0xfac', 5, {}, None)
+    open_store(deployment_store_file(store_file, 'polygon'), legacy_csvs=()).record_loan_run(book, ts=1000)
+    sharded = build_update_pipeline(store_file, mode='prices', deployments=[polygon])
+
+    assert sharded.stages['shards'].func.__name__ == 'cached_shards'
+    assert sharded.stages['shards']() == {'polygon': book}
+    with pytest.raises(ValueError):
+        build_update_pipeline(store_file, mode='loans')
@@ -0,0 +1,50 @@
+import numpy as np
+
+from price_history import DAY, PriceHistory, tvl_series
+
+
+DAI = '0x6B175474E89094C44Da98b954EedeAC495271d0F'
+USDC = '0xA0b86991c6218b36c1d19D4a2e9Eb0cE3606eB48'
+
+
+def history():
+    '''Days 0-4. DAI costs 1 USD, USDC 2 USD until day 3 (its last price is a day old) and is unknown after.'''
+    history = PriceHistory.empty(0, 4 * DAY, DAY, tokens=[DAI, USDC])
+    history.ingest(DAI, [(t, 1.0) for t in range(0, 5 * DAY, DAY)])
+    history.ingest(USDC, [(0, 2.0), (2 * DAY, 2.0)])
+    return history
+
+
+def test_price_at():
+    prices = history()
+
+    assert prices.price_at(DAI, 4 * DAY + 10) == 1.0
+    assert prices.price_at(USDC, 2 * DAY) == 2.0
+    assert prices.price_at(USDC, 3 * DAY) == 2.0
+    assert np.isnan(prices.price_at(USDC, 4 * DAY))
+    assert np.isnan(prices.price_at(DAI, -1))
+
+
+def loan(status, ts_start, **fields):
+    loan = {
+        'address_lending_token': DAI, 'address_collateral_token': USDC,
+        'principal': 10 * 10**18, 'collateral': 20 * 10**6,
+        'loan_status': status, 'ts_start': ts_start, 'ts_repaid': 0,
+        'ts_due': 10 * DAY, 'liquidatable_t_allowance': 0,
+        }
+    loan.update(fields)
+    return loan
+
+
+def test_tvl_series():
+    loans_data = {
+        '0xa': loan(0, 0),
+        '0xb': loan(1, DAY, ts_repaid=3 * DAY),
+        '0xc': loan(0, 0, address_collateral_token='0xunknown'),
+        }
+    times, tvl, borrowed = tvl_series(loans_data, history())
+
+    assert times.tolist() == [0, DAY, 2 * DAY, 3 * DAY, 4 * DAY]
+    # USDC collateral is worth 2 USD per token, and nothing once its price is unknown
+    assert tvl.tolist() == [40, 80, 80, 40, 0]
+    assert borrowed.tolist() == [10, 20, 20, 10, 10]
@@ -0,0 +1,61 @@
+import gzip
+import json
+
+import pytest
+
+from replay import (
+    Bundle, RecordingEtherscan, RecordingProvider, ReplayEtherscan, ReplayMissError, ReplayProvider, endpoint_name,
+    text_to_page)
+
+
+class LiveProvider:
+    """Answers eth_blockNumber with a new block on every request."""
+
+    def __init__(self):
+        self.block = 100
+
+    def make_request(self, method, params):
+        self.block += 1
+        return {'jsonrpc': '2.0', 'id': 1, 'result': hex(self.block)}
+
+
+class LiveEtherscan:
+    def get_contract_abi(self, address):
+        return '[{"type": "function", "name": "getLoans"}]'
+
+
+def test_record_replay_round_trip(tmp_path):
+    bundle = Bundle()
+    mainnet = RecordingProvider(LiveProvider(), bundle)
+    polygon = RecordingProvider(LiveProvider(), bundle, endpoint_name('https://polygon-rpc.com/v1/KEY'))
+    etherscan = RecordingEtherscan(LiveEtherscan(), bundle)
+
+    recorded = [mainnet.make_request('eth_blockNumber', []) for _ in range(2)]
+    recorded_polygon = polygon.make_request('eth_blockNumber', [])
+    abi = etherscan.get_contract_abi('0xfac')
+    bundle.add_page('https://www.coingecko.com/en', b'<html>\xff</html>')
+
+    path = str(tmp_path / 'run.json.gz')
+    bundle.save(path)
+    loaded = Bundle.load(path)
+    assert 'KEY' not in repr(loaded.rpc)
+
+    replay = ReplayProvider(loaded)
+    # Responses come back in order, then the last one repeats
+    assert [replay.make_request('eth_blockNumber', []) for _ in range(3)] == recorded + recorded[-1:]
+    assert ReplayProvider(loaded, 'polygon-rpc.com').make_request('eth_blockNumber', []) == recorded_polygon
+    assert ReplayEtherscan(loaded).get_contract_abi('0xfac') == abi
+    assert text_to_page(loaded.pages['https://www.coingecko.com/en']) == b'<html>\xff</html>'
+
+    with pytest.raises(ReplayMissError):
+        replay.make_request('eth_call', [{'to': '0xfac'}, 'latest'])
+    with pytest.raises(ReplayMissError):
+        ReplayEtherscan(loaded).get_contract_abi('0xother')
+
+
+def test_bundle_version_is_checked(tmp_path):
+    path = str(tmp_path / 'old.json.gz')
+    with gzip.open(path, 'wt') as file:
+        json.dump({'version': 0}, file)
+    with pytest.raises(ValueError):
+        Bundle.load(path)
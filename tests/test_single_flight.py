@@ -0,0 +1,66 @@
+import threading
+from time import sleep
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run_concurrently(flights, key, function, n):
+    '''Starts n calls of flights.do(key, function) while the first one runs.'''
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flights.do(key, function))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    release = threading.Event()
+    executions = []
+
+    def prepare():
+        executions.append(1)
+        release.wait(5)
+        return 'payload'
+
+    threads, results, _ = run_concurrently(flights, ('read', 'loans.png'), prepare, 5)
+    while flights.calls < 5:
+        sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(executions) == 1
+    assert sorted(results) == [('payload', False)] + [('payload', True)] * 4
+    assert flights.stats() == {'calls': 5, 'executions': 1, 'coalesced': 4, 'percent_saved': 80.0}
+
+
+def test_errors_are_shared_and_not_kept():
+    flights = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise IOError('upload failed')
+
+    threads, results, errors = run_concurrently(flights, 'upload', fail, 3)
+    while flights.calls < 3:
+        sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [] and len(errors) == 3
+    # The next call runs again
+    assert flights.do('upload', lambda: 'ok') == ('ok', False)
+    with pytest.raises(ValueError):
+        flights.do('other', lambda: int('x'))
@@ -0,0 +1,41 @@
+import pytest
+
+from telemetry import Counter, Histogram, Registry, write_textfile
+
+
+def test_prometheus_exposition(tmp_path):
+    registry = Registry()
+    requests = Counter('bot_requests', 'Requests by command.', ['command'], registry=registry)
+    seconds = Histogram('bot_seconds', 'Handler latency.', ['command'], buckets=(0.5, 0.1), registry=registry)
+
+    requests.inc('/loans')
+    requests.inc('/loans', amount=2)
+    requests.inc('say "hi"\n')
+    seconds.observe(0.05, '/loans')
+    seconds.observe(0.3, '/loans')
+    seconds.observe(2, '/loans')
+
+    assert registry.expose() == '\n'.join([
+        '# HELP bot_requests Requests by command.',
+        '# TYPE bot_requests counter',
+        'bot_requests_total{command="/loans"} 3',
+        'bot_requests_total{command="say \\"hi\\"\\n"} 1',
+        '# HELP bot_seconds Handler latency.',
+        '# TYPE bot_seconds histogram',
+        'bot_seconds_bucket{command="/loans",le="0.1"} 1',
+        'bot_seconds_bucket{command="/loans",le="0.5"} 2',
+        'bot_seconds_bucket{command="/loans",le="+Inf"} 3',
+        'bot_seconds_sum{command="/loans"} 2.35',
+        'bot_seconds_count{command="/loans"} 3',
+        ]) + '\n'
+
+    path = str(tmp_path / 'statsbot.prom')
+    write_textfile(path, registry)
+    assert open(path).read() == registry.expose()
+
+
+def test_labels_must_match():
+    counter = Counter('errors', 'Errors.', ['function'], registry=Registry())
+    with pytest.raises(ValueError):
+        counter.inc()
+    assert counter.value('scrape') == 0
@@ -0,0 +1,67 @@
+from timeseries_store import DAY, TimeSeriesStore, bucket_start
+
+
+def loan(status=0, balance=100, ts_repaid=0):
+    return {'loan_status': status, 'collateral_balance': balance, 'ts_repaid': ts_repaid, 'principal': 10**21}
+
+
+def test_loans_at_round_trip_across_checkpoint(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'store.db'))
+    books = [
+        {'0xa': loan(), '0xb': loan()},
+        {'0xa': loan(balance=90), '0xb': loan()},
+        {'0xa': loan(status=1, balance=0, ts_repaid=1700), '0xb': loan(), '0xc': loan()},   # checkpoint
+        {'0xa': loan(status=1, balance=0, ts_repaid=1700), '0xc': loan(status=2)},          # 0xb removed
+        {'0xa': loan(status=1, balance=0, ts_repaid=1700), '0xc': loan(status=2)},
+        ]
+
+    run_ids = [store.record_loan_run(book, ts=1000 + i, checkpoint_every=2) for i, book in enumerate(books)]
+
+    assert [checkpoint for _, _, checkpoint in store.loan_runs()] == [1, 0, 1, 0, 1]
+    for run_id, book in zip(run_ids, books):
+        assert store.loans_at(run_id) == book
+    assert store.loans_at(ts=1003) == books[3]
+    assert store.loans_at(ts=999) == {}
+    assert store.loans_at() == books[-1]
+
+
+def test_record_loan_run_stores_only_changes(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'store.db'))
+    store.record_loan_run({'0xa': loan(), '0xb': loan()}, ts=1000)
+    run_id = store.record_loan_run({'0xa': loan(balance=90)}, ts=1001)
+
+    with store._connect() as con:
+        changes = con.execute(
+            'SELECT loan, field, value FROM loan_changes WHERE run_id = ? ORDER BY loan, field', (run_id,)).fetchall()
+        state_loans = {row[0] for row in con.execute('SELECT loan FROM loan_state')}
+
+    assert changes == [('0xa', 'collateral_balance', '90')] + [
+        ('0xb', field, None) for field in sorted(loan())]
+    assert state_loans == {'0xa'}
+
+
+def test_rollups_upsert(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'store.db'))
+    day = 20000 * DAY
+    for ts, tvl in [(day + 100, 5.0), (day + 50, 3.0), (day + 200, 4.0), (day + DAY, 7.0)]:
+        store.append({'total_collateral_in_use_USD': tvl}, ts=ts)
+
+    rollups = store.read_rollups('total_collateral_in_use_USD', period='day')
+    assert rollups == [
+        {'bucket': day, 'min': 3.0, 'max': 5.0, 'last': 4.0, 'mean': 4.0, 'count': 3},
+        {'bucket': day + DAY, 'min': 7.0, 'max': 7.0, 'last': 7.0, 'mean': 7.0, 'count': 1},
+        ]
+
+    # Replacing a row recomputes its buckets
+    store.append({'total_collateral_in_use_USD': 10.0}, ts=day + 200)
+    week = store.read_rollups('total_collateral_in_use_USD', period='week')
+    assert week[0]['bucket'] == bucket_start(day, 'week')
+    assert (week[0]['max'], week[0]['count']) == (10.0, 4)
+
+
+def test_terminal_loans_missing_from_run_are_kept(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'store.db'))
+    store.record_loan_run({'0xa': loan(status=1), '0xb': loan()}, ts=1000, checkpoint_every=10)
+    store.record_loan_run({}, ts=1001, checkpoint_every=10)
+
+    assert store.loans_at() == {'0xa': loan(status=1)}
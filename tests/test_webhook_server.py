@@ -0,0 +1,50 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from queue import Queue
+from types import SimpleNamespace
+
+import pytest
+
+from webhook_server import SECRET_HEADER, WebhookServer
+
+
+@pytest.fixture
+def server():
+    dispatcher = SimpleNamespace(bot=None, update_queue=Queue())
+    server = WebhookServer('127.0.0.1', 0, '/telegram', 'secret', dispatcher)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(server, body, secret='secret', path='/telegram'):
+    url = f'http://127.0.0.1:{server.server_address[1]}{path}'
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json', SECRET_HEADER: secret})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+UPDATE = json.dumps({'update_id': 1}).encode()
+
+
+def test_update_is_queued(server):
+    assert post(server, UPDATE) == 200
+    assert server.dispatcher.update_queue.qsize() == 1
+
+
+def test_bad_secret_is_rejected(server):
+    assert post(server, UPDATE, secret='wrong') == 403
+    assert post(server, UPDATE, secret='') == 403
+    assert post(server, UPDATE, path='/other') == 404
+    assert server.dispatcher.update_queue.empty()
+
+
+def test_malformed_update_is_rejected(server):
+    assert post(server, b'{"update_id": ') == 400
+    assert server.dispatcher.update_queue.empty()
@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Append-only time-series store for loan metrics (SQLite).
+
+Rows are keyed by unix timestamp, so range reads use the primary key index.
+Daily and weekly rollups (min, max, last, mean) of every metric are updated
+incrementally with each appended row, so history queries don't scan raw rows.
+Per-loan state is stored delta-encoded: each run only adds the fields that
+changed since the previous run, plus a full checkpoint every few runs.
+The database schema is versioned (PRAGMA user_version) and migrated on open.
+Both legacy csv files can be imported, and csv can be exported on demand.
+
+    python timeseries_store.py migrate                 # import legacy csv files
+    python timeseries_store.py export out.csv          # export all rows to csv
+"""
+import calendar
+import csv
+import json
+import os
+import sqlite3
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from time import time
+
+
+STORE_FILE = 'yield_stats.db'
+
+# Legacy csv files, imported once when a new store is created
+LEGACY_CSVS = ['stats_v1.csv', 'yield_stats_v1.csv']
+
+# Metrics as returned by export_loan_metrics_dict() (without 'time')
+METRIC_FIELDS = [
+    'YLD_total_supply',
+    'YLD_minted_burned',
+    'total_loans',
+    'active_loans',
+    'repaid_loans',
+    'defauted_loans',
+    'percent_defauted',
+    'total_collateral_in_use_USD',
+    'total_borrowed_USD',
+    'avg_loan_val_USD',
+    'avg_interest_rate',
+    'avg_loan_duration_days'
+    ]
+
+# Format of the 'time' column of yield_stats_v1.csv
+TIME_FORMAT = '%d %b %Y - %H:%M UTC'
+
+# Schema versions of imported rows
+#   1   stats_v1.csv (daily, fewer metrics)
+#   2   yield_stats_v1.csv / export_loan_metrics_dict()
+SOURCE_SCHEMA_STATS_V1 = 1
+SOURCE_SCHEMA_CURRENT = 2
+
+# Column names of stats_v1.csv mapped to METRIC_FIELDS
+STATS_V1_COLUMNS = {
+    'TVL': 'total_collateral_in_use_USD',
+    'total_borrowed': 'total_borrowed_USD',
+    'avg_loan_val': 'avg_loan_val_USD',
+    'avg_interest_rate': 'avg_interest_rate',
+    'avg_loan_duration': 'avg_loan_duration_days',
+    'YLD_total_supply': 'YLD_total_supply',
+    'YLD_minted_burned': 'YLD_minted_burned'
+    }
+
+# Every n-th loan run stores the full state of all loans
+LOAN_CHECKPOINT_EVERY = 50
+
+# Rollup periods and their bucket length in seconds
+DAY = 24 * 3600
+WEEK = 7 * DAY
+ROLLUP_PERIODS = {'day': DAY, 'week': WEEK}
+
+ROLLUP_UPSERT = '''
+    INSERT INTO rollups (period, metric, bucket, min, max, last, last_ts, sum, count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (period, metric, bucket) DO UPDATE SET
+        min = MIN(min, excluded.min),
+        max = MAX(max, excluded.max),
+        last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.last ELSE last END,
+        last_ts = MAX(last_ts, excluded.last_ts),
+        sum = sum + excluded.sum,
+        count = count + 1
+    '''
+
+
+# Helper function: Returns the start of the rollup bucket (day or week) containing ts
+def bucket_start(ts, period):
+    if period == 'day':
+        return ts - ts % DAY
+
+    # Weeks start on Monday (1970-01-01 was a Thursday)
+    return ts - (ts + 3 * DAY) % WEEK
+
+# Helper function: Adds one snapshot to the rollups it falls into
+def update_rollups(con, ts, metrics):
+    rows = [
+        (period, field, bucket_start(ts, period), value, value, value, ts, value)
+        for period in ROLLUP_PERIODS
+        for field in METRIC_FIELDS
+        for value in [metrics.get(field)] if value is not None
+        ]
+    con.executemany(ROLLUP_UPSERT, rows)
+
+# Helper function: Recomputes the rollups for rows with start <= ts < end
+def rebuild_rollups(con, start=0, end=2**62):
+    con.execute('DELETE FROM rollups WHERE bucket >= ? AND bucket < ?', (start, end))
+    query = f"SELECT ts, {', '.join(METRIC_FIELDS)} FROM snapshots WHERE ts >= ? AND ts < ? ORDER BY ts"
+    for row in con.execute(query, (start, end)).fetchall():
+        update_rollups(con, row[0], dict(zip(METRIC_FIELDS, row[1:])))
+
+# Migration to schema version 2: Adds rollups and fills them from existing rows
+def migrate_add_rollups(con):
+    con.execute('''
+        CREATE TABLE rollups (
+            period TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            min NUMERIC,
+            max NUMERIC,
+            last NUMERIC,
+            last_ts INTEGER,
+            sum NUMERIC,
+            count INTEGER,
+            PRIMARY KEY (period, metric, bucket)
+        )
+        ''')
+    rebuild_rollups(con)
+
+
+# Database migrations. Entry i brings the schema from version i to i+1.
+# Entries are either SQL scripts or functions taking a connection.
+MIGRATIONS = [
+    f'''
+    CREATE TABLE snapshots (
+        ts INTEGER PRIMARY KEY,
+        source_schema INTEGER NOT NULL,
+        {', '.join(f'{field} NUMERIC' for field in METRIC_FIELDS)}
+    );
+    ''',
+    migrate_add_rollups,
+    '''
+    CREATE TABLE loan_runs (
+        run_id INTEGER PRIMARY KEY,
+        ts INTEGER NOT NULL,
+        checkpoint INTEGER NOT NULL
+    );
+    CREATE INDEX loan_runs_ts ON loan_runs (ts);
+    CREATE TABLE loan_changes (
+        run_id INTEGER NOT NULL,
+        loan TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (run_id, loan, field)
+    );
+    CREATE TABLE loan_state (
+        loan TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (loan, field)
+    );
+    ''',
+    '''
+    CREATE INDEX loan_state_active ON loan_state (loan) WHERE field = 'loan_status' AND value = '0';
+    ''',
+    ]
+
+
+# Helper function: Converts a unix timestamp to the display string used in csv files
+def ts_to_time_str(ts):
+    return datetime.utcfromtimestamp(ts).strftime(TIME_FORMAT)
+
+# Helper function: Converts a display time string back to a unix timestamp
+def time_str_to_ts(time_str, fmt=TIME_FORMAT):
+    return calendar.timegm(datetime.strptime(time_str.strip(), fmt).timetuple())
+
+# Helper function: Converts a csv cell to a number (None if empty)
+def to_number(value):
+    if value is None or value.strip() == '':
+        return None
+    return float(value)
+
+
+# Helper function: Writes whole numbers without decimals (as pandas did for int columns)
+def format_number(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+class TimeSeriesStore:
+    """
+    Append-only store of metrics snapshots.
+    Every method opens its own connection, so a store can be shared by threads.
+    """
+
+    def __init__(self, path=STORE_FILE):
+        self.path = path
+        with self._connect() as con:
+            self._migrate(con)
+
+
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+
+    def _migrate(self, con):
+        version = con.execute('PRAGMA user_version').fetchone()[0]
+        for i, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            if callable(step):
+                step(con)
+            else:
+                con.executescript(step)
+            con.execute(f'PRAGMA user_version = {i}')
+
+
+    def append(self, metrics, ts=None, source_schema=SOURCE_SCHEMA_CURRENT, replace=True):
+        '''
+        Appends a metrics dict (as returned by export_loan_metrics_dict()) as
+        new row. ts defaults to now. Missing metrics are stored as NULL.
+        '''
+        ts = int(time()) if ts is None else int(ts)
+        with self._connect() as con:
+            self._insert(con, ts, metrics, source_schema, replace)
+        return ts
+
+
+    def _insert(self, con, ts, metrics, source_schema, replace):
+        exists = con.execute('SELECT 1 FROM snapshots WHERE ts = ?', (ts,)).fetchone()
+        if exists and not replace:
+            return
+
+        values = [metrics.get(field) for field in METRIC_FIELDS]
+        columns = ', '.join(['ts', 'source_schema'] + METRIC_FIELDS)
+        placeholders = ', '.join('?' * (len(METRIC_FIELDS) + 2))
+        con.execute(
+            f'INSERT OR REPLACE INTO snapshots ({columns}) VALUES ({placeholders})',
+            [ts, source_schema] + values
+            )
+
+        # Possibility: An existing row was replaced. Recompute its buckets.
+        if exists:
+            start = bucket_start(ts, 'week')
+            rebuild_rollups(con, start, start + WEEK)
+        else:
+            update_rollups(con, ts, metrics)
+
+
+    def read_range(self, start=None, end=None, fields=None):
+        '''
+        Returns rows with start <= ts <= end as list of dicts (ts ascending).
+        fields limits the returned metrics (default: all).
+        '''
+        fields = fields or METRIC_FIELDS
+        unknown = set(fields) - set(METRIC_FIELDS)
+        if unknown:
+            raise ValueError(f'Unknown metrics: {unknown}')
+
+        query = f"SELECT ts, {', '.join(fields)} FROM snapshots WHERE ts BETWEEN ? AND ? ORDER BY ts"
+        start = 0 if start is None else int(start)
+        end = 2**62 if end is None else int(end)
+
+        with self._connect() as con:
+            rows = con.execute(query, (start, end)).fetchall()
+
+        return [dict(zip(['ts'] + fields, row)) for row in rows]
+
+
+    def read_rollups(self, metric, period='day', start=None, end=None):
+        '''
+        Returns the daily or weekly rollups of metric for buckets starting
+        between start and end as list of dicts (bucket ascending) with
+        keys 'bucket', 'min', 'max', 'last', 'mean' and 'count'.
+        '''
+        if metric not in METRIC_FIELDS:
+            raise ValueError(f'Unknown metric: {metric}')
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f'Unknown period: {period}')
+
+        start = 0 if start is None else bucket_start(int(start), period)
+        end = 2**62 if end is None else int(end)
+        query = '''
+            SELECT bucket, min, max, last, sum * 1.0 / count, count FROM rollups
+            WHERE period = ? AND metric = ? AND bucket BETWEEN ? AND ?
+            ORDER BY bucket
+            '''
+        with self._connect() as con:
+            rows = con.execute(query, (period, metric, start, end)).fetchall()
+
+        keys = ['bucket', 'min', 'max', 'last', 'mean', 'count']
+        return [dict(zip(keys, row)) for row in rows]
+
+
+    def latest(self):
+        '''
+        Returns the newest row in the format of export_loan_metrics_dict()
+        (with 'time' as display string), or {} if the store is empty.
+        '''
+        query = f"SELECT ts, {', '.join(METRIC_FIELDS)} FROM snapshots ORDER BY ts DESC LIMIT 1"
+        with self._connect() as con:
+            row = con.execute(query).fetchone()
+
+        if not row:
+            return {}
+
+        d = {'time': ts_to_time_str(row[0])}
+        d.update(zip(METRIC_FIELDS, row[1:]))
+        return d
+
+
+    def import_csv(self, csv_file):
+        '''
+        Imports a legacy csv file (stats_v1.csv or yield_stats_v1.csv format).
+        Rows already in the store are kept. Returns the number of rows read.
+        '''
+        with open(csv_file, newline='') as file:
+            reader = csv.DictReader(file)
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+
+            # Possibility: stats_v1.csv (one row per day, different column names)
+            if 'date' in reader.fieldnames:
+                source_schema = SOURCE_SCHEMA_STATS_V1
+                rows = [
+                    (time_str_to_ts(row['date'], '%Y-%m-%d'),
+                     {STATS_V1_COLUMNS[k]: to_number(v) for k, v in row.items() if k in STATS_V1_COLUMNS})
+                    for row in reader
+                    ]
+
+            # Possibility: yield_stats_v1.csv (format of export_loan_metrics_dict())
+            else:
+                source_schema = SOURCE_SCHEMA_CURRENT
+                rows = [
+                    (time_str_to_ts(row['time']),
+                     {k: to_number(v) for k, v in row.items() if k in METRIC_FIELDS})
+                    for row in reader
+                    ]
+
+        with self._connect() as con:
+            for ts, metrics in rows:
+                self._insert(con, ts, metrics, source_schema, replace=False)
+
+        return len(rows)
+
+
+    def record_loan_run(self, loans_data, ts=None, checkpoint_every=LOAN_CHECKPOINT_EVERY):
+        '''
+        Stores the state of all loans (as in ALL_LOANS_DATA) for one run.
+        Only fields that changed since the previous run are written, except
+        for every checkpoint_every-th run, which stores all fields.
+        Only active loans (loan_status 0) are looked for among the loans
+        missing from a run: repaid and defaulted loans never leave
+        LoanFactory.sol's getLoans(), so their stored state is kept.
+        Returns the run id.
+        '''
+        ts = int(time()) if ts is None else int(ts)
+        new_state = {
+            (loan, field): json.dumps(value)
+            for loan, data in loans_data.items()
+            for field, value in data.items()
+            }
+
+        with self._connect() as con:
+            # Only the state of the loans in this run is read
+            con.execute('CREATE TEMP TABLE run_loans (loan TEXT PRIMARY KEY)')
+            con.executemany('INSERT INTO run_loans (loan) VALUES (?)', ((loan,) for loan in loans_data))
+            old_state = {(loan, field): value for loan, field, value in con.execute(
+                'SELECT loan, field, value FROM loan_state JOIN run_loans USING (loan)')}
+            # Active loans are found by the partial index loan_state_active, without reading all states
+            gone = con.execute('''
+                SELECT loan, field FROM loan_state WHERE loan IN (
+                    SELECT loan FROM loan_state WHERE field = 'loan_status' AND value = '0'
+                    AND loan NOT IN (SELECT loan FROM run_loans))
+                ''').fetchall()
+
+            last_checkpoint = con.execute(
+                'SELECT MAX(run_id) FROM loan_runs WHERE checkpoint = 1').fetchone()[0]
+            last_run = con.execute('SELECT MAX(run_id) FROM loan_runs').fetchone()[0]
+
+            checkpoint = last_checkpoint is None or last_run - last_checkpoint + 1 >= checkpoint_every
+
+            changed = {key: value for key, value in new_state.items() if old_state.get(key) != value}
+
+            # Fields and loans that disappeared are stored as NULL
+            removed = {key: None for key in old_state.keys() - new_state.keys()}
+            removed.update((key, None) for key in gone)
+
+            run_id = con.execute(
+                'INSERT INTO loan_runs (ts, checkpoint) VALUES (?, ?)', (ts, int(checkpoint))
+                ).lastrowid
+
+            changes = new_state if checkpoint else {**changed, **removed}
+            con.executemany(
+                'INSERT INTO loan_changes (run_id, loan, field, value) VALUES (?, ?, ?, ?)',
+                [(run_id, loan, field, value) for (loan, field), value in changes.items()]
+                )
+
+            con.executemany(
+                'INSERT OR REPLACE INTO loan_state (loan, field, value) VALUES (?, ?, ?)',
+                [(loan, field, value) for (loan, field), value in changed.items()]
+                )
+            con.executemany(
+                'DELETE FROM loan_state WHERE loan = ? AND field = ?', list(removed)
+                )
+
+        return run_id
+
+
+    def loan_runs(self, start=None, end=None):
+        '''
+        Returns (run_id, ts, checkpoint) of all loan runs with start <= ts <= end.
+        '''
+        start = 0 if start is None else int(start)
+        end = 2**62 if end is None else int(end)
+        with self._connect() as con:
+            return con.execute(
+                'SELECT run_id, ts, checkpoint FROM loan_runs WHERE ts BETWEEN ? AND ? ORDER BY run_id',
+                (start, end)
+                ).fetchall()
+
+
+    def loans_at(self, run_id=None, ts=None):
+        '''
+        Reconstructs the loan book (same format as ALL_LOANS_DATA) as of a run.
+        Takes a run id, or the latest run at or before ts (default: latest run).
+        Only the nearest checkpoint and the changes after it are read.
+        '''
+        with self._connect() as con:
+            if run_id is None:
+                ts = 2**62 if ts is None else int(ts)
+                run_id = con.execute(
+                    'SELECT MAX(run_id) FROM loan_runs WHERE ts <= ?', (ts,)).fetchone()[0]
+                if run_id is None:
+                    return {}
+
+            checkpoint = con.execute(
+                'SELECT MAX(run_id) FROM loan_runs WHERE checkpoint = 1 AND run_id <= ?',
+                (run_id,)).fetchone()[0]
+            if checkpoint is None:
+                return {}
+
+            rows = con.execute(
+                '''SELECT loan, field, value FROM loan_changes
+                   WHERE run_id BETWEEN ? AND ? ORDER BY run_id''',
+                (checkpoint, run_id)).fetchall()
+
+        loans = {}
+        for loan, field, value in rows:
+            if value is None:
+                loans.get(loan, {}).pop(field, None)
+            else:
+                loans.setdefault(loan, {})[field] = json.loads(value)
+
+        return {loan: data for loan, data in loans.items() if data}
+
+
+    def export_csv(self, csv_file, start=None, end=None):
+        '''
+        Writes rows with start <= ts <= end to csv_file in the format of
+        yield_stats_v1.csv. Returns the number of rows written.
+        '''
+        rows = self.read_range(start, end)
+
+        with open(csv_file, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['time'] + METRIC_FIELDS)
+            for row in rows:
+                values = ['' if row[f] is None else format_number(row[f]) for f in METRIC_FIELDS]
+                writer.writerow([ts_to_time_str(row['ts'])] + values)
+
+        return len(rows)
+
+
+# Opens the store, importing the legacy csv files if it doesn't exist yet
+def open_store(path=STORE_FILE, legacy_csvs=LEGACY_CSVS, verbose=False):
+    is_new = not os.path.exists(path)
+    store = TimeSeriesStore(path)
+
+    if is_new:
+        for csv_file in legacy_csvs:
+            if os.path.exists(csv_file):
+                n = store.import_csv(csv_file)
+                if verbose:
+                    print(f'Imported {n} rows from {csv_file} into {path}.')
+
+    return store
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+
+    if command == 'migrate':
+        store = TimeSeriesStore()
+        for csv_file in sys.argv[2:] or LEGACY_CSVS:
+            print(f'Imported {store.import_csv(csv_file)} rows from {csv_file}.')
+
+    elif command == 'export':
+        out = sys.argv[2] if len(sys.argv) > 2 else 'yield_stats_export.csv'
+        print(f'Exported {TimeSeriesStore().export_csv(out)} rows to {out}.')
+
+    else:
+        print(__doc__)
@@ -2,35 +2,34 @@
 # -*- coding: utf-8 -*-
 
 """
-Script to update a csv file and loans.png with current metrics.
+Script to update the metrics store and loans.png with current metrics.
 Assumed to be scheduled to run multiple times a day.
-"""
 
-print('\n' + '='*60)
-print('\nScript started. Reading loan data from the Ethereum blockchain...')
+Runs the stages of build_update_pipeline(), independent ones in parallel.
+A single stage can be re-run from the cached outputs of the last run:
+
+    python update.py --stage render
 
-import os
-import pandas
-from data_aggregation import (
-    reset_scraped_prices,
-    export_loan_metrics_dict,
-    safe_getter,
-    append_to_csv
-    )
-from image_manipulation import update_loan_stats
+Prices change by the minute, the loan book only a few times a day. A fast
+price-only update reuses the loan book of the latest full update in the
+store and only fetches prices, i.e. scheduled every few minutes:
 
-# Define csv file to append data to
-metrics_csv = 'yield_stats_v1.csv'
+    python update.py --mode prices
 
-# Clear price memory to get current token prices
-print('Resetting price data stored in memory...')
-reset_scraped_prices(verbose=True)
+All external data of a run can be recorded to a bundle and replayed
+offline, i.e. for reproducible profiling (see replay.py):
 
+    python update.py --record run.json.gz
+    python update.py --replay run.json.gz --store replay.db --image replay.png
+"""
+import argparse
 
+import replay
+import telemetry as tm
+from deployments import DEPLOYMENTS_FILE, load_deployments
+from pipeline import build_update_pipeline
+from timeseries_store import STORE_FILE
 
-# Read token data from Ethereum blockchain, scrape price data from web
-print('Scraping price data to get aggregated loan statistics...')
-metrics = safe_getter(export_loan_metrics_dict)
 
 # Helper function for table-style plotting
 def prettyprint(dict_):
@@ -39,16 +38,68 @@ def prettyprint(dict_):
     for k,v in dict_.items():
         print("{:35} | {:<20}".format(k,v))
 
-# Print sample
-print('\nLoan metrics updated. Data from export_loan_metrics_dict():')
-prettyprint(metrics)
 
-# Save to csv file. Only add header if no csv file exists yet.
-print(f'\nAppending data to {metrics_csv}...')
-append_to_csv(metrics_csv, metrics, verbose=False)
-print(f'{metrics_csv} has been updated successfully.')
+parser = argparse.ArgumentParser(description='Update loan metrics and loans.png.')
+parser.add_argument('--stage', help='re-run only this stage from cached inputs')
+parser.add_argument('--metrics-textfile', help='write run metrics to this file (Prometheus text format)')
+parser.add_argument('--record', metavar='FILE', help='record all RPC responses, ABIs and pages to this bundle')
+parser.add_argument('--replay', metavar='FILE', help='run offline from a recorded bundle')
+parser.add_argument('--store', default=STORE_FILE, help=f'metrics store to update (default: {STORE_FILE})')
+parser.add_argument('--image', default='loans.png', help='infographic to update (default: loans.png)')
+parser.add_argument('--prices', choices=['coingecko', 'dex'], default='coingecko',
+                    help='price source: scrape CoinGecko or read Uniswap V2 reserves (default: coingecko)')
+parser.add_argument('--mode', choices=['full', 'prices'], default='full',
+                    help='full: read loans from the chain, prices: reuse the stored loan book (default: full)')
+parser.add_argument('--deployments', default=DEPLOYMENTS_FILE,
+                    help=f'LoanFactory deployments to track (default: {DEPLOYMENTS_FILE} if it exists)')
+args = parser.parse_args()
+
+print('\n' + '='*60)
+if args.replay:
+    print(f'\nReplaying {replay.install_replayer(args.replay)} from {args.replay}.')
+elif args.record:
+    bundle = replay.install_recorder()
+
+deployments = load_deployments(args.deployments)
+pipeline = build_update_pipeline(store_file=args.store, outfile=args.image, verbose=True,
+                                 deployments=deployments, price_source=args.prices, mode=args.mode)
+
+if args.stage:
+    print(f'\nRe-running stage {args.stage} from cached inputs...')
+    result = pipeline.run_stage(args.stage)
+    if isinstance(result, dict) and args.stage == 'metrics':
+        prettyprint(result)
+
+else:
+    # Read token data from Ethereum blockchain, scrape price data from web
+    if args.mode == 'prices':
+        print(f'\nScript started. Re-pricing the latest loan book in {args.store}...')
+    else:
+        print('\nScript started. Reading loan data from the Ethereum blockchain...')
+    results = pipeline.run()
+
+    # Print sample
+    print('\nLoan metrics updated. Data from export_loan_metrics_dict():')
+    prettyprint(results['metrics'])
+    for name, metrics in results.get('deployment_metrics', {}).items():
+        print(f'\nDeployment {name}:')
+        prettyprint(metrics)
+    print(f'\n{args.store} and {args.image} have been updated successfully.')
+
+if args.record and not args.replay:
+    bundle.save(args.record)
+    print(f'\nRecorded {bundle} to {args.record}.')
+
+# Print how long each stage took
+print('\n{:^35} | {:^6}'.format('stage', 'seconds'))
+print('-'*65)
+for name, seconds in pipeline.timings.items():
+    print("{:35} | {:<20.2f}".format(name, seconds))
+if not args.stage:
+    print("{:35} | {:<20.2f}".format('(critical path)', pipeline.critical_path_time()))
 
-# Update loans.png with the aggregated loan metrics
-update_loan_stats(metrics, 'loans.png', 'loans_template.png', verbose=True)
+# Save counters and timings of this run, i.e. for node_exporter's textfile collector
+if args.metrics_textfile:
+    tm.write_textfile(args.metrics_textfile)
 
 # Add supply plot to loans.png
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Embedded HTTP server that receives Telegram updates via webhook and hands
+them to the dispatcher of MerchBot.
+
+Can also be run directly to post a recorded Update JSON to a running server:
+
+    python webhook_server.py http://localhost:8443/telegram update.json SECRET
+"""
+import hmac
+import json
+import logging
+import sys
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+
+# Header Telegram uses to send the secret token configured with set_webhook()
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server that validates the secret token of each request
+    and puts the decoded update on the dispatcher's update queue.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, listen, port, url_path, secret, dispatcher):
+        self.url_path = url_path
+        self.secret = secret
+        self.dispatcher = dispatcher
+        super().__init__((listen, port), WebhookHandler)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Request handler accepting POSTed Update JSON on the configured path.
+    """
+
+    def do_POST(self):
+        server = self.server
+
+        if self.path != server.url_path:
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        # Reject requests that don't carry the configured secret token
+        token = self.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(token.encode(), server.secret.encode()):
+            self.send_response(403)
+            self.end_headers()
+            logging.warning(f'Rejected webhook request from {self.client_address[0]}: bad secret.')
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length))
+            update = Update.de_json(data, server.dispatcher.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            self.send_response(400)
+            self.end_headers()
+            logging.warning(f'Received malformed update via webhook ({e}).')
+            return
+
+        # Answer right away, the dispatcher processes the update asynchronously
+        server.dispatcher.update_queue.put(update)
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug('webhook: ' + format % args)
+
+
+# Posts a recorded Update JSON file to a running webhook server (local testing)
+def post_update(url, json_file, secret):
+    '''
+    Reads an Update JSON from json_file and posts it to url with the
+    secret token header set. Returns the HTTP status code.
+    '''
+    with open(json_file, 'rb') as file:
+        body = file.read()
+
+    req = urllib.request.Request(
+        url,
+        data=body,
+        headers={'Content-Type': 'application/json', SECRET_HEADER: secret}
+        )
+    try:
+        with urllib.request.urlopen(req) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+if __name__ == "__main__":
+    url, json_file, secret = sys.argv[1:4]
+    print(post_update(url, json_file, secret))